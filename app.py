@@ -1,65 +1,20 @@
-import streamlit as st
-import sqlite3
-import pandas as pd
+import csv
+import io
 import os
+import re
 
-DB_PATH = "data/questions.db"
-PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(PROJECT_ROOT, "data", "questions.db")
+import streamlit as st
 
+from quizmaker import (
+    admission, bulk_io, catalog, db, editing, grading, leaderboard, maintenance, migrations,
+    picker, pools, profiling, score_writer, snapshots, text_answers,
+)
 
-# Initialize database and tables
-def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Questions table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS questions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            text TEXT,
-            type TEXT,
-            choices TEXT,
-            correct TEXT,
-            points INTEGER,
-            tags TEXT
-        )
-    """)
-
-    # Scores table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS scores (
-            user TEXT,
-            score INTEGER,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # Tests table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS tests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            description TEXT,
-            tags TEXT
-        )
-    """)
-
-    # Link table between tests and questions
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS test_questions (
-            test_id INTEGER,
-            question_id INTEGER,
-            position INTEGER,
-            PRIMARY KEY (test_id, question_id),
-            FOREIGN KEY(test_id) REFERENCES tests(id),
-            FOREIGN KEY(question_id) REFERENCES questions(id)
-        )
-    """)
 
-    conn.commit()
-    conn.close()
+# Initialize database and tables (once per process and database file)
+def init_db():
+    migrations.ensure_schema()
+    maintenance.ensure_scheduler()
 
 def add_question_page():
     st.header("➕ Добавить новый вопрос")
@@ -76,43 +31,42 @@ def add_question_page():
         else:
             correct = st.multiselect("Правильные ответы", choices)
     else:
-        correct = st.text_input("Правильный текстовый ответ")
+        raw = st.text_area("Правильные ответы (каждый допустимый вариант с новой строки)")
+        correct = [c.strip() for c in raw.splitlines() if c.strip()]
+        rules = answer_rules_form()
 
     if st.button("Сохранить вопрос"):
-        
-        if not text:
-            st.error("Введите текст вопроса.")
-            return
-
         if qtype in ["Один ответ", "Множественный выбор"]:
-            if not choices:
-                st.error("Добавьте хотя бы один вариант.")
-                return
-            
             corr_list = correct if isinstance(correct, list) else [correct]
-            if not corr_list or any(not c for c in corr_list):
-                st.error("Выберите правильный(ые) ответ(ы).")
-                return
-
-            choices_str = "|".join(choices)
-            correct_str = "|".join(corr_list)
+            rules = None
         else:
-            if not correct:
-                st.error("Введите текстовый ответ.")
-                return
-            choices_str = ""
-            correct_str = correct
+            choices = []
+            corr_list = correct
 
+        try:
+            editing.create_question(text, qtype, choices, corr_list, points, tags, rules)
+        except ValueError as exc:
+            st.error(str(exc))
+            return
+        st.success("Вопрос сохранён!")
 
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO questions (text,type,choices,correct,points,tags) VALUES (?,?,?,?,?,?)",
-            (text, qtype, choices_str, correct_str, points, tags)
+
+def answer_rules_form():
+    """Matching rules of a text question (see quizmaker.text_answers)."""
+    with st.expander("Правила проверки ответа"):
+        st.caption("Лишние пробелы, «ё» и Unicode-варианты символов не учитываются.")
+        case_sensitive = st.checkbox("Учитывать регистр")
+        ignore_punctuation = st.checkbox("Игнорировать знаки препинания", value=True)
+        max_distance = st.number_input(
+            "Допустимое число опечаток", min_value=0, max_value=text_answers.MAX_DISTANCE, value=0
         )
-        conn.commit()
-        conn.close()
-        st.success("Вопрос сохранён!")
+        raw = st.text_area("Регулярные выражения (каждое с новой строки)")
+    return {
+        "case_sensitive": case_sensitive,
+        "ignore_punctuation": ignore_punctuation,
+        "max_distance": int(max_distance),
+        "patterns": [p.strip() for p in raw.splitlines() if p.strip()],
+    }
 
 # ---------------------------------
 # Page: Create a new test (wizard)
@@ -162,13 +116,7 @@ def create_test_wizard_page():
 
     # Left: existing questions multiselect
     with col1:
-        qs = pd.read_sql("SELECT id,text FROM questions", sqlite3.connect(DB_PATH))
-        picked = st.multiselect(
-            "Ваши вопросы",
-            options=qs["id"],
-            format_func=lambda i: qs.set_index("id").at[i, "text"],
-            key="wizard_picked"
-        )
+        picked = picker.question_picker("Ваши вопросы", key="wizard_picked")
         w["questions"] = picked
 
     # Right: form to add a new question inline
@@ -187,32 +135,29 @@ def create_test_wizard_page():
                 else:
                     correct = st.multiselect("Правильные ответы", choices, key="new_qcorrect_multi")
             else:
-                correct = st.text_input("Правильный ответ", key="new_qcorrect_text")
+                raw = st.text_area("Правильные ответы (каждый допустимый вариант с новой строки)",
+                                   key="new_qcorrect_text")
+                correct = [c.strip() for c in raw.splitlines() if c.strip()]
                 choices = []
+                rules = answer_rules_form()
 
             add_q   = st.form_submit_button("Добавить")
             reset_q = st.form_submit_button("Очистить")
 
         if add_q:
-            if not qtext:
-                st.error("❌ Текст вопроса обязателен")
-            elif qtype != "Текстовый ответ" and not choices:
-                st.error("❌ Нужно хотя бы один вариант")
-            elif not correct:
-                st.error("❌ Укажите правильный ответ")
+            # same validation and insert as add_question_page
+            if qtype != "Текстовый ответ":
+                corr_list = correct if isinstance(correct, list) else [correct]
+                rules = None
             else:
-                ch_str   = "|".join(choices)
-                corr_str = "|".join(correct) if isinstance(correct, list) else str(correct)
-                conn     = sqlite3.connect(DB_PATH)
-                cur      = conn.cursor()
-                cur.execute(
-                    "INSERT INTO questions (text,type,choices,correct,points,tags) VALUES (?,?,?,?,?,?)",
-                    (qtext, qtype, ch_str, corr_str, qpoints, qtags)
+                corr_list = correct
+            try:
+                new_id = editing.create_question(
+                    qtext, qtype, choices, corr_list, qpoints, qtags, rules
                 )
-                new_id = cur.lastrowid
-                conn.commit()
-                conn.close()
-
+            except ValueError as exc:
+                st.error(f"❌ {exc}")
+            else:
                 st.success(f"✅ Вопрос ID {new_id} сохранён")
                 w["questions"].append(new_id)
 
@@ -228,23 +173,16 @@ def create_test_wizard_page():
         if not w["questions"]:
             st.error("❌ Добавьте хотя бы один вопрос")
         else:
-            conn = sqlite3.connect(DB_PATH)
-            cur  = conn.cursor()
-            
-            cur.execute(
-                "INSERT INTO tests (name,description,tags) VALUES (?,?,?)",
-                (w["name"], w["desc"], w["tags"])
-            )
-            test_id = cur.lastrowid
-            for idx, qid in enumerate(w["questions"], start=1):
-                cur.execute(
-                    "INSERT INTO test_questions (test_id,question_id,position) VALUES (?,?,?)",
-                    (test_id, qid, idx)
+            try:
+                test_id, added = editing.create_test(
+                    w["name"], w["desc"], w["tags"], w["questions"]
                 )
-            conn.commit()
-            conn.close()
-
+            except ValueError as exc:
+                st.error(f"❌ {exc}")
+                return
             st.success(f"🎉 Тест ID {test_id} успешно создан!")
+            if added < len(w["questions"]):
+                st.warning(f"Удалённые вопросы пропущены: {len(w['questions']) - added}.")
     
             del st.session_state.wizard
 
@@ -253,42 +191,24 @@ def create_test_wizard_page():
 #List all tests
 def list_tests_page():
     st.header("📚 Список тестов")
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql("SELECT * FROM tests", conn)
-    conn.close()
-
-    if df.empty:
+    if catalog.count_tests() == 0:
         st.info("Тестов ещё нет.")
         return
 
-    all_tags = set()
-    for tag_str in df['tags'].fillna("").tolist():
-        for t in tag_str.split(","):
-            t = t.strip()
-            if t:
-                all_tags.add(t)
-    all_tags = sorted(all_tags)
-
     #Filter
-    selected_tags = st.multiselect("Фильтровать по тегам", all_tags)
-    if selected_tags:
-        df = df[df['tags'].fillna("").apply(
-            lambda tag_str: any(t in tag_str.split(",") for t in selected_tags)
-        )]
-
-
+    selected_tags = st.multiselect("Фильтровать по тегам", catalog.load_tags())
     name_query = st.text_input("Поиск по названию")
-    if name_query:
-        df = df[df['name'].str.contains(name_query, case=False, na=False)]
 
     # Pagination
     PAGE_SIZE = 5
-    total_pages = (len(df) - 1) // PAGE_SIZE + 1
+    total = catalog.count_tests(selected_tags, name_query)
+    total_pages = max(1, (total - 1) // PAGE_SIZE + 1)
     page = st.number_input("Страница", 1, total_pages, 1, 1)
-    start, end = (page - 1) * PAGE_SIZE, page * PAGE_SIZE
+    df = catalog.search_tests(selected_tags, name_query, page, PAGE_SIZE)
+    start = (page - 1) * PAGE_SIZE
 
-    st.write(f"Показаны {start+1}–{min(end, len(df))} из {len(df)} тестов")
-    st.dataframe(df.iloc[start:end])
+    st.write(f"Показаны {min(start+1, total)}–{start + len(df)} из {total} тестов")
+    st.dataframe(df)
 
 
 
@@ -296,37 +216,39 @@ def take_full_test_page():
     st.header("📝 Пройти тест (все вопросы на одной странице)")
 
     # Load all available tests
-    conn = sqlite3.connect(DB_PATH)
-    tests_df = pd.read_sql("SELECT id, name FROM tests", conn)
-    conn.close()
-    if tests_df.empty:
+    tests = catalog.load_tests()
+    if not tests:
         st.info("Сначала создайте тест!")
         return
 
 
-    options = [f"{r.id}: {r.name}" for r in tests_df.itertuples()]
+    options = [f"{t.id}: {t.name}" for t in tests]
     choice = st.selectbox("Выберите тест", options)
     test_id = int(choice.split(":", 1)[0])
 
 
-    conn = sqlite3.connect(DB_PATH)
-    questions = pd.read_sql(
-        """
-        SELECT q.id, q.text, q.type, q.choices, q.correct, q.points
-          FROM questions q
-          JOIN test_questions tq ON q.id = tq.question_id
-         WHERE tq.test_id = ?
-         ORDER BY tq.position
-        """,
-        conn,
-        params=(test_id,)
-    ).to_dict("records")
-    conn.close()
+    # a published snapshot is served from memory; pool tests draw a new
+    # random set of questions per attempt
+    attempt = None
+    snap = snapshots.get(test_id)
+    if snap is not None:
+        questions = snap.questions
+    elif pools.load_pool(test_id):
+        attempt = pool_attempt("fulltest_attempt", test_id)
+        questions = catalog.load_questions(attempt.ids)
+        if st.button("🎲 Другая выборка вопросов"):
+            forget_attempt(test_id)
+            st.rerun()
+    else:
+        questions = catalog.load_test_questions(test_id)
     if not questions:
         st.warning("В этом тесте пока нет вопросов!")
         return
 
 
+    # one idempotency token per attempt: resubmitting it is not graded again,
+    # even after switching to another test and back
+    token = attempt_token("fulltest_token", test_id)
     if "fulltest_submitted" not in st.session_state:
         st.session_state.fulltest_submitted = False
         st.session_state.fulltest_score = 0
@@ -337,43 +259,46 @@ def take_full_test_page():
         answers = {}
         for q in questions:
             st.subheader(q["text"])
-            opts = q["choices"].split("|") if q["type"] != "Текстовый ответ" else []
+            opts = q["choices"]
             if q["type"] == "Один ответ":
-                answers[q["id"]] = st.radio("", opts, key=f"qa_{q['id']}")
+                answers[q["id"]] = st.radio("Ответ", opts, key=f"qa_{q['id']}", label_visibility="collapsed")
             elif q["type"] == "Множественный выбор":
-                answers[q["id"]] = st.multiselect("", opts, key=f"qa_{q['id']}")
+                answers[q["id"]] = st.multiselect("Ответ", opts, key=f"qa_{q['id']}", label_visibility="collapsed")
             else:
                 answers[q["id"]] = st.text_input("Ваш ответ", key=f"qa_{q['id']}")
         submitted = st.form_submit_button("Отправить все ответы")
 
 
     # On submit, calculate total and max score
-    if submitted:
-        total_score = 0
-        max_score = 0
-        for q in questions:
-            max_score += q["points"]
-            user_ans = answers[q["id"]]
-            correct_list = (
-                q["correct"].split("|")
-                if q["type"] != "Текстовый ответ"
-                else [q["correct"]]
-            )
-            if isinstance(user_ans, list):
-                norm_user = {a.strip().lower() for a in user_ans}
-                norm_corr = {c.strip().lower() for c in correct_list}
-                if norm_user == norm_corr:
-                    total_score += q["points"]
-            else:
-                # для текстовых ответов
-                ans_norm  = user_ans.strip().lower()
-                corr_norm = correct_list[0].strip().lower()
-                if ans_norm == corr_norm:
-                    total_score += q["points"]
+    graded = st.session_state.setdefault("fulltest_graded", set())
+    if submitted and token in graded:
+        admission.deduplicated("grade")
+        st.info("Эти ответы уже проверены. Сохраните результат или начните тест заново.")
+    elif submitted:
+        if snap is not None:
+            key = snap.key
+        else:
+            key = grading.AnswerKey(questions) if attempt else grading.get_key(test_id)
+        try:
+            with admission.admit("grade"):
+                total_score = key.score(answers)
+                max_score = key.max_score
+                score_writer.get_writer().submit_attempt(
+                    test_id, total_score, max_score, attempt.seed if attempt else None,
+                    grading.encode_responses(questions, answers, key.marks(answers)),
+                    token=token,
+                )
+        except admission.Rejected as exc:
+            st.warning(str(exc))
+            return
 
+        graded.add(token)
         st.session_state.fulltest_submitted = True
+        st.session_state.fulltest_test_id = test_id
+        st.session_state.fulltest_seed = attempt.seed if attempt else None
         st.session_state.fulltest_score = total_score
         st.session_state.fulltest_max = max_score
+        st.session_state.fulltest_graded_token = token
 
 
     if st.session_state.fulltest_submitted:
@@ -382,191 +307,527 @@ def take_full_test_page():
             f"{st.session_state.fulltest_max} баллов."
         )
 
-        user = st.text_input("Введите ваше имя для рейтинга",
-                             key="fulltest_user")
-        if st.button("Сохранить результат", key="save_fulltest_button"):
-            if not user.strip():
-                st.error("Введите имя, чтобы сохранить результат.")
+        # the graded attempt is saved under its own token, even if another
+        # test is selected by now
+        saved = save_score_form("fulltest", st.session_state.fulltest_score,
+                                st.session_state.fulltest_test_id,
+                                st.session_state.fulltest_seed,
+                                st.session_state.fulltest_graded_token)
+        if saved or st.button("🔄 Пройти заново", key="fulltest_again"):
+            st.session_state.fulltest_submitted = False
+            forget_attempt(st.session_state.fulltest_test_id)
+            del st.session_state.fulltest_graded_token
+            if not saved:
+                st.rerun()
+
+
+
+def pool_attempt(key, test_id):
+    """Current random draw of a pool test; the seeds live in
+    session_state[key] per test, so they survive switching tests."""
+    seeds = st.session_state.setdefault(key, {})
+    if test_id not in seeds:
+        seeds[test_id] = pools.new_seed()
+    return pools.draw(test_id, seeds[test_id])
+
+
+def attempt_token(key, test_id):
+    """Idempotency token of the current attempt of test_id; the tokens live
+    in session_state[key] per test, so they survive switching tests."""
+    tokens = st.session_state.setdefault(key, {})
+    if test_id not in tokens:
+        tokens[test_id] = admission.new_token()
+    return tokens[test_id]
+
+
+def forget_attempt(test_id):
+    """Start a new full-test attempt of test_id: a new draw and a new token."""
+    token = st.session_state.get("fulltest_token", {}).pop(test_id, None)
+    st.session_state.get("fulltest_attempt", {}).pop(test_id, None)
+    st.session_state.get("fulltest_graded", set()).discard(token)
+
+
+def save_score_form(key, score, test_id, seed=None, token=None):
+    """Name input + save button; returns True once the score is queued.
+
+    token is the attempt's idempotency token: saving it twice stores one score.
+    """
+    user = st.text_input("Введите ваше имя для рейтинга", key=f"{key}_user")
+    if st.button("Сохранить результат", key=f"save_{key}_button"):
+        if not user.strip():
+            st.error("Введите имя, чтобы сохранить результат.")
+            return False
+        try:
+            with admission.admit("save"):
+                score_writer.get_writer().submit(user.strip(), score, test_id, seed, token)
+        except admission.Rejected as exc:
+            st.warning(str(exc))
+            return False
+        st.success("Результат сохранён!")
+        return True
+    return False
+
+
+EXAM_PAGE_SIZES = [5, 10, 20, 50]
+
+
+def take_paged_test_page():
+    st.header("📄 Экзамен (вопросы по страницам)")
+
+    tests = catalog.load_tests()
+    if not tests:
+        st.info("Сначала создайте тест!")
+        return
+
+    options = [f"{t.id}: {t.name}" for t in tests]
+    choice = st.selectbox("Выберите тест", options, key="exam_test")
+    test_id = int(choice.split(":", 1)[0])
+    # only ids, answers, per-page points, the draw seed, the pinned
+    # snapshot version and the attempt's idempotency token are kept between reruns
+    exam = st.session_state.get("exam")
+    # a new page size starts a new attempt, so it is locked once answers exist
+    in_progress = bool(exam and exam["test_id"] == test_id and not exam["finished"]
+                       and exam["answers"])
+    page_size = st.selectbox("Вопросов на странице", EXAM_PAGE_SIZES, index=1,
+                             key="exam_page_size", disabled=in_progress)
+    if in_progress:
+        st.caption("Размер страницы меняется только при новой попытке.")
+        if st.button("🔄 Начать заново", key="exam_new_attempt"):
+            del st.session_state.exam
+            st.rerun()
+    if not exam or exam["test_id"] != test_id or exam["page_size"] != page_size:
+        snap = snapshots.get(test_id)
+        is_pool = snap is None and pools.load_pool(test_id) is not None
+        exam = st.session_state.exam = {
+            "test_id": test_id, "page_size": page_size, "page": 0,
+            "answers": {}, "earned": {}, "responses": {}, "finished": False,
+            "seed": pools.new_seed() if is_pool else None,
+            "snapshot": snap.version if snap is not None else None,
+            "token": admission.new_token(),
+        }
+    # the whole attempt sees one version, even if a newer one gets published;
+    # if that version is gone, the attempt stops rather than mixing sources
+    snap = snapshots.get(test_id, exam["snapshot"]) if exam["snapshot"] else None
+    if exam["snapshot"] and snap is None:
+        st.error("Версия теста, по которой шла попытка, больше недоступна. "
+                 "Начните тест заново.")
+        if st.button("🔄 Начать заново", key="exam_restart"):
+            del st.session_state.exam
+            st.rerun()
+        return
+    is_pool = exam["seed"] is not None
+
+    if snap is not None:
+        total, max_score = len(snap), snap.max_score
+    elif is_pool:
+        attempt = pools.draw(test_id, exam["seed"])
+        total, max_score = len(attempt.ids), attempt.max_score
+    else:
+        total, max_score = catalog.test_summary(test_id)
+    if not total:
+        st.warning("В этом тесте пока нет вопросов!")
+        return
+
+    if exam["finished"]:
+        score = sum(exam["earned"].values())
+        st.success(f"Вы набрали {score} из {max_score} баллов.")
+        if save_score_form("exam", score, test_id, exam["seed"], exam["token"]):
+            del st.session_state.exam
+        return
+
+    page = exam["page"]
+    pages = (total + page_size - 1) // page_size
+    if snap is not None:
+        questions = snap.page(page, page_size)
+    elif is_pool:
+        page_ids = attempt.ids[page * page_size:(page + 1) * page_size]
+        questions = catalog.load_questions(page_ids)
+    else:
+        questions = catalog.load_test_page(test_id, page, page_size)
+        if page + 1 < pages:
+            catalog.prefetch_test_page(test_id, page + 1, page_size)
+
+    st.progress((page + 1) / pages,
+                text=f"Страница {page + 1} из {pages} · вопросов: {total}")
+    saved = exam["answers"]
+    with st.form(f"exam_form_{page}"):
+        answers = {}
+        for n, q in enumerate(questions, start=page * page_size + 1):
+            qid = q["id"]
+            st.subheader(f"{n}. {q['text']}")
+            opts = q["choices"]
+            if q["type"] == "Один ответ":
+                index = opts.index(saved[qid]) if saved.get(qid) in opts else None
+                answers[qid] = st.radio("Ответ", opts, index=index, key=f"ex_{qid}",
+                                        label_visibility="collapsed")
+            elif q["type"] == "Множественный выбор":
+                default = [o for o in saved.get(qid, []) if o in opts]
+                answers[qid] = st.multiselect("Ответ", opts, default=default,
+                                              key=f"ex_{qid}", label_visibility="collapsed")
             else:
-                conn = sqlite3.connect(DB_PATH)
-                conn.execute(
-                    "INSERT INTO scores (user, score) VALUES (?, ?)",
-                    (user.strip(), st.session_state.fulltest_score)
-                )
-                conn.commit()
-                conn.close()
-                st.success("Результат сохранён!")
-                
-                st.session_state.fulltest_submitted = False 
+                answers[qid] = st.text_input("Ваш ответ", value=saved.get(qid, ""),
+                                             key=f"ex_{qid}")
+        cols = st.columns(3)
+        back = cols[0].form_submit_button("⬅️ Назад", disabled=page == 0)
+        forward = cols[1].form_submit_button("Далее ➡️", disabled=page + 1 >= pages)
+        finish = cols[2].form_submit_button("Завершить")
+
+    if back or forward or finish:
+        # grade just this page; earlier pages keep their points
+        saved.update(answers)
+        if snap is not None:
+            key = snap.page_key(page, page_size)
+        elif is_pool:
+            key = grading.AnswerKey(questions)
+        else:
+            key = grading.get_page_key(test_id, page, page_size)
+        exam["earned"][page] = key.score(answers)
+        for row in grading.encode_responses(questions, answers, key.marks(answers)):
+            exam["responses"][row[0]] = row
+        if finish:
+            try:
+                with admission.admit("grade"):
+                    score_writer.get_writer().submit_attempt(
+                        test_id, sum(exam["earned"].values()), max_score, exam["seed"],
+                        list(exam["responses"].values()), token=exam["token"],
+                    )
+            except admission.Rejected as exc:
+                st.warning(str(exc))
+                return
+            exam["finished"] = True
+        else:
+            exam["page"] = page - 1 if back else page + 1
+        st.rerun()
 
 
 
 #  Rating leaderboard
 def rating_page():
     st.header("🏆 Рейтинг пользователей")
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql(
-        "SELECT user, SUM(score) AS total_score FROM scores GROUP BY user ORDER BY total_score DESC", conn
-    )
-    conn.close()
-    if df.empty:
+    boards = {
+        "За всё время": {},
+        "Сегодня": {"period": "day"},
+        "Эта неделя": {"period": "week"},
+        "По тесту": None,
+    }
+    board = st.radio("Рейтинг", list(boards), horizontal=True)
+    kwargs = boards[board]
+    if kwargs is None:
+        tests = catalog.load_tests()
+        if not tests:
+            st.info("Тестов ещё нет.")
+            return
+        names = {t.id: t.name for t in tests}
+        test_id = st.selectbox("Тест", list(names), format_func=lambda i: f"{i}: {names[i]}")
+        kwargs = {"test_id": test_id}
+
+    total = leaderboard.count(**kwargs)
+    if total == 0:
         st.info("Результатов ещё нет.")
-    else:
-        st.table(df)
+        return
+
+    PAGE_SIZE = 20
+    total_pages = (total - 1) // PAGE_SIZE + 1
+    page = st.number_input("Страница", 1, total_pages, 1, 1, key="rating_page")
+    rows = leaderboard.top(PAGE_SIZE, (page - 1) * PAGE_SIZE, **kwargs)
+    st.markdown(markdown_table(["#", "user", "total_score"], rows))
+
+
+def markdown_table(headers, rows):
+    """Small tables without the DataFrame round trip of st.table."""
+    def cell(value):
+        # user names are free text: keep them from turning into markdown
+        return re.sub(r"([\\`*_{}\[\]<>()#+\-.!|~])", r"\\\1", str(value)).replace("\n", " ")
+
+    lines = ["| " + " | ".join(headers) + " |", "|" + " --- |" * len(headers)]
+    lines += ["| " + " | ".join(cell(v) for v in row) + " |" for row in rows]
+    return "\n".join(lines)
+
+
+# Item statistics
+def stats_page():
+    # analytics needs pandas; import it only when this page is opened
+    from quizmaker import analytics
+
+    st.header("📊 Статистика вопросов")
+    tests = catalog.load_tests()
+    if not tests:
+        st.info("Тестов ещё нет.")
+        return
+
+    # fold attempts saved since the last visit into the running sums
+    analytics.refresh()
+
+    names = {t.id: t.name for t in tests}
+    test_id = st.selectbox("Тест", list(names), format_func=lambda i: f"{i}: {names[i]}",
+                           key="stats_test")
+    attempts, mean = analytics.test_overview(test_id)
+    if not attempts:
+        st.info("Этот тест ещё никто не проходил.")
+        return
+    # AVG is NULL when no attempt has a positive max_score
+    st.write(f"Попыток: {attempts}, средний результат: "
+             f"{'—' if mean is None else format(mean, '.0%')}")
+
+    items = analytics.item_stats(test_id)
+    text_ids = set(items.loc[items.pop("type") == catalog.TEXT_TYPE, "question_id"])
+    st.caption("Сложность — доля верных ответов; дискриминация — корреляция "
+               "ответа на вопрос с итоговым результатом попытки.")
+    st.dataframe(
+        items.rename(columns={
+            "question_id": "id", "text": "Вопрос", "answers": "Ответов",
+            "difficulty": "Сложность", "discrimination": "Дискриминация",
+        }),
+        hide_index=True,
+        column_config={"Сложность": st.column_config.NumberColumn(format="percent")},
+    )
+
+    if items.empty:
+        return
+    labels = dict(zip(items["question_id"], items["text"].fillna("(удалён)")))
+    qid = st.selectbox("Анализ вариантов ответа", list(labels),
+                       format_func=lambda i: f"{i}: {labels[i]}", key="stats_question")
+    if qid in text_ids:
+        st.info("У текстового вопроса нет вариантов ответа.")
+        return
+    choices = analytics.choice_stats(test_id, qid)
+    st.dataframe(
+        choices.drop(columns="ordinal").rename(columns={
+            "text": "Вариант", "is_correct": "Верный", "picks": "Выбрали",
+            "pick_rate": "Доля", "mean_score": "Средний результат выбравших",
+        }),
+        hide_index=True,
+        column_config={
+            "Верный": st.column_config.CheckboxColumn(),
+            "Доля": st.column_config.NumberColumn(format="percent"),
+            "Средний результат выбравших": st.column_config.NumberColumn(format="percent"),
+        },
+    )
 
 
 # Editing 
 def edit_test_page():
     st.header("✏️ Управление тестами и вопросами")
-    conn = sqlite3.connect(DB_PATH)
-    tests = pd.read_sql("SELECT id, name FROM tests", conn)
-    conn.close()
+    tests = catalog.load_tests()
 
-    if tests.empty:
+    if not tests:
         st.info("Пока нет ни одного теста.")
         return
 
+    test_names = {t.id: t.name for t in tests}
     test_id = st.selectbox(
         "Выберите тест для редактирования",
-        options=tests["id"],
-        format_func=lambda i: f"{i}: {tests.loc[tests.id==i,'name'].iloc[0]}"
+        options=list(test_names),
+        format_func=lambda i: f"{i}: {test_names[i]}"
     )
 
 
     with st.expander("🖉 Изменить название/описание/теги"):
-        row = tests.set_index("id").loc[test_id]
+        row = next(t for t in tests if t.id == test_id)
         new_name = st.text_input("Название теста", value=row.name)
-        new_desc = st.text_area("Описание", value=row.get("description",""))
-        new_tags = st.text_input("Теги", value=row.get("tags",""))
+        new_desc = st.text_area("Описание", value=row.description or "")
+        new_tags = st.text_input("Теги", value=row.tags or "")
         if st.button("Сохранить метаданные", key="save_meta"):
-            conn = sqlite3.connect(DB_PATH)
-            conn.execute(
-                "UPDATE tests SET name=?, description=?, tags=? WHERE id=?",
-                (new_name, new_desc, new_tags, test_id)
-            )
-            conn.commit()
-            conn.close()
+            with db.transaction() as conn:
+                conn.execute(catalog.UPDATE_TEST_SQL, (new_name, new_desc, new_tags, test_id))
+                catalog.replace_test_tags(conn, test_id, new_tags)
+            catalog.invalidate()
             st.success("Метаданные обновлены!")
     
     
-    current_qs = pd.read_sql(
-        "SELECT q.id, q.text FROM questions q "
-        " JOIN test_questions tq ON q.id=tq.question_id "
-        " WHERE tq.test_id=? ORDER BY tq.position",
-        sqlite3.connect(DB_PATH), params=(test_id,)
-    )
+    with st.expander("🎲 Случайная выборка вопросов"):
+        pool = pools.load_pool(test_id)
+        st.caption("Каждая попытка получает свой набор вопросов из банка по тегам; "
+                   "вопросы, добавленные в тест вручную, при этом не используются.")
+        all_tags = pools.load_tags()
+        pool_tags = st.multiselect(
+            "Теги вопросов", all_tags,
+            default=[t for t in (pool["tags"] if pool else []) if t in all_tags],
+            key=f"pool_tags_{test_id}",
+        )
+        pool_size = st.number_input("Вопросов в попытке", min_value=1,
+                                    value=pool["size"] if pool else 10,
+                                    key=f"pool_size_{test_id}")
+        weighting = st.selectbox(
+            "Сложность (по баллам)", list(pools.WEIGHTINGS),
+            index=list(pools.WEIGHTINGS).index(pool["weighting"]) if pool else 0,
+            format_func=pools.WEIGHTINGS.__getitem__, key=f"pool_weighting_{test_id}",
+        )
+        if pool_tags:
+            st.caption(f"Вопросов в пуле: {len(pools.get_pool(pool_tags, weighting))}")
+        cols = st.columns(2)
+        if cols[0].button("Сохранить выборку", key="save_pool"):
+            if not pool_tags:
+                st.error("Выберите хотя бы один тег.")
+            else:
+                with db.transaction() as conn:
+                    pools.save_pool(conn, test_id, pool_size, pool_tags, weighting)
+                catalog.invalidate()
+                if snapshots.status(test_id):
+                    snapshots.unpublish([test_id])
+                st.success("Тест теперь собирается случайно для каждой попытки.")
+        if pool and cols[1].button("Отключить выборку", key="delete_pool"):
+            with db.transaction() as conn:
+                pools.delete_pool(conn, test_id)
+            catalog.invalidate()
+            st.success("Тест снова использует фиксированный список вопросов.")
+
+    with st.expander("📌 Снимок для экзамена"):
+        st.caption("Опубликованный снимок фиксирует вопросы и ответы теста: экзамены читают "
+                   "его из памяти, без запросов к БД. Изменения теста попадают к студентам "
+                   "только после новой публикации.")
+        published = snapshots.status(test_id)
+        if published:
+            version, _sha, n_questions, published_at = published
+            st.write(f"Опубликована версия {version} ({n_questions} вопросов, {published_at} UTC).")
+        cols = st.columns(2)
+        if cols[0].button("Опубликовать", key="publish_snapshot"):
+            try:
+                snap = snapshots.publish(test_id)
+            except ValueError as exc:
+                st.error(str(exc))
+            else:
+                st.success(f"Опубликована версия {snap.version}.")
+        if published and cols[1].button("Снять с публикации", key="unpublish_snapshot"):
+            snapshots.unpublish([test_id])
+            st.success("Экзамены снова читают тест из БД.")
+
+    current_qs = catalog.load_test_questions(test_id)
+    current_text = {q["id"]: q["text"] for q in current_qs}
     with st.expander("🗑️ Удалить вопросы из этого теста"):
         to_remove = st.multiselect(
             "Выберите вопросы",
-            options=current_qs["id"],
-            format_func=lambda i: current_qs.loc[current_qs.id==i,"text"].iat[0]
+            options=list(current_text),
+            format_func=current_text.__getitem__
         )
         if st.button("Удалить из теста", key="del_from_test"):
-            conn = sqlite3.connect(DB_PATH)
-            conn.executemany(
-                "DELETE FROM test_questions WHERE test_id=? AND question_id=?",
-                [(test_id, q) for q in to_remove]
-            )
-            conn.commit()
-            conn.close()
-            st.success(f"Удалено {len(to_remove)} вопрос(ов) из теста.")
+            removed = editing.remove_questions(test_id, to_remove)
+            st.success(f"Удалено {removed} вопрос(ов) из теста.")
             
 
 
-    all_qs = pd.read_sql("SELECT id, text FROM questions", sqlite3.connect(DB_PATH))
-    avail = all_qs[~all_qs.id.isin(current_qs.id)]
     with st.expander("➕ Добавить в тест новые вопросы"):
-        to_add = st.multiselect(
-            "Выберите вопросы",
-            options=avail["id"],
-            format_func=lambda i: avail.loc[avail.id==i,"text"].iat[0]
+        to_add = picker.question_picker(
+            "Выберите вопросы", key=f"add_to_test_{test_id}", exclude_test_id=test_id
         )
         if st.button("Добавить в тест", key="add_to_test"):
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            last_pos = cur.execute(
-                "SELECT COALESCE(MAX(position),0) FROM test_questions WHERE test_id=?",
-                (test_id,)
-            ).fetchone()[0]
-            for q in to_add:
-                last_pos += 1
-                cur.execute(
-                    "INSERT INTO test_questions(test_id,question_id,position) VALUES(?,?,?)",
-                    (test_id, q, last_pos)
-                )
-            conn.commit()
-            conn.close()
-            st.success(f"Добавлено {len(to_add)} вопрос(ов).")
+            added = editing.add_questions(test_id, to_add)
+            st.success(f"Добавлено {added} вопрос(ов).")
             
 
 
     with st.expander("🗑️ Удалить любые вопросы из БД"):
-        df_q = pd.read_sql("SELECT id, text FROM questions", sqlite3.connect(DB_PATH))
-        to_del_q = st.multiselect(
-            "Вопросы для удаления",
-            options=df_q["id"],
-            format_func=lambda i: f"{i}: {df_q.loc[df_q.id==i,'text'].iloc[0]}"
+        to_del_q = picker.question_picker(
+            "Вопросы для удаления", key="del_any_q_pick", show_ids=True
         )
         if st.button("Удалить выбранные вопросы", key="del_any_q"):
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            
-            cur.executemany(
-                "DELETE FROM test_questions WHERE question_id=?",
-                [(q,) for q in to_del_q]
-            )
-            
-            cur.executemany(
-                "DELETE FROM questions WHERE id=?",
-                [(q,) for q in to_del_q]
-            )
-            conn.commit()
-            conn.close()
-            st.success(f"Удалено {len(to_del_q)} вопрос(ов) из БД.")
+            deleted = editing.delete_questions(to_del_q)
+            st.success(f"Удалено {deleted} вопрос(ов) из БД.")
             
             
     with st.expander("🗑️ Удалить тесты из БД"):
-        df_t = pd.read_sql("SELECT id, name FROM tests", sqlite3.connect(DB_PATH))
         to_del_t = st.multiselect(
             "Тесты для удаления",
-            options=df_t["id"],
-            format_func=lambda i: f"{i}: {df_t.loc[df_t.id==i,'name'].iloc[0]}"
+            options=list(test_names),
+            format_func=lambda i: f"{i}: {test_names[i]}"
         )
         if st.button("Удалить выбранные тесты", key="del_any_t"):
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            for t in to_del_t:
-                cur.execute("DELETE FROM test_questions WHERE test_id=?", (t,))
-                cur.execute("DELETE FROM tests WHERE id=?", (t,))
-            conn.commit()
-            conn.close()
-            st.success(f"Удалено {len(to_del_t)} тест(ов).")
+            deleted = editing.delete_tests(to_del_t)
+            st.success(f"Удалено {deleted} тест(ов).")
             
-  
+
+# Bulk import / export
+def import_export_page():
+    st.header("📦 Импорт и экспорт")
+    st.markdown("""
+  - **Вопросы**: CSV, JSONL или Parquet с полями text, type, choices, correct, points, tags
+  - **Тесты**: JSONL, где у строки есть name, description, tags и список questions
+""")
+    uploaded = st.file_uploader("Файл для импорта", type=["csv", "jsonl", "ndjson", "parquet"])
+    if uploaded is not None and st.button("Импортировать", key="bulk_import"):
+        fmt = bulk_io.detect_format(uploaded.name)
+        # utf-8-sig: Excel writes CSV with a byte order mark
+        f = uploaded if fmt == "parquet" else io.TextIOWrapper(uploaded, encoding="utf-8-sig", newline="")
+        status = st.empty()
+        try:
+            report = bulk_io.import_file(
+                f, fmt,
+                progress=lambda p: status.info(
+                    f"Прочитано {p['rows']} строк, добавлено {p['inserted']} вопросов"
+                ),
+            )
+        except (ValueError, UnicodeDecodeError, csv.Error, RuntimeError) as exc:
+            # the file as a whole is unreadable (encoding, broken CSV, pyarrow missing, ...)
+            st.error(f"Импорт прерван: {exc}")
+            report = None
+        if report is not None:
+            stats = report.as_dict()
+            st.success(
+                f"Добавлено вопросов: {stats['inserted']}, тестов: {stats['tests']}, "
+                f"дубликатов пропущено: {stats['duplicates']}"
+            )
+            if report.invalid:
+                st.error(f"Строк с ошибками: {report.invalid}")
+                st.table([{"строка": n, "ошибка": msg} for n, msg in report.errors])
+
+    st.subheader("Экспорт")
+    kind = st.radio("Что выгрузить", ["Вопросы", "Тесты"], horizontal=True)
+    if kind == "Вопросы":
+        fmt = st.selectbox("Формат", bulk_io.FORMATS)
+    else:
+        fmt = "jsonl"
+    if st.button("Подготовить файл", key="bulk_export"):
+        what = "questions" if kind == "Вопросы" else "tests"
+        name = f"{what}.{fmt}"
+        # the export is streamed to a temporary file, handed to the download
+        # button (which keeps its own copy) and removed right away
+        path = bulk_io.export_to_temp(what, fmt)
+        try:
+            with open(path, "rb") as f:
+                st.download_button(f"⬇️ Скачать {name}", f, file_name=name)
+        finally:
+            os.remove(path)
+
+
 def main():
-    init_db()
-    st.sidebar.title("QuizMaker")
-    page = st.sidebar.radio("Меню", [
-        "Мастер создания теста",
-        "Добавить вопрос",  
-        "Список тестов",
-        "Редактировать тест",
-        "Пройти тест",
-        "Рейтинг"
-    ])
-
-    if page == "Добавить вопрос":
-        add_question_page()
-    elif page == "Мастер создания теста":
-        create_test_wizard_page()  
-    elif page == "Список тестов":
-        list_tests_page()
-    elif page == "Редактировать тест":
-        edit_test_page() 
-    elif page == "Пройти тест":
-        take_full_test_page()
-    elif page == "Рейтинг":
-        rating_page()
+    run = profiling.start()
+    try:
+        with profiling.section("init_db"):
+            init_db()
+        st.sidebar.title("QuizMaker")
+        page = st.sidebar.radio("Меню", [
+            "Мастер создания теста",
+            "Добавить вопрос",  
+            "Список тестов",
+            "Редактировать тест",
+            "Пройти тест",
+            "Экзамен (по страницам)",
+            "Рейтинг",
+            "Статистика вопросов",
+            "Импорт/экспорт"
+        ])
+
+        with profiling.section(page):
+            if page == "Добавить вопрос":
+                add_question_page()
+            elif page == "Мастер создания теста":
+                create_test_wizard_page()  
+            elif page == "Список тестов":
+                list_tests_page()
+            elif page == "Редактировать тест":
+                edit_test_page() 
+            elif page == "Пройти тест":
+                take_full_test_page()
+            elif page == "Экзамен (по страницам)":
+                take_paged_test_page()
+            elif page == "Рейтинг":
+                rating_page()
+            elif page == "Статистика вопросов":
+                stats_page()
+            elif page == "Импорт/экспорт":
+                import_export_page()
+    finally:
+        profiling.finish(run)
 
 if __name__ == "__main__":
     main()
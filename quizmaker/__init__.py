@@ -0,0 +1 @@
+"""QuizMaker support modules: database access and the logic behind the pages of app.py."""
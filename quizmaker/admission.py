@@ -0,0 +1,160 @@
+"""Admission control for grading and score saving.
+
+Three layers, cheapest first:
+
+  * idempotency — every attempt gets a token (new_token(), kept in
+    session_state); attempts and scores store it under a unique index and
+    are inserted with ON CONFLICT DO NOTHING, so a double click or a rerun
+    that resubmits the same attempt is graded and counted once (see
+    score_writer and migration 14). Pages also skip re-grading a token
+    they have already graded and report it with deduplicated();
+  * rate limiting — a token bucket per (action, session):
+    RATES[action] = (tokens per second, burst). Saves are not keyed on the
+    typed user name, so one session cannot drain another user's bucket;
+  * load shedding — at most MAX_IN_FLIGHT gradings/saves run at once per
+    process; the rest are turned away instead of queueing up.
+
+admit() raises Rejected with a retry_after hint when a request is turned
+away; pages show it as a "retry shortly" message. stats() counts admitted,
+rate-limited, shed and deduplicated requests per action.
+"""
+import math
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+RATES = {
+    "grade": (0.5, 5),   # tokens per second, burst
+    "save": (0.2, 3),
+}
+MAX_IN_FLIGHT = 16      # concurrent gradings/saves per process
+SHED_RETRY = 2.0        # seconds suggested to a shed request
+MAX_BUCKETS = 10000     # idle buckets are dropped past this many
+
+
+class Rejected(Exception):
+    """Request turned away; retry after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Слишком много запросов, повторите через {math.ceil(retry_after)} с")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def wait(self, now):
+        """Refill; return 0.0 if a token is available, else seconds until one is."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def idle(self, now):
+        """Full again, so dropping it changes nothing."""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class AdmissionControl:
+    def __init__(self, rates=RATES, max_in_flight=MAX_IN_FLIGHT, max_buckets=MAX_BUCKETS):
+        self.rates = rates
+        self.max_in_flight = max_in_flight
+        self.max_buckets = max_buckets
+        self._buckets = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            action: {"admitted": 0, "rate_limited": 0, "shed": 0, "deduplicated": 0}
+            for action in rates
+        }
+        self._peak_in_flight = 0
+
+    def _prune(self, now):
+        for key in [k for k, b in self._buckets.items() if b.idle(now)]:
+            del self._buckets[key]
+
+    def acquire(self, action, keys):
+        rate, burst = self.rates[action]
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats[action]
+            if self._in_flight >= self.max_in_flight:
+                stats["shed"] += 1
+                raise Rejected("shed", SHED_RETRY)
+            if len(self._buckets) >= self.max_buckets:
+                self._prune(now)
+            buckets = []
+            for key in keys:
+                bucket = self._buckets.get((action, key))
+                if bucket is None:
+                    bucket = self._buckets[(action, key)] = TokenBucket(rate, burst, now)
+                buckets.append(bucket)
+            # all keys must have a token; only then is one taken from each
+            wait = max(b.wait(now) for b in buckets)
+            if wait:
+                stats["rate_limited"] += 1
+                raise Rejected("rate_limited", wait)
+            for bucket in buckets:
+                bucket.tokens -= 1.0
+            stats["admitted"] += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def deduplicated(self, action):
+        with self._lock:
+            self._stats[action]["deduplicated"] += 1
+
+    def stats(self):
+        with self._lock:
+            out = {action: dict(s) for action, s in self._stats.items()}
+            out["in_flight"] = self._in_flight
+            out["peak_in_flight"] = self._peak_in_flight
+            out["buckets"] = len(self._buckets)
+        return out
+
+
+@st.cache_resource
+def get_control():
+    return AdmissionControl()
+
+
+def session_key():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return f"session:{ctx.session_id}" if ctx is not None else "session:local"
+
+
+@contextmanager
+def admit(action, *keys):
+    """Run the block as one admitted `action` ("grade" or "save") of this
+    session (plus any extra bucket keys); raises Rejected."""
+    control = get_control()
+    control.acquire(action, (session_key(),) + keys)
+    try:
+        yield
+    finally:
+        control.release()
+
+
+def deduplicated(action):
+    """Count a request dropped because its token was already handled."""
+    get_control().deduplicated(action)
+
+
+def new_token():
+    return secrets.token_hex(16)
+
+
+def stats():
+    return get_control().stats()
@@ -0,0 +1,165 @@
+"""Item statistics over stored attempts.
+
+Per (test, question) the item_stats table keeps running sums: number of
+answers n, correct answers, and Σy, Σy², Σxy where x is the 0/1
+correctness and y the attempt score as a fraction of its maximum.
+choice_stats keeps, per option, how often it was picked and Σy of the
+pickers. refresh() folds only attempts newer than the stored watermark
+into these sums (vectorized pandas/NumPy per chunk of attempts), so its
+cost depends on new data, not on the whole history. From the sums:
+
+    difficulty      share of correct answers, n_correct / n
+    discrimination  point-biserial correlation of x with y
+    distractors     pick rate of every option and the mean score of pickers
+
+Options are identified by their position in the question (the bit number
+in responses.choices, see grading.encode_responses).
+"""
+import numpy as np
+import pandas as pd
+
+from quizmaker import db
+
+CHUNK_ATTEMPTS = 5000
+
+# watermark and newest attempt, read without taking the write lock
+PENDING_SQL = """
+    SELECT (SELECT value FROM analytics_state WHERE name = 'last_attempt_id'),
+           (SELECT MAX(id) FROM attempts)
+"""
+WATERMARK_SQL = "SELECT value FROM analytics_state WHERE name = 'last_attempt_id'"
+SET_WATERMARK_SQL = "UPDATE analytics_state SET value = ? WHERE name = 'last_attempt_id'"
+# last id of the next chunk of CHUNK_ATTEMPTS attempts past the watermark
+UPTO_SQL = "SELECT MAX(id) FROM (SELECT id FROM attempts WHERE id > ? ORDER BY id LIMIT ?)"
+NEW_RESPONSES_SQL = """
+    SELECT a.test_id, r.question_id, COALESCE(r.choices, 0) AS choices, r.correct,
+           COALESCE(a.score * 1.0 / NULLIF(a.max_score, 0), 0) AS y
+      FROM attempts a JOIN responses r ON r.attempt_id = a.id
+     WHERE a.id > ? AND a.id <= ?
+"""
+COUNT_ATTEMPTS_SQL = "SELECT COUNT(*) FROM attempts WHERE id > ? AND id <= ?"
+ADD_ITEM_STATS_SQL = """
+    INSERT INTO item_stats (test_id, question_id, n, n_correct, sum_y, sum_y2, sum_xy)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (test_id, question_id) DO UPDATE SET
+        n = n + excluded.n, n_correct = n_correct + excluded.n_correct,
+        sum_y = sum_y + excluded.sum_y, sum_y2 = sum_y2 + excluded.sum_y2,
+        sum_xy = sum_xy + excluded.sum_xy
+"""
+ADD_CHOICE_STATS_SQL = """
+    INSERT INTO choice_stats (test_id, question_id, ordinal, picks, sum_y)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (test_id, question_id, ordinal) DO UPDATE SET
+        picks = picks + excluded.picks, sum_y = sum_y + excluded.sum_y
+"""
+TEST_OVERVIEW_SQL = """
+    SELECT COUNT(*), AVG(score * 1.0 / NULLIF(max_score, 0)) FROM attempts WHERE test_id = ?
+"""
+ITEM_STATS_SQL = """
+    SELECT s.question_id, q.text, q.type, s.n, s.n_correct, s.sum_y, s.sum_y2, s.sum_xy
+      FROM item_stats s LEFT JOIN questions q ON q.id = s.question_id
+     WHERE s.test_id = ?
+"""
+CHOICE_STATS_SQL = """
+    SELECT qc.ordinal, qc.text, qc.is_correct,
+           COALESCE(cs.picks, 0) AS picks, cs.sum_y
+      FROM question_choices qc
+      LEFT JOIN choice_stats cs ON cs.test_id = ? AND cs.question_id = qc.question_id
+                               AND cs.ordinal = qc.ordinal
+     WHERE qc.question_id = ?
+     ORDER BY qc.ordinal
+"""
+ITEM_ANSWERS_SQL = "SELECT n FROM item_stats WHERE test_id = ? AND question_id = ?"
+
+
+def _aggregate(df):
+    """Sums to add to item_stats and choice_stats for one chunk."""
+    x = df["correct"].to_numpy(dtype=np.float64)
+    y = df["y"].to_numpy(dtype=np.float64)
+    items = (
+        df.assign(x=x, y2=y * y, xy=x * y)
+        .groupby(["test_id", "question_id"], sort=False)
+        .agg(n=("x", "size"), n_correct=("x", "sum"), sum_y=("y", "sum"),
+             sum_y2=("y2", "sum"), sum_xy=("xy", "sum"))
+        .reset_index()
+    )
+
+    picked = df[df["choices"] > 0]
+    masks = picked["choices"].to_numpy(dtype=np.int64)
+    width = int(masks.max()).bit_length() if len(masks) else 0
+    bits = (masks[:, None] >> np.arange(width)) & 1
+    rows, ordinal = np.nonzero(bits)
+    choices = (
+        pd.DataFrame({
+            "test_id": picked["test_id"].to_numpy()[rows],
+            "question_id": picked["question_id"].to_numpy()[rows],
+            "ordinal": ordinal,
+            "y": picked["y"].to_numpy()[rows],
+        })
+        .groupby(["test_id", "question_id", "ordinal"], sort=False)
+        .agg(picks=("y", "size"), sum_y=("y", "sum"))
+        .reset_index()
+    )
+    return items, choices
+
+
+def refresh():
+    """Fold new attempts into the statistics; returns how many were added.
+
+    Viewing statistics with nothing new to fold is a plain read: the write
+    transaction (which competes with score writes) is only opened when
+    there are attempts past the watermark.
+    """
+    last, newest = db.query(PENDING_SQL)[0]
+    if newest is None or newest <= last:
+        return 0
+    added = 0
+    while True:
+        with db.transaction() as conn:
+            last = conn.execute(WATERMARK_SQL).fetchone()[0]
+            upto = conn.execute(UPTO_SQL, (last, CHUNK_ATTEMPTS)).fetchone()[0]
+            if upto is None:
+                return added
+            df = pd.read_sql_query(NEW_RESPONSES_SQL, conn, params=(last, upto))
+            if not df.empty:
+                items, choices = _aggregate(df)
+                conn.executemany(ADD_ITEM_STATS_SQL, items.itertuples(index=False, name=None))
+                conn.executemany(ADD_CHOICE_STATS_SQL, choices.itertuples(index=False, name=None))
+            conn.execute(SET_WATERMARK_SQL, (upto,))
+            added += conn.execute(COUNT_ATTEMPTS_SQL, (last, upto)).fetchone()[0]
+
+
+def test_overview(test_id):
+    """(attempts, mean score as a fraction of the maximum) of a test."""
+    return db.query(TEST_OVERVIEW_SQL, (int(test_id),))[0]
+
+
+def item_stats(test_id):
+    """Difficulty and discrimination of every answered question of a test."""
+    df = db.query_df(ITEM_STATS_SQL, params=(int(test_id),))
+    n = df["n"].to_numpy(dtype=np.float64)
+    sx = df["n_correct"].to_numpy(dtype=np.float64)
+    sy = df["sum_y"].to_numpy()
+    # point-biserial r = (nΣxy − ΣxΣy) / sqrt((nΣx − (Σx)²)(nΣy² − (Σy)²)), x² = x
+    cov = n * df["sum_xy"].to_numpy() - sx * sy
+    var = (n * sx - sx * sx) * (n * df["sum_y2"].to_numpy() - sy * sy)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.where(var > 1e-12, cov / np.sqrt(np.where(var > 1e-12, var, 1.0)), np.nan)
+    return pd.DataFrame({
+        "question_id": df["question_id"],
+        "text": df["text"],
+        "type": df["type"],
+        "answers": df["n"],
+        "difficulty": sx / n,
+        "discrimination": r,
+    })
+
+
+def choice_stats(test_id, question_id):
+    """Options of a question with pick rate and mean score of the pickers."""
+    df = db.query_df(CHOICE_STATS_SQL, params=(int(test_id), int(question_id)))
+    total = db.query(ITEM_ANSWERS_SQL, (int(test_id), int(question_id)))
+    n = total[0][0] if total else 0
+    df["pick_rate"] = df["picks"] / n if n else 0.0
+    df["mean_score"] = df["sum_y"] / df["picks"].where(df["picks"] > 0)
+    return df.drop(columns="sum_y")
@@ -0,0 +1,319 @@
+"""Benchmark every page and the raw SQL paths on a synthetic database.
+
+Pages are rendered headlessly with Streamlit's AppTest. Each page is
+measured cold (catalog cache dropped before every rerun, so all reads hit
+SQLite) and warm (cache kept). Memory is reported per page as the RSS growth over its runs
+(from /proc/self/statm, Linux only) and the peak of Python allocations
+during one extra cold rerun under tracemalloc (kept out of the timings);
+the process-wide peak RSS is reported once for the whole run. The report
+is printed / written as JSON so runs can be compared:
+
+    python -m quizmaker.bench --questions 100000 --tests 10000 --out bench.json
+
+--startup measures process start instead: every run is a fresh interpreter
+that imports AppTest, renders the start page once (imports the app modules,
+opens the pool, checks the schema) and then reruns it; the report has the
+first-render time, rerun percentiles (AppTest adds its own polling delay
+to these), the cost of the per-rerun init_db() call, SQL statements per
+rerun and whether pandas got imported.
+
+--grading times answer keys of text questions without a database:
+compiling the matchers (cold and from the matcher cache, as after an
+unrelated catalog write) and AnswerKey.score() of one submission, for
+answers that hit the fast exact path and for answers that miss and run
+through the patterns and the bounded edit distance.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from quizmaker import catalog, db, grading, query_plans, synthetic, text_answers
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+APP_PATH = os.path.join(db.PROJECT_ROOT, "app.py")
+
+PAGES = {
+    "list_tests_page": "Список тестов",
+    "take_full_test_page": "Пройти тест",
+    "take_paged_test_page": "Экзамен (по страницам)",
+    "edit_test_page": "Редактировать тест",
+    "rating_page": "Рейтинг",
+    "stats_page": "Статистика вопросов",
+    "wizard_step2": "Мастер создания теста",
+}
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None}
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+    }
+
+
+def _peak_rss_kb():
+    """Process-wide high-water mark: only meaningful once per run."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _rss_kb():
+    """Current resident set size, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1])
+    except OSError:
+        return None
+    return resident * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def _alloc_peak_kb(at):
+    """Peak of Python allocations during one cold rerun of the page."""
+    catalog.invalidate()
+    tracemalloc.start()
+    try:
+        at.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak // 1024
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, _sql):
+        self.count += 1
+
+
+def bench_page(name, label, runs, counter):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=600)
+    if name == "wizard_step2":
+        at.session_state["wizard"] = {
+            "step": 2, "name": "bench", "desc": "", "tags": "", "questions": [],
+        }
+    at.run()
+    at.sidebar.radio[0].set_value(label)
+
+    result = {}
+    rss_before = _rss_kb()
+    for mode in ("cold", "warm"):
+        times, queries = [], []
+        for _ in range(runs):
+            if mode == "cold":
+                catalog.invalidate()
+            counter.count = 0
+            started = time.perf_counter()
+            at.run()
+            times.append(time.perf_counter() - started)
+            queries.append(counter.count)
+            if at.exception:
+                raise RuntimeError(f"{name}: {at.exception[0].message}")
+        result[mode] = dict(_percentiles(times), queries=statistics.mean(queries))
+    rss_after = _rss_kb()
+    result["rss_delta_kb"] = None if rss_before is None else rss_after - rss_before
+    result["alloc_peak_kb"] = _alloc_peak_kb(at)
+    return result
+
+
+def bench_sql(runs):
+    out = {}
+    with db.connection() as conn:
+        for name, (sql, params) in query_plans.STATEMENTS.items():
+            times = []
+            for _ in range(runs):
+                conn.execute("BEGIN")
+                started = time.perf_counter()
+                conn.execute(sql, params).fetchall()
+                times.append(time.perf_counter() - started)
+                conn.execute("ROLLBACK")
+            out[name] = _percentiles(times)
+    return out
+
+
+def _text_questions(n):
+    rules = [None, {"max_distance": 2}, {"patterns": [r"отв[её]т\s*№?\s*{}"]},
+             {"case_sensitive": True, "ignore_punctuation": False}]
+    questions = []
+    for i in range(n):
+        r = rules[i % len(rules)]
+        if r and "patterns" in r:
+            r = {"patterns": [r["patterns"][0].format(i)]}
+        questions.append({
+            "id": i + 1, "type": catalog.TEXT_TYPE, "points": 1,
+            "correct": [f"Ответ номер {i}", f"вариант ответа {i}"],
+            "answer_rules": json.dumps(r, ensure_ascii=False) if r else None,
+        })
+    return questions
+
+
+def bench_grading(runs, questions=100):
+    """Compile and score() times of an answer key of text questions."""
+    qs = _text_questions(questions)
+    compile_cold, compile_cached = [], []
+    for _ in range(runs):
+        text_answers._compile.cache_clear()
+        started = time.perf_counter()
+        grading.AnswerKey(qs)
+        compile_cold.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        key = grading.AnswerKey(qs)
+        compile_cached.append(time.perf_counter() - started)
+
+    submissions = {
+        # extra spaces, punctuation, case: found by the set lookup
+        "exact": {q["id"]: f"  ответ   НОМЕР, {q['id'] - 1}! " for q in qs},
+        # one typo: fails the lookup, accepted only within max_distance
+        "typo": {q["id"]: f"Ответ нмоер {q['id'] - 1}" for q in qs},
+        # wrong answers: every check runs to the end
+        "miss": {q["id"]: "совсем другой ответ на этот вопрос" for q in qs},
+    }
+    out = {
+        "questions": questions,
+        "compile_cold": _percentiles(compile_cold),
+        "compile_cached": _percentiles(compile_cached),
+    }
+    for name, answers in submissions.items():
+        times = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            score = key.score(answers)
+            times.append(time.perf_counter() - started)
+        out[f"score_{name}"] = dict(_percentiles(times), score=score)
+    return out
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=600)
+at.run()
+first = time.perf_counter()
+from quizmaker import db
+statements = []
+db.get_pool().set_trace(statements.append)
+reruns = []
+for _ in range(int(sys.argv[2])):
+    t = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - t)
+rerun_statements = len(statements) / max(len(reruns), 1)
+pandas_loaded = "pandas" in sys.modules
+# the schema check every rerun starts with, without AppTest's polling
+import app
+t = time.perf_counter()
+for _ in range(1000):
+    app.init_db()
+init_db = (time.perf_counter() - t) / 1000
+print(json.dumps({
+    "import_s": imported - started, "first_render_s": first - imported,
+    "reruns_s": reruns, "statements": rerun_statements, "init_db_s": init_db,
+    "pandas_loaded": pandas_loaded,
+}))
+"""
+
+
+def bench_startup(path, runs, reruns=20):
+    """Fresh-process start and rerun overhead of the start page."""
+    env = dict(os.environ, QUIZMAKER_DB=path)
+    first, rerun, init_db, statements, pandas_loaded = [], [], [], [], False
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, APP_PATH, str(reruns)],
+            cwd=db.PROJECT_ROOT, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        sample = json.loads(out.strip().splitlines()[-1])
+        first.append(sample["first_render_s"])
+        rerun.extend(sample["reruns_s"])
+        init_db.append(sample["init_db_s"])
+        statements.append(sample["statements"])
+        pandas_loaded = pandas_loaded or sample["pandas_loaded"]
+    return {
+        "first_render": _percentiles(first),
+        "rerun": _percentiles(rerun),
+        "init_db_us": round(statistics.median(init_db) * 1e6, 3),
+        "statements_per_rerun": statistics.mean(statements),
+        "pandas_loaded": pandas_loaded,
+    }
+
+
+def run(sizes, runs=10, pages=tuple(PAGES)):
+    report = {"sizes": sizes, "runs": runs}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        started = time.perf_counter()
+        synthetic.generate(path, **sizes)
+        report["generate_s"] = round(time.perf_counter() - started, 3)
+        report["db_size_mb"] = round(os.path.getsize(path) / 2 ** 20, 2)
+
+        counter = QueryCounter()
+        db.get_pool().set_trace(counter)
+        report["pages"] = {
+            name: bench_page(name, PAGES[name], runs, counter) for name in pages
+        }
+        db.get_pool().set_trace(None)
+        report["sql"] = bench_sql(runs)
+        report["peak_rss_kb"] = _peak_rss_kb()
+        db.get_pool().close()
+    return report
+
+
+def run_startup(sizes, runs=10):
+    report = {"sizes": sizes, "runs": runs}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        synthetic.generate(path, **sizes)
+        db.get_pool().close()
+        report["startup"] = bench_startup(path, runs)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк страниц QuizMaker")
+    synthetic.add_size_arguments(parser)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--pages", nargs="*", choices=list(PAGES), default=list(PAGES))
+    parser.add_argument("--startup", action="store_true",
+                        help="измерить запуск процесса и накладные расходы перерисовки")
+    parser.add_argument("--grading", action="store_true",
+                        help="измерить проверку текстовых ответов (без БД)")
+    parser.add_argument("--out", help="записать JSON в файл вместо stdout")
+    args = parser.parse_args(argv)
+
+    if args.grading:
+        report = {"runs": args.runs, "grading": bench_grading(args.runs)}
+    elif args.startup:
+        report = run_startup(synthetic.sizes_from_args(args), args.runs)
+    else:
+        report = run(synthetic.sizes_from_args(args), args.runs, args.pages)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
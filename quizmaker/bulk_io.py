@@ -0,0 +1,558 @@
+"""Streaming bulk import/export of question banks and tests.
+
+Import reads CSV, JSONL or Parquet in chunks of CHUNK_SIZE rows, validates
+every row with the same rules as add_question_page, skips questions whose
+content hash already exists (in the database or earlier in the file) and
+inserts each chunk in one transaction. With defer_indexes the full-text
+trigger on questions is dropped for the duration of the import and the
+new questions are indexed once at the end. The import commits chunk by
+chunk, so if the process dies before the trigger is restored,
+migrations.ensure_schema() recreates it and rebuilds the index on the
+next start (repair_fts()).
+
+Question rows have the fields text, type, choices, correct, points, tags
+and, optionally, answer_rules (JSON matching rules of a text question, see
+text_answers). In JSONL/Parquet choices and correct are lists; in CSV they
+are either a JSON list or one option per line (as in the add-question
+form). Every correct entry of a text question is an accepted answer. A JSONL
+row with a "questions" list is a whole test: name, description, tags and
+its questions in order — the format written by export_tests(). A row
+that fails to decode or validate (broken JSON line, a field of the wrong
+type) is listed in the report with its row number and skipped; the rest
+of the file is still imported.
+
+    python -m quizmaker.bulk_io import bank.csv
+    python -m quizmaker.bulk_io export-questions bank.parquet
+    python -m quizmaker.bulk_io export-tests tests.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+from quizmaker import catalog, db, migrations
+
+CHUNK_SIZE = 5000
+EXPORT_BATCH = 500
+
+FIELDS = ("text", "type", "choices", "correct", "points", "tags", "answer_rules")
+FORMATS = ("csv", "jsonl", "parquet")
+
+# dropped during a deferred import, recreated from their saved SQL
+DEFERRED_TRIGGERS = ("questions_fts_ai",)
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    if ext == "ndjson":
+        ext = "jsonl"
+    if ext not in FORMATS:
+        raise ValueError(f"Неизвестный формат файла: {path}")
+    return ext
+
+
+# ---------------------------------
+# Reading
+# ---------------------------------
+def _iter_csv(f):
+    yield from csv.DictReader(f)
+
+
+class BadRow:
+    """A line that is not a JSON object; reported as an error of its row."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def _iter_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield BadRow(f"Строка — не JSON: {exc}")
+            continue
+        yield row if isinstance(row, dict) else BadRow("Строка должна быть JSON-объектом")
+
+
+def _iter_parquet(f):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для Parquet нужен пакет pyarrow") from None
+    for batch in pq.ParquetFile(f).iter_batches(batch_size=CHUNK_SIZE):
+        yield from batch.to_pylist()
+
+
+def iter_rows(f, fmt):
+    """Yield raw row dicts from a text (CSV/JSONL) or binary (Parquet) file."""
+    return {"csv": _iter_csv, "jsonl": _iter_jsonl, "parquet": _iter_parquet}[fmt](f)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    if hasattr(value, "tolist"):  # numpy arrays from Parquet
+        return _as_list(value.tolist())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)   # "correct": 42
+    if not isinstance(value, str):
+        raise ValueError(f"Ожидался список или строка, а не {type(value).__name__}")
+    if value.lstrip().startswith("["):
+        try:
+            items = json.loads(value)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"Список начинается с «[», но это не JSON: {exc}") from None
+        if not isinstance(items, list):
+            raise ValueError("Ожидался JSON-список")
+        return _as_list(items)
+    return [c.strip() for c in value.splitlines() if c.strip()]
+
+
+def _text(row, field):
+    value = row.get(field)
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise ValueError(f"Поле {field} должно быть строкой")
+    return value.strip()
+
+
+def _points(value):
+    """Points of a row: an integer, or a number/string with no fractional
+    part ("2", 2.0, "2.0"); empty means 1. Anything else raises ValueError."""
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == "":
+        return 1
+    if isinstance(value, bool):
+        raise ValueError("Баллы должны быть целым числом")
+    if isinstance(value, int):
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Баллы должны быть целым числом, а не «{value}»") from None
+    if not number.is_integer():
+        raise ValueError(f"Баллы должны быть целым числом, а не «{value}»")
+    return int(number)
+
+
+def parse_question(row):
+    """Raw row -> (question dict, error message or None)."""
+    if not isinstance(row, dict):
+        return None, "Вопрос должен быть объектом"
+    try:
+        qtype = _text(row, "type")
+        choices = _as_list(row.get("choices"))
+        correct = _as_list(row.get("correct"))
+        text = _text(row, "text")
+        tags = _text(row, "tags")
+        points = _points(row.get("points"))
+    except ValueError as exc:
+        return None, str(exc)
+    rules = row.get("answer_rules") or None
+    if qtype == catalog.TEXT_TYPE:
+        choices = []
+    else:
+        rules = None
+    q = {
+        "text": text,
+        "type": qtype,
+        "choices": choices,
+        "correct": correct,
+        "points": points,
+        "tags": tags,
+        "answer_rules": rules,
+    }
+    return q, catalog.validate_question(q["text"], qtype, choices, correct, points, rules)
+
+
+def parse_test(row):
+    """Raw test row -> (test dict without its questions, error message or None)."""
+    try:
+        test = {field: _text(row, field) for field in ("name", "description", "tags")}
+    except ValueError as exc:
+        return None, str(exc)
+    if not test["name"]:
+        return None, "Название теста не может быть пустым"
+    return test, None
+
+
+# ---------------------------------
+# Import
+# ---------------------------------
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.tests = 0
+        self.errors = []          # (row number, message), first MAX_ERRORS only
+        self.invalid = 0
+        self.started = time.perf_counter()
+
+    MAX_ERRORS = 100
+
+    def error(self, row_no, message):
+        self.invalid += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append((row_no, message))
+
+    def as_dict(self):
+        return {
+            "rows": self.rows, "inserted": self.inserted, "duplicates": self.duplicates,
+            "tests": self.tests, "invalid": self.invalid,
+            "seconds": round(time.perf_counter() - self.started, 3),
+        }
+
+
+def _existing_hashes(conn, hashes):
+    found = set()
+    hashes = list(hashes)
+    for i in range(0, len(hashes), 500):
+        part = hashes[i:i + 500]
+        marks = ",".join("?" * len(part))
+        found.update(r[0] for r in conn.execute(
+            f"SELECT content_hash FROM questions WHERE content_hash IN ({marks})", part
+        ))
+    return found
+
+
+def _hash_to_id(conn, h):
+    return conn.execute(
+        "SELECT id FROM questions WHERE content_hash=? LIMIT 1", (h,)
+    ).fetchone()[0]
+
+
+def _import_chunk(conn, chunk, report, seen):
+    """chunk: [(row_no, raw row)] -> inserts questions and tests."""
+    parsed = []   # (row_no, question, hash) or (row_no, test, [(question, hash)])
+    hashes = set()
+    for row_no, row in chunk:
+        if isinstance(row, BadRow):
+            report.error(row_no, row.message)
+            continue
+        if isinstance(row.get("questions"), list):
+            test, err = parse_test(row)
+            if err:
+                report.error(row_no, err)
+                continue
+            items = []
+            for k, raw in enumerate(row["questions"], start=1):
+                q, err = parse_question(raw)
+                if err:
+                    report.error(row_no, f"вопрос {k}: {err}")
+                    break
+                h = catalog.question_hash(q["text"], q["type"], q["choices"], q["correct"])
+                items.append((q, h))
+                hashes.add(h)
+            else:
+                parsed.append((row_no, test, items))
+            continue
+        q, err = parse_question(row)
+        if err:
+            report.error(row_no, err)
+            continue
+        h = catalog.question_hash(q["text"], q["type"], q["choices"], q["correct"])
+        hashes.add(h)
+        parsed.append((row_no, q, h))
+
+    existing = _existing_hashes(conn, hashes - seen.keys())
+
+    def insert(q, h):
+        """Insert unless a question with the same content exists; return its id."""
+        if h in seen:
+            report.duplicates += 1
+            return seen[h]
+        if h in existing:
+            report.duplicates += 1
+            seen[h] = _hash_to_id(conn, h)
+            return seen[h]
+        qid = catalog.insert_question(
+            conn, q["text"], q["type"], q["choices"], q["correct"], q["points"], q["tags"],
+            q["answer_rules"],
+        )
+        report.inserted += 1
+        seen[h] = qid
+        return qid
+
+    for row_no, item, extra in parsed:
+        if isinstance(extra, list):
+            test_id = conn.execute(
+                catalog.INSERT_TEST_SQL, (item["name"], item["description"], item["tags"])
+            ).lastrowid
+            catalog.replace_test_tags(conn, test_id, item["tags"])
+            qids = list(dict.fromkeys(insert(q, h) for q, h in extra))
+            conn.executemany(
+                catalog.INSERT_TEST_QUESTION_SQL,
+                [(test_id, qid, pos) for pos, qid in enumerate(qids, start=1)],
+            )
+            report.tests += 1
+        else:
+            insert(item, extra)
+
+
+def _drop_deferred(conn):
+    saved = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='trigger' AND name IN ({})".format(
+            ",".join("?" * len(DEFERRED_TRIGGERS))
+        ),
+        DEFERRED_TRIGGERS,
+    ).fetchall()
+    for name, _sql in saved:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    return saved
+
+
+def _restore_deferred(conn, saved, first_new_id):
+    if conn.execute(migrations.TRIGGER_EXISTS_SQL, ("questions_fts_ai",)).fetchone():
+        # migrations.repair_fts() already put it back and rebuilt the index
+        return
+    for _name, sql in saved:
+        conn.execute(sql)
+    if saved:
+        conn.execute(
+            "INSERT INTO questions_fts(rowid, text) SELECT id, text FROM questions WHERE id >= ?",
+            (first_new_id,),
+        )
+
+
+def import_file(f, fmt, defer_indexes=False, progress=None, chunk_size=CHUNK_SIZE):
+    """Import an open file (text mode for CSV/JSONL, binary for Parquet).
+
+    progress(report_dict) is called after every committed chunk.
+    """
+    report = ImportReport()
+    seen = {}     # content hash -> question id, for this import
+    saved = []
+    if defer_indexes:
+        with db.transaction() as conn:
+            first_new_id = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) + 1 FROM questions"
+            ).fetchone()[0]
+            saved = _drop_deferred(conn)
+    try:
+        chunk = []
+        for row_no, row in enumerate(iter_rows(f, fmt), start=1):
+            chunk.append((row_no, row))
+            report.rows += 1
+            if len(chunk) >= chunk_size:
+                with db.transaction() as conn:
+                    _import_chunk(conn, chunk, report, seen)
+                chunk = []
+                if progress:
+                    progress(report.as_dict())
+        if chunk:
+            with db.transaction() as conn:
+                _import_chunk(conn, chunk, report, seen)
+    finally:
+        if saved:
+            with db.transaction() as conn:
+                _restore_deferred(conn, saved, first_new_id)
+        catalog.invalidate()
+    if progress:
+        progress(report.as_dict())
+    return report
+
+
+def import_path(path, fmt=None, **kwargs):
+    fmt = fmt or detect_format(path)
+    if fmt == "parquet":
+        with open(path, "rb") as f:
+            return import_file(f, fmt, **kwargs)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return import_file(f, fmt, **kwargs)
+
+
+# ---------------------------------
+# Export
+# ---------------------------------
+def _choices_for(conn, ids):
+    choices, correct = {}, {}
+    marks = ",".join("?" * len(ids))
+    for qid, text, is_correct in conn.execute(
+        f"SELECT question_id, text, is_correct FROM question_choices"
+        f" WHERE question_id IN ({marks}) ORDER BY question_id, ordinal",
+        ids,
+    ):
+        choices.setdefault(qid, []).append(text)
+        if is_correct:
+            correct.setdefault(qid, []).append(text)
+    return choices, correct
+
+
+def _question_dict(row, choices, correct):
+    qid, text, qtype, points, tags, answer_rules = row
+    return {
+        "text": text, "type": qtype,
+        "choices": [] if qtype == catalog.TEXT_TYPE else choices.get(qid, []),
+        "correct": correct.get(qid, []),
+        "points": points, "tags": tags or "", "answer_rules": answer_rules,
+    }
+
+
+def iter_questions(conn, batch=EXPORT_BATCH):
+    """Yield every question as a dict, keyset-paginated by id."""
+    last = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, text, type, points, tags, answer_rules FROM questions"
+            " WHERE id > ? ORDER BY id LIMIT ?",
+            (last, batch),
+        ).fetchall()
+        if not rows:
+            return
+        choices, correct = _choices_for(conn, [r[0] for r in rows])
+        for row in rows:
+            yield _question_dict(row, choices, correct)
+        last = rows[-1][0]
+
+
+def iter_tests(conn, batch=EXPORT_BATCH):
+    """Yield every test with its questions in position order."""
+    last = 0
+    while True:
+        tests = conn.execute(
+            "SELECT id, name, description, tags FROM tests WHERE id > ? ORDER BY id LIMIT ?",
+            (last, batch),
+        ).fetchall()
+        if not tests:
+            return
+        for test_id, name, description, tags in tests:
+            rows = conn.execute(
+                """
+                SELECT q.id, q.text, q.type, q.points, q.tags, q.answer_rules
+                  FROM test_questions tq JOIN questions q ON q.id = tq.question_id
+                 WHERE tq.test_id = ? ORDER BY tq.position
+                """,
+                (test_id,),
+            ).fetchall()
+            choices, correct = _choices_for(conn, [r[0] for r in rows]) if rows else ({}, {})
+            yield {
+                "name": name, "description": description or "", "tags": tags or "",
+                "questions": [_question_dict(r, choices, correct) for r in rows],
+            }
+        last = tests[-1][0]
+
+
+def write_rows(rows, f, fmt):
+    """Stream question dicts to an open file; returns the number written."""
+    n = 0
+    if fmt == "jsonl":
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            n += 1
+    elif fmt == "csv":
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(
+                row,
+                choices=json.dumps(row["choices"], ensure_ascii=False),
+                correct=json.dumps(row["correct"], ensure_ascii=False),
+            ))
+            n += 1
+    elif fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([
+            ("text", pa.string()), ("type", pa.string()),
+            ("choices", pa.list_(pa.string())), ("correct", pa.list_(pa.string())),
+            ("points", pa.int64()), ("tags", pa.string()), ("answer_rules", pa.string()),
+        ])
+        with pq.ParquetWriter(f, schema) as writer:
+            buf = []
+            for row in rows:
+                buf.append(row)
+                n += 1
+                if len(buf) >= CHUNK_SIZE:
+                    writer.write_table(pa.Table.from_pylist(buf, schema))
+                    buf = []
+            if buf:
+                writer.write_table(pa.Table.from_pylist(buf, schema))
+    else:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    return n
+
+
+def export_questions(path, fmt=None):
+    fmt = fmt or detect_format(path)
+    with db.connection() as conn:
+        if fmt == "parquet":
+            with open(path, "wb") as f:
+                return write_rows(iter_questions(conn), f, fmt)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            return write_rows(iter_questions(conn), f, fmt)
+
+
+def export_tests(path):
+    with db.connection() as conn, open(path, "w", encoding="utf-8") as f:
+        return write_rows(iter_tests(conn), f, "jsonl")
+
+
+def export_to_temp(kind, fmt):
+    """Stream an export ("questions" or "tests") into a new temporary file,
+    for st.download_button; returns its path, the caller removes it."""
+    fd, path = tempfile.mkstemp(prefix="quizmaker-export-", suffix="." + fmt)
+    os.close(fd)
+    try:
+        if kind == "tests":
+            export_tests(path)
+        else:
+            export_questions(path, fmt)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт/экспорт вопросов и тестов")
+    parser.add_argument("--db", help="путь к БД (по умолчанию data/questions.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="импортировать CSV/JSONL/Parquet")
+    imp.add_argument("path")
+    imp.add_argument("--format", choices=FORMATS)
+    imp.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    imp.add_argument("--no-defer-indexes", action="store_true",
+                     help="не отключать полнотекстовый индекс на время импорта")
+    exq = sub.add_parser("export-questions", help="выгрузить банк вопросов")
+    exq.add_argument("path")
+    exq.add_argument("--format", choices=FORMATS)
+    ext = sub.add_parser("export-tests", help="выгрузить тесты с вопросами (JSONL)")
+    ext.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.use_database(args.db)
+    migrations.migrate()
+
+    if args.command == "import":
+        report = import_path(
+            args.path, args.format, defer_indexes=not args.no_defer_indexes,
+            chunk_size=args.chunk_size,
+            progress=lambda p: print(json.dumps(p), file=sys.stderr),
+        )
+        for row_no, message in report.errors:
+            print(f"строка {row_no}: {message}", file=sys.stderr)
+        print(json.dumps(report.as_dict()))
+        return 1 if report.invalid else 0
+    if args.command == "export-questions":
+        print(f"{export_questions(args.path, args.format)} вопросов")
+    else:
+        print(f"{export_tests(args.path)} тестов")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
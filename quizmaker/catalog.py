@@ -0,0 +1,468 @@
+"""Read-through cache for the test catalog and the question bank.
+
+Cached results are keyed by a process-wide data version. Every write path in
+app.py calls invalidate() after committing, which bumps the version so the
+next read goes to SQLite; until then reruns are served from memory.
+invalidate() also increments the shared catalog_version row, which every
+process polls at most once per SHARED_CHECK seconds, so the caches of other
+app processes on the host drop their entries too. The version row is
+always read from the primary, never from a replica, so the delay is
+SHARED_CHECK and not the replica lag.
+Entries also expire after CACHE_TTL seconds and the least recently used
+ones are evicted once CACHE_SIZE is reached.
+
+Cached DataFrames are shared between sessions — callers must not modify
+them in place.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from quizmaker import db, text_answers
+
+CACHE_TTL = 300.0   # seconds
+CACHE_SIZE = 256    # entries
+SHARED_CHECK = 1.0  # seconds between polls of the shared catalog version
+
+TEXT_TYPE = "Текстовый ответ"
+
+
+class ReadCache:
+    """Thread-safe LRU cache with per-entry TTL."""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, shared_version=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self.shared_seen = None
+        self._shared_version = shared_version
+        self._checked_at = 0.0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "remote_bumps": 0}
+
+    def _sync_shared(self, now):
+        if self._shared_version is None or now - self._checked_at < SHARED_CHECK:
+            return
+        self._checked_at = now
+        seen = self._shared_version()
+        if seen is None or seen == self.shared_seen:
+            return
+        if self.shared_seen is not None:
+            self.bump()
+            with self._lock:
+                self._stats["remote_bumps"] += 1
+        self.shared_seen = seen
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        self._sync_shared(now)
+        with self._lock:
+            full_key = (self.version,) + key
+            entry = self._data.get(full_key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(full_key)
+                self._stats["hits"] += 1
+                return entry[1]
+            self._stats["misses"] += 1
+
+        value = loader()
+
+        with self._lock:
+            # a write may have bumped the version while we were loading;
+            # keep the result for this caller but don't cache it
+            if full_key[0] == self.version:
+                self._data[full_key] = (now + self.ttl, value)
+                self._data.move_to_end(full_key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self._stats["evictions"] += 1
+        return value
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            # entries of older versions can never be hit again
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["version"] = self.version
+            out["size"] = len(self._data)
+        return out
+
+
+VERSION_SQL = "SELECT version FROM catalog_version WHERE id = 1"
+BUMP_VERSION_SQL = "UPDATE catalog_version SET version = version + 1 WHERE id = 1 RETURNING version"
+
+
+def _shared_version():
+    try:
+        return db.query(VERSION_SQL)[0][0]
+    except (sqlite3.OperationalError, IndexError):
+        return None  # not migrated yet
+
+
+@st.cache_resource
+def get_cache():
+    return ReadCache(shared_version=_shared_version)
+
+
+def invalidate():
+    """Call after any write to tests/questions/test_questions."""
+    cache = get_cache()
+    try:
+        # lock waits are retried by transaction(); a lock error that still
+        # gets through is raised, not dropped, or other processes would
+        # keep serving their stale caches
+        with db.transaction() as conn:
+            cache.shared_seen = conn.execute(BUMP_VERSION_SQL).fetchall()[0][0]
+    except sqlite3.OperationalError as exc:
+        if "no such table" not in str(exc):
+            raise
+        # not migrated yet (first start, synthetic.generate)
+    finally:
+        cache.bump()
+
+
+def cache_stats():
+    return get_cache().stats()
+
+
+Test = namedtuple("Test", "id name description tags")
+
+LOAD_TESTS_SQL = "SELECT id, name, description, tags FROM tests ORDER BY id"
+UPDATE_TEST_SQL = "UPDATE tests SET name=?, description=?, tags=? WHERE id=?"
+
+
+def load_tests():
+    """All tests as a list of Test(id, name, description, tags) tuples."""
+    return get_cache().get_or_load(
+        ("tests",),
+        lambda: [Test(*row) for row in
+                 db.query(LOAD_TESTS_SQL, replica=True)],
+    )
+
+
+# a test's questions (or one LIMIT/OFFSET page of them) in position order
+TEST_QUESTIONS_SQL = """
+    SELECT q.id, q.text, q.type, q.points, q.answer_rules
+      FROM questions q
+      JOIN test_questions tq ON q.id = tq.question_id
+     WHERE tq.test_id = ?
+     ORDER BY tq.position
+     LIMIT ? OFFSET ?
+"""
+# options of the same questions in one indexed query
+TEST_CHOICES_SQL = """
+    SELECT qc.question_id, qc.text, qc.is_correct
+      FROM question_choices qc
+     WHERE qc.question_id IN (
+           SELECT question_id FROM test_questions
+            WHERE test_id = ? ORDER BY position LIMIT ? OFFSET ?)
+     ORDER BY qc.question_id, qc.ordinal
+"""
+
+
+# questions by id, for pool attempts (ids passed as one JSON array)
+QUESTIONS_BY_ID_SQL = """
+    SELECT id, text, type, points, answer_rules FROM questions
+     WHERE id IN (SELECT value FROM json_each(?))
+"""
+QUESTION_IDS_SQL = """
+    SELECT id FROM questions WHERE id IN (SELECT value FROM json_each(?))
+"""
+CHOICES_BY_ID_SQL = """
+    SELECT question_id, text, is_correct FROM question_choices
+     WHERE question_id IN (SELECT value FROM json_each(?))
+     ORDER BY question_id, ordinal
+"""
+
+
+def _load_test_questions(test_id, limit=-1, offset=0):
+    params = (test_id, limit, offset)
+    questions = db.query_records(TEST_QUESTIONS_SQL, params, replica=True)
+    return _with_choices(questions, db.query(TEST_CHOICES_SQL, params, replica=True))
+
+
+def _with_choices(questions, rows):
+    choices, correct = {}, {}
+    for qid, text, is_correct in rows:
+        choices.setdefault(qid, []).append(text)
+        if is_correct:
+            correct.setdefault(qid, []).append(text)
+    for q in questions:
+        q["choices"] = [] if q["type"] == TEXT_TYPE else choices.get(q["id"], [])
+        q["correct"] = correct.get(q["id"], [])
+    return questions
+
+
+def load_test_questions(test_id):
+    """Questions of one test in position order, as a list of dicts.
+
+    Keys: id, text, type, points, answer_rules (JSON or None, see
+    text_answers), choices (list of option texts, empty for text questions)
+    and correct (list of correct texts; accepted answers of a text question).
+    The list is shared through the cache, so callers must not modify it.
+    """
+    return get_cache().get_or_load(
+        ("test_questions", int(test_id)),
+        lambda: _load_test_questions(int(test_id)),
+    )
+
+
+def load_questions(ids):
+    """Questions with the given ids, in the order of `ids`; same keys as
+    load_test_questions(). Not cached: used for per-attempt random draws."""
+    ids = [int(i) for i in ids]
+    param = (json.dumps(ids),)
+    order = {qid: n for n, qid in enumerate(ids)}
+    questions = sorted(db.query_records(QUESTIONS_BY_ID_SQL, param, replica=True),
+                       key=lambda q: order[q["id"]])
+    return _with_choices(questions, db.query(CHOICES_BY_ID_SQL, param, replica=True))
+
+
+def existing_question_ids(ids):
+    """The subset of `ids` that are still in the question bank."""
+    param = (json.dumps([int(i) for i in ids]),)
+    return {qid for qid, in db.query(QUESTION_IDS_SQL, param, replica=True)}
+
+
+def data_version():
+    """Version of the cached catalog data; it changes after every write,
+    in this process or (once the shared version is polled) another one."""
+    return get_cache().version
+
+
+def load_test_page(test_id, page, page_size):
+    """One page (0-based) of a test's questions, same keys as
+    load_test_questions()."""
+    test_id, page, page_size = int(test_id), int(page), int(page_size)
+    return get_cache().get_or_load(
+        ("test_page", test_id, page, page_size),
+        lambda: _load_test_questions(test_id, page_size, page * page_size),
+    )
+
+
+_prefetcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+
+def prefetch_test_page(test_id, page, page_size):
+    """Warm the cache with a page in the background; errors are ignored,
+    the page is simply loaded synchronously when it is shown."""
+    _prefetcher.submit(load_test_page, test_id, page, page_size)
+
+
+TEST_SUMMARY_SQL = """
+    SELECT COUNT(*), COALESCE(SUM(q.points), 0) FROM test_questions tq
+      JOIN questions q ON q.id = tq.question_id WHERE tq.test_id = ?
+"""
+
+
+def test_summary(test_id):
+    """(number of questions, max score) of a test."""
+    return get_cache().get_or_load(
+        ("test_summary", int(test_id)),
+        lambda: db.query(TEST_SUMMARY_SQL, (int(test_id),), replica=True)[0],
+    )
+
+
+def _questions_filter(text, exclude_test_id, after_id=0):
+    where, params = [], []
+    if after_id:
+        # keyset paging: the next page starts after the last id shown
+        where.append("id > ?")
+        params.append(int(after_id))
+    match = _fts_query(text or "")
+    if match:
+        where.append("id IN (SELECT rowid FROM questions_fts WHERE questions_fts MATCH ?)")
+        params.append(match)
+    if exclude_test_id is not None:
+        where.append("id NOT IN (SELECT question_id FROM test_questions WHERE test_id = ?)")
+        params.append(int(exclude_test_id))
+    sql = " WHERE " + " AND ".join(where) if where else ""
+    return sql, params
+
+
+def search_questions_sql(text, limit, exclude_test_id=None, after_id=0):
+    """-> (sql, params) of search_questions(); also checked by query_plans."""
+    where, params = _questions_filter(text, exclude_test_id, after_id)
+    return f"SELECT id, text FROM questions{where} ORDER BY id LIMIT ?", params + [int(limit)]
+
+
+def search_questions(text="", limit=50, exclude_test_id=None, after_id=0):
+    """[(id, text), ...] of up to `limit` questions matching a prefix search,
+    ordered by id and starting after `after_id`; optionally skipping
+    questions already in a test."""
+    sql, params = search_questions_sql(text, limit, exclude_test_id, after_id)
+    return get_cache().get_or_load(
+        ("search_questions", text, int(limit), exclude_test_id, int(after_id)),
+        lambda: db.query(sql, params, replica=True),
+    )
+
+
+QUESTION_TYPES = ("Один ответ", "Множественный выбор", TEXT_TYPE)
+
+
+def validate_question(text, qtype, choices, correct, points, answer_rules=None):
+    """Rules of add_question_page; returns an error message or None.
+
+    choices is the list of options ([] for text questions), correct the
+    list of correct option texts (accepted answers for "Текстовый ответ").
+    """
+    if not text:
+        return "Введите текст вопроса."
+    if qtype not in QUESTION_TYPES:
+        return f"Неизвестный тип вопроса: {qtype}"
+    if qtype != TEXT_TYPE:
+        if not choices:
+            return "Добавьте хотя бы один вариант."
+        if not correct or any(not c for c in correct):
+            return "Выберите правильный(ые) ответ(ы)."
+        if any(c not in choices for c in correct):
+            return "Правильный ответ должен быть одним из вариантов."
+        if qtype == "Один ответ" and len(correct) != 1:
+            return "У вопроса с одним ответом должен быть ровно один правильный вариант."
+    elif not correct or any(not c for c in correct):
+        return "Введите текстовый ответ."
+    elif answer_rules:
+        error = text_answers.validate_rules(answer_rules)
+        if error:
+            return error
+    if not isinstance(points, int) or points < 1:
+        return "Баллы должны быть целым числом не меньше 1."
+    return None
+
+
+def question_hash(text, qtype, choices, correct):
+    """Content hash used to skip duplicate questions on import."""
+    payload = json.dumps(
+        [text.strip(), qtype, list(choices), sorted(correct)], ensure_ascii=False
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+INSERT_QUESTION_SQL = ("INSERT INTO questions (text,type,points,tags,content_hash,answer_rules)"
+                       " VALUES (?,?,?,?,?,?)")
+INSERT_CHOICE_SQL = ("INSERT INTO question_choices (question_id, ordinal, text, is_correct)"
+                     " VALUES (?,?,?,?)")
+
+
+def insert_question(conn, text, qtype, choices, correct, points, tags, answer_rules=None):
+    """Insert a question with its options; return the new id.
+
+    correct is a list of option texts (accepted answers for "Текстовый
+    ответ", matched with answer_rules). Call inside the write transaction.
+    """
+    rules = text_answers.dump_rules(answer_rules) if qtype == TEXT_TYPE else None
+    qid = conn.execute(
+        INSERT_QUESTION_SQL,
+        (text, qtype, points, tags, question_hash(text, qtype, choices, correct), rules),
+    ).lastrowid
+    if qtype == TEXT_TYPE:
+        rows = [(qid, i, c, 1) for i, c in enumerate(correct)]
+    else:
+        rows = [(qid, i, c, int(c in correct)) for i, c in enumerate(choices)]
+    conn.executemany(INSERT_CHOICE_SQL, rows)
+    return qid
+
+
+# ---------------------------------
+# Tags and search over the test list
+# ---------------------------------
+def split_tags(tags):
+    """'a, b,,a' -> ['a', 'b'] (stripped, deduplicated, order kept)."""
+    out = []
+    for t in (tags or "").split(","):
+        t = t.strip()
+        if t and t not in out:
+            out.append(t)
+    return out
+
+
+DELETE_TEST_TAGS_SQL = "DELETE FROM test_tags WHERE test_id=?"
+INSERT_TEST_SQL = "INSERT INTO tests (name, description, tags) VALUES (?, ?, ?)"
+INSERT_TEST_QUESTION_SQL = (
+    "INSERT INTO test_questions (test_id, question_id, position) VALUES (?, ?, ?)"
+)
+INSERT_TEST_TAG_SQL = "INSERT INTO test_tags (tag, test_id) VALUES (?, ?)"
+
+
+def replace_test_tags(conn, test_id, tags):
+    """Rewrite test_tags rows of one test; call inside the write transaction."""
+    conn.execute(DELETE_TEST_TAGS_SQL, (test_id,))
+    conn.executemany(INSERT_TEST_TAG_SQL, [(t, test_id) for t in split_tags(tags)])
+
+
+def _fts_query(text):
+    # every word becomes a quoted prefix term: мат шаш -> "мат"* "шаш"*
+    words = [w.replace('"', '""') for w in text.split()]
+    return " ".join(f'"{w}"*' for w in words if w)
+
+
+def _tests_filter(tags, name_query):
+    where, params = [], []
+    if tags:
+        marks = ",".join("?" * len(tags))
+        where.append(f"t.id IN (SELECT test_id FROM test_tags WHERE tag IN ({marks}))")
+        params.extend(tags)
+    match = _fts_query(name_query or "")
+    if match:
+        where.append("t.id IN (SELECT rowid FROM tests_fts WHERE tests_fts MATCH ?)")
+        params.append(match)
+    sql = " WHERE " + " AND ".join(where) if where else ""
+    return sql, params
+
+
+LOAD_TAGS_SQL = "SELECT DISTINCT tag FROM test_tags ORDER BY tag"
+
+
+def load_tags():
+    """Sorted list of all distinct test tags."""
+    return get_cache().get_or_load(
+        ("tags",),
+        lambda: [r[0] for r in db.query(LOAD_TAGS_SQL, replica=True)],
+    )
+
+
+def count_tests_sql(tags, name_query):
+    """-> (sql, params) of count_tests(); also checked by query_plans."""
+    where, params = _tests_filter(tags, name_query)
+    return f"SELECT COUNT(*) FROM tests t{where}", params
+
+
+def count_tests(tags=(), name_query=""):
+    """Number of tests matching any of `tags` and the name/description search."""
+    tags = tuple(tags)
+    sql, params = count_tests_sql(tags, name_query)
+    return get_cache().get_or_load(
+        ("count_tests", tags, name_query),
+        lambda: db.query(sql, params, replica=True)[0][0],
+    )
+
+
+def search_tests_sql(tags, name_query, page, page_size):
+    """-> (sql, params) of search_tests(); also checked by query_plans."""
+    where, params = _tests_filter(tags, name_query)
+    return (
+        f"SELECT t.id, t.name, t.description, t.tags FROM tests t{where}"
+        " ORDER BY t.id LIMIT ? OFFSET ?",
+        params + [page_size, (int(page) - 1) * page_size],
+    )
+
+
+def search_tests(tags=(), name_query="", page=1, page_size=5):
+    """One page (1-based) of matching tests as a DataFrame, ordered by id."""
+    tags = tuple(tags)
+    sql, params = search_tests_sql(tags, name_query, page, page_size)
+    return get_cache().get_or_load(
+        ("search_tests", tags, name_query, int(page), page_size),
+        lambda: db.query_df(sql, params=params, replica=True),
+    )
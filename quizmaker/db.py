@@ -0,0 +1,399 @@
+"""Shared database access layer.
+
+All pages borrow connections from one process-wide pool instead of calling
+sqlite3.connect() themselves. Connections run in WAL mode so readers never
+block the writer, and every write starts with BEGIN IMMEDIATE so lock waits
+are handled by busy_timeout (plus a few retries) instead of failing with
+"database is locked".
+
+Storage is SQLite only: the database is addressed by a file path or a
+sqlite:/// URL, and every process writes that one file directly. WAL mode
+needs shared memory between the processes using the file, so it must be
+on a local disk and every app process must run on that same host: WAL
+does not work across hosts or on network filesystems. This is a
+single-host setup, not horizontal scale-out. The SQL throughout the
+package (FTS5, json_each, PRAGMAs, the backup API) is SQLite's own.
+Besides the primary (QUIZMAKER_DB), read-only replicas can be listed in
+QUIZMAKER_DB_REPLICAS (separated by os.pathsep), e.g. a copy kept by
+Litestream/LiteFS, to take read load off the primary file. Reads that
+tolerate lag (catalog, leaderboard) pass replica=True and are spread
+round-robin over the replicas; a replica that fails is skipped for
+REPLICA_RETRY seconds and the read goes to the primary.
+
+Consistency model:
+  * every write goes to the primary, serialized by BEGIN IMMEDIATE;
+  * a session that wrote (transaction() or a queued score) reads from the
+    primary for PRIMARY_STICKY seconds, so it sees its own changes;
+  * everyone else may read data up to the replica lag old; cached catalog
+    reads are additionally bounded by catalog's shared version check;
+  * scores are write-behind (see score_writer): accepted by the process
+    queue, committed on the primary within FLUSH_INTERVAL, and the
+    leaderboard aggregates change in the same transaction, so a board is
+    never ahead of or inconsistent with the scores it is built from.
+"""
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.environ.get("QUIZMAKER_DB") or os.path.join(PROJECT_ROOT, "data", "questions.db")
+
+POOL_SIZE = 8               # max open connections per process
+POOL_TIMEOUT = 30.0         # seconds to wait for a free connection
+BUSY_TIMEOUT_MS = 5000      # sqlite busy handler, per statement
+LOCK_RETRIES = 5            # extra attempts after busy_timeout gave up
+STATEMENT_CACHE = 256       # prepared statements kept per connection
+REPLICAS = [u for u in os.environ.get("QUIZMAKER_DB_REPLICAS", "").split(os.pathsep) if u]
+REPLICA_RETRY = 30.0        # seconds a failed replica is left out
+PRIMARY_STICKY = 5.0        # seconds a session reads the primary after writing
+
+log = logging.getLogger(__name__)
+
+
+def _is_lock_error(exc):
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+class ConnectionPool:
+    """Thread-safe pool of sqlite3 connections to a single database file."""
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._trace = None
+        self._trace_used = False
+        self._stats = {"hits": 0, "created": 0, "waits": 0, "lock_retries": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _connect(self):
+        if self.readonly:
+            # replicas are maintained by someone else; never create or migrate them
+            target, uri = f"file:{self.path}?mode=ro", True
+        else:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            target, uri = self.path, False
+        # isolation_level=None: autocommit for reads, explicit BEGIN for writes
+        conn = sqlite3.connect(
+            target,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE,
+            uri=uri,
+        )
+        if not self.readonly:
+            # only takes effect on a new, empty file (before WAL is set up);
+            # older databases are converted by `quizmaker.maintenance convert`
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        # ON DELETE CASCADE of the link tables (see quizmaker.editing)
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        conn = self._acquire()
+        if self._trace_used:
+            conn.set_trace_callback(self._trace)
+        return conn
+
+    def _acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            self._count("hits")
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            self._count("created")
+            return conn
+
+        self._count("waits")
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("Нет свободных подключений к БД") from None
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def retry(self, fn):
+        """Call fn(), retrying with backoff while the database is locked."""
+        for attempt in range(LOCK_RETRIES + 1):
+            try:
+                return fn()
+            except sqlite3.OperationalError as exc:
+                if not _is_lock_error(exc) or attempt == LOCK_RETRIES:
+                    raise
+                self._count("lock_retries")
+                time.sleep(0.05 * 2 ** attempt)
+
+    def set_trace(self, callback):
+        """Call callback(sql) for every statement run on pooled connections
+        borrowed from now on; None switches tracing off."""
+        self._trace = callback
+        self._trace_used = True
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["open"] = self._created
+        out["idle"] = self._idle.qsize()
+        return out
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+
+
+def parse_url(url):
+    """'sqlite:///x.db' / 'sqlite:////abs/x.db' / bare path -> (scheme, rest)."""
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        return "sqlite", url
+    if scheme == "sqlite":
+        rest = rest[1:]
+    return scheme, rest
+
+
+def open_pool(url, readonly=False):
+    """Pool for a database URL: a file path, sqlite:///relative.db or
+    sqlite:////absolute/path.db."""
+    scheme, rest = parse_url(url)
+    if scheme != "sqlite":
+        raise ValueError(f"Неподдерживаемая СУБД: {scheme}")
+    return ConnectionPool(rest, readonly=readonly)
+
+
+class ReplicaRouter:
+    """Round-robin over read-only replica pools, skipping failed ones."""
+
+    def __init__(self, urls):
+        self.pools = [open_pool(u, readonly=True) for u in urls]
+        self._turn = itertools.count()
+        self._down_until = [0.0] * len(self.pools)
+        self._stats = {"reads": 0, "failovers": 0}
+        self._lock = threading.Lock()
+
+    def pick(self):
+        now = time.monotonic()
+        for _ in range(len(self.pools)):
+            i = next(self._turn) % len(self.pools)
+            if self._down_until[i] <= now:
+                with self._lock:
+                    self._stats["reads"] += 1
+                return self.pools[i]
+        return None
+
+    def mark_down(self, pool):
+        i = self.pools.index(pool)
+        self._down_until[i] = time.monotonic() + REPLICA_RETRY
+        with self._lock:
+            self._stats["failovers"] += 1
+
+    def set_trace(self, callback):
+        for pool in self.pools:
+            pool.set_trace(callback)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        now = time.monotonic()
+        out["replicas"] = len(self.pools)
+        out["down"] = sum(until > now for until in self._down_until)
+        return out
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+
+
+@st.cache_resource
+def get_pool():
+    return open_pool(DB_PATH)
+
+
+@st.cache_resource
+def get_router():
+    return ReplicaRouter(REPLICAS)
+
+
+def use_database(path):
+    """Point this process at another database file (CLIs, benchmarks).
+
+    Replicas are dropped: they belong to the configured primary. Callers
+    should also call catalog.invalidate() so cached reads of the previous
+    file are dropped.
+    """
+    global DB_PATH
+    get_pool().close()
+    get_pool.clear()
+    get_router().close()
+    get_router.clear()
+    REPLICAS.clear()
+    DB_PATH = path
+
+
+# read-your-writes: session id -> monotonic time until which it reads the primary
+_primary_until = {}
+
+
+def prefer_primary(seconds=PRIMARY_STICKY):
+    """Send this session's replica reads to the primary for a while."""
+    if not REPLICAS:
+        return
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return
+    now = time.monotonic()
+    for session, until in list(_primary_until.items()):
+        if until < now:
+            _primary_until.pop(session, None)
+    _primary_until[ctx.session_id] = now + seconds
+
+
+def _replica_pool():
+    if not REPLICAS:
+        return None
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is not None and _primary_until.get(ctx.session_id, 0.0) > time.monotonic():
+        return None
+    return get_router().pick()
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection (autocommit) for reads."""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+# Optional callback(kind, sql, seconds, result) for transaction() and the
+# read helpers below, installed by quizmaker.profiling.
+_observer = None
+
+
+@contextmanager
+def transaction():
+    """Borrow a connection inside BEGIN IMMEDIATE ... COMMIT."""
+    prefer_primary()
+    pool = get_pool()
+    observer = _observer
+    started = time.perf_counter()
+    with pool.connection() as conn:
+        pool.retry(lambda: conn.execute("BEGIN IMMEDIATE"))
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        pool.retry(conn.commit)
+    if observer is not None:
+        # lock wait, every statement of the block and the commit
+        observer("transaction", "BEGIN IMMEDIATE", time.perf_counter() - started, None)
+
+
+def set_observer(callback):
+    global _observer
+    _observer = callback
+
+
+def _observed(kind, sql, fn):
+    observer = _observer
+    if observer is None:
+        return fn()
+    started = time.perf_counter()
+    result = fn()
+    observer(kind, sql, time.perf_counter() - started, result)
+    return result
+
+
+def _read(kind, sql, run, replica):
+    pool = _replica_pool() if replica else None
+    if pool is not None:
+        try:
+            with pool.connection() as conn:
+                return _observed(kind, sql, lambda: pool.retry(lambda: run(conn)))
+        except sqlite3.Error as exc:
+            # missing file, lagging schema, ...: fall back to the primary
+            log.warning("Реплика %s недоступна: %s", pool.path, exc)
+            get_router().mark_down(pool)
+    with connection() as conn:
+        return _observed(kind, sql, lambda: get_pool().retry(lambda: run(conn)))
+
+
+def query(sql, params=(), replica=False):
+    """Run a SELECT and return all rows as tuples.
+
+    replica=True allows serving the read from a replica (see module doc).
+    """
+    return _read("query", sql, lambda conn: conn.execute(sql, params).fetchall(), replica)
+
+
+def query_records(sql, params=(), replica=False):
+    """Run a SELECT and return rows as dicts keyed by column name."""
+    def run(conn):
+        cur = conn.execute(sql, params)
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    return _read("query", sql, run, replica)
+
+
+def query_df(sql, params=(), replica=False):
+    """Run a SELECT and return a pandas DataFrame."""
+    import pandas as pd  # only the pages that show tables pay for pandas
+
+    return _read("query_df", sql, lambda conn: pd.read_sql(sql, conn, params=params), replica)
+
+
+def pool_stats():
+    out = get_pool().stats()
+    if REPLICAS:
+        out["replicas"] = get_router().stats()
+    return out
@@ -0,0 +1,125 @@
+"""Set-based edits of tests and the question bank.
+
+Every function runs in a single BEGIN IMMEDIATE transaction, so two admins
+editing the same test are serialized by SQLite instead of racing between
+a read and the following writes. Id lists are passed as one JSON array
+parameter and expanded with json_each, so an edit costs a fixed number of
+statements however many ids it touches.
+
+Deleting a test or a question relies on the ON DELETE CASCADE foreign keys
+(migration 11, PRAGMA foreign_keys=ON on every connection) to remove its
+test_questions, question_choices, test_pools and test_snapshots rows. Positions inside a
+test are kept gapless, 1..n, by renumber().
+"""
+import json
+
+from quizmaker import catalog, db, snapshots
+
+APPEND_SQL = """
+    INSERT INTO test_questions (test_id, question_id, position)
+    SELECT :test_id, n.question_id,
+           (SELECT COALESCE(MAX(position), 0) FROM test_questions WHERE test_id = :test_id)
+           + ROW_NUMBER() OVER (ORDER BY n.ord)
+      FROM (SELECT value AS question_id, MIN(key) AS ord
+              FROM json_each(:ids) GROUP BY value) n
+     WHERE n.question_id IN (SELECT id FROM questions)
+       AND n.question_id NOT IN (SELECT question_id FROM test_questions WHERE test_id = :test_id)
+"""
+REMOVE_SQL = """
+    DELETE FROM test_questions
+     WHERE test_id = ? AND question_id IN (SELECT value FROM json_each(?))
+"""
+# one UPDATE for any number of tests; rows already in place are not rewritten
+RENUMBER_SQL = """
+    UPDATE test_questions SET position = r.rn
+      FROM (SELECT test_id, question_id,
+                   ROW_NUMBER() OVER (PARTITION BY test_id ORDER BY position, question_id) AS rn
+              FROM test_questions
+             WHERE test_id IN (SELECT value FROM json_each(?))) r
+     WHERE test_questions.test_id = r.test_id
+       AND test_questions.question_id = r.question_id
+       AND test_questions.position IS NOT r.rn
+"""
+TESTS_OF_QUESTIONS_SQL = """
+    SELECT DISTINCT test_id FROM test_questions
+     WHERE question_id IN (SELECT value FROM json_each(?))
+"""
+DELETE_QUESTIONS_SQL = "DELETE FROM questions WHERE id IN (SELECT value FROM json_each(?))"
+DELETE_TESTS_SQL = "DELETE FROM tests WHERE id IN (SELECT value FROM json_each(?))"
+
+
+def _ids(ids):
+    return json.dumps([int(i) for i in ids])
+
+
+def renumber(conn, test_ids):
+    """Close position gaps of the given tests; call inside the write transaction."""
+    conn.execute(RENUMBER_SQL, (_ids(test_ids),))
+
+
+def create_question(text, qtype, choices, correct, points, tags, answer_rules=None):
+    """Validate (catalog.validate_question) and insert one question; returns
+    its id. ValueError carries the validation message."""
+    error = catalog.validate_question(text, qtype, choices, correct, points, answer_rules)
+    if error:
+        raise ValueError(error)
+    with db.transaction() as conn:
+        qid = catalog.insert_question(conn, text, qtype, choices, correct, points, tags,
+                                      answer_rules)
+    catalog.invalidate()
+    return qid
+
+
+def create_test(name, description, tags, question_ids):
+    """Create a test with the given questions in order; returns (test id,
+    number of questions added). Ids no longer in the bank are skipped; if
+    none is left, nothing is created and ValueError is raised."""
+    with db.transaction() as conn:
+        test_id = conn.execute(catalog.INSERT_TEST_SQL, (name, description, tags)).lastrowid
+        catalog.replace_test_tags(conn, test_id, tags)
+        added = conn.execute(APPEND_SQL, {"test_id": test_id, "ids": _ids(question_ids)}).rowcount
+        if not added:
+            raise ValueError("Выбранных вопросов больше нет в базе.")
+    catalog.invalidate()
+    return test_id, added
+
+
+def add_questions(test_id, question_ids):
+    """Append questions to the end of a test in the given order; returns how
+    many were added (ids already in the test or missing from the bank are skipped)."""
+    with db.transaction() as conn:
+        added = conn.execute(
+            APPEND_SQL, {"test_id": int(test_id), "ids": _ids(question_ids)}
+        ).rowcount
+    catalog.invalidate()
+    return added
+
+
+def remove_questions(test_id, question_ids):
+    """Take questions out of a test (they stay in the bank); returns the count."""
+    with db.transaction() as conn:
+        removed = conn.execute(REMOVE_SQL, (int(test_id), _ids(question_ids))).rowcount
+        renumber(conn, [test_id])
+    catalog.invalidate()
+    return removed
+
+
+def delete_questions(question_ids):
+    """Delete questions from the bank, with their options and test links."""
+    ids = _ids(question_ids)
+    with db.transaction() as conn:
+        tests = [t for t, in conn.execute(TESTS_OF_QUESTIONS_SQL, (ids,))]
+        deleted = conn.execute(DELETE_QUESTIONS_SQL, (ids,)).rowcount
+        renumber(conn, tests)
+    catalog.invalidate()
+    return deleted
+
+
+def delete_tests(test_ids):
+    """Delete tests; their question links, pool settings, tags and published
+    snapshots go with them."""
+    with db.transaction() as conn:
+        deleted = conn.execute(DELETE_TESTS_SQL, (_ids(test_ids),)).rowcount
+    snapshots.remove_files(test_ids)
+    catalog.invalidate()
+    return deleted
@@ -0,0 +1,153 @@
+"""Answer-key compilation and scoring.
+
+A test's answer key is compiled once per data version (normalized answer
+sets, point vector, type codes) and reused for every submission. score()
+grades one submission in a single pass; score_batch() grades many
+submissions at once with vectorized pandas/NumPy operations, e.g. to
+re-grade stored attempts after an answer key was fixed.
+
+Options are compared after strip().lower(); text answers go through the
+question's compiled text_answers.Matcher (normalization, alternatives,
+patterns, edit distance).
+"""
+import numpy as np
+
+from quizmaker import catalog, text_answers
+
+SINGLE, MULTI, TEXT = 0, 1, 2
+# options past this position are not recorded in a response bitmask
+MAX_CHOICES = 63
+TYPE_CODES = {
+    "Один ответ": SINGLE,
+    "Множественный выбор": MULTI,
+    "Текстовый ответ": TEXT,
+}
+
+
+def normalize(answer):
+    return str(answer).strip().lower()
+
+
+def _given(answer):
+    if answer is None:
+        return frozenset()
+    if isinstance(answer, (list, tuple, set, frozenset)):
+        return frozenset(normalize(a) for a in answer)
+    return frozenset((normalize(answer),))
+
+
+class AnswerKey:
+    """Compiled answer key of one test, questions in test order."""
+
+    def __init__(self, questions):
+        self.ids = tuple(int(q["id"]) for q in questions)
+        self.types = np.array([TYPE_CODES.get(q["type"], TEXT) for q in questions], dtype=np.int8)
+        self.points = np.array([int(q["points"] or 0) for q in questions], dtype=np.int64)
+        self.correct = tuple(frozenset(normalize(c) for c in q["correct"]) for q in questions)
+        # compiled matchers of text questions (None for choice questions)
+        self.matchers = tuple(
+            text_answers.compile_matcher(q["correct"], q.get("answer_rules"))
+            if code == TEXT else None
+            for q, code in zip(questions, self.types.tolist())
+        )
+        self.max_score = int(self.points.sum())
+        self._points = self.points.tolist()
+        self._batch = None
+
+    def score(self, answers):
+        """answers: {question_id: str | list[str]} -> points earned."""
+        total = 0
+        for ok, pts in zip(self.marks(answers), self._points):
+            if ok:
+                total += pts
+        return total
+
+    def marks(self, answers):
+        """Per-question correctness (list of bools, in key order)."""
+        return [
+            match(answers.get(qid)) if match is not None
+            else _given(answers.get(qid)) == correct
+            for qid, correct, match in zip(self.ids, self.correct, self.matchers)
+        ]
+
+    def score_batch(self, responses):
+        """Grade many submissions at once.
+
+        responses: DataFrame with columns submission, question_id, answer —
+        one row per chosen option (text answers: one row). Returns a Series
+        of points per submission.
+        """
+        import pandas as pd  # batch grading only; page renders never need it
+
+        if self._batch is None:
+            # long (question position, normalized answer) table of right
+            # options; a text question needs exactly one matching answer
+            pairs = [(pos, a) for pos, answers in enumerate(self.correct)
+                     if self.matchers[pos] is None for a in answers]
+            self._batch = (
+                pd.Series(np.arange(len(self.ids)), index=self.ids),
+                np.where(self.types == TEXT, 1, [len(c) for c in self.correct]).astype(np.int64),
+                pd.MultiIndex.from_tuples(pairs, names=["q", "answer"]) if pairs
+                else pd.MultiIndex.from_arrays([[], []], names=["q", "answer"]),
+            )
+        position, n_correct, correct_pairs = self._batch
+
+        raw = responses["answer"].astype(str)
+        df = pd.DataFrame({
+            "submission": responses["submission"].to_numpy(),
+            "q": responses["question_id"].map(position).to_numpy(),
+            "answer": raw.str.strip().str.lower().to_numpy(),
+            "raw": raw.to_numpy(),
+        })
+        sub_codes, subs = pd.factorize(df["submission"])
+        df["sub"] = sub_codes
+        df = df.dropna(subset=["q"]).drop_duplicates(["sub", "q", "answer"])
+        q = df["q"].to_numpy(dtype=np.int64)
+        s = df["sub"].to_numpy(dtype=np.int64)
+        hit = pd.MultiIndex.from_arrays([q, df["answer"].to_numpy()]).isin(correct_pairs)
+        text = self.types[q] == TEXT
+        if text.any():
+            hit[text] = [self.matchers[i](a) for i, a in zip(q[text], df["raw"].to_numpy()[text])]
+
+        # per (submission, question): how many chosen answers are right / wrong
+        shape = (len(subs), len(self.ids))
+        hits = np.zeros(shape, dtype=np.int64)
+        misses = np.zeros(shape, dtype=np.int64)
+        np.add.at(hits, (s[hit], q[hit]), 1)
+        np.add.at(misses, (s[~hit], q[~hit]), 1)
+        ok = (hits == n_correct) & (misses == 0)
+        return pd.Series(ok @ self.points, index=subs, name="score")
+
+
+def encode_responses(questions, answers, marks):
+    """Rows for ScoreWriter.submit_attempt: (question_id, choices mask,
+    text answer, correct) per question, unanswered ones included."""
+    rows = []
+    for q, ok in zip(questions, marks):
+        given = answers.get(q["id"])
+        if q["type"] == catalog.TEXT_TYPE:
+            rows.append((q["id"], None, (given or "").strip() or None, int(ok)))
+            continue
+        chosen = set(given) if isinstance(given, (list, tuple)) else {given}
+        mask = 0
+        for pos, option in enumerate(q["choices"][:MAX_CHOICES]):
+            if option in chosen:
+                mask |= 1 << pos
+        rows.append((q["id"], mask, None, int(ok)))
+    return rows
+
+
+def get_key(test_id):
+    """Compiled answer key of a test, cached until the next catalog write."""
+    return catalog.get_cache().get_or_load(
+        ("answer_key", int(test_id)),
+        lambda: AnswerKey(catalog.load_test_questions(test_id)),
+    )
+
+
+def get_page_key(test_id, page, page_size):
+    """Answer key of one page of a test (see catalog.load_test_page)."""
+    return catalog.get_cache().get_or_load(
+        ("answer_key_page", int(test_id), int(page), int(page_size)),
+        lambda: AnswerKey(catalog.load_test_page(test_id, page, page_size)),
+    )
@@ -0,0 +1,84 @@
+"""Leaderboard reads over the materialized score aggregates.
+
+user_totals, user_test_totals and user_period_totals are kept current by
+triggers on scores (migration 3, "leaderboard aggregates", in
+quizmaker.migrations), so every board is an index range scan over at most
+one page of rows and never touches the scores table.
+"""
+from quizmaker import db
+
+PERIODS = ("day", "week")
+
+# bucket of the current day / week, same expressions as in the triggers
+_BUCKET = {
+    "day": "date('now')",
+    "week": "date('now', 'weekday 0', '-6 days')",
+}
+
+
+def _board(test_id=None, period=None):
+    """-> (table, WHERE clause, params) for the requested board."""
+    if test_id is not None and period is not None:
+        raise ValueError("Рейтинг по тесту доступен только за всё время")
+    if test_id is not None:
+        return "user_test_totals", " WHERE test_id = ?", [int(test_id)]
+    if period is not None:
+        if period not in PERIODS:
+            raise ValueError(f"Неизвестный период: {period}")
+        return "user_period_totals", f" WHERE period = ? AND bucket = {_BUCKET[period]}", [period]
+    return "user_totals", "", []
+
+
+def top_sql(limit, offset, test_id=None, period=None):
+    """-> (sql, params) of top(); also checked by query_plans."""
+    table, where, params = _board(test_id, period)
+    return (
+        f"SELECT user, total_score FROM {table}{where}"
+        " ORDER BY total_score DESC, user LIMIT ? OFFSET ?",
+        params + [limit, offset],
+    )
+
+
+def top(limit=10, offset=0, test_id=None, period=None):
+    """[(rank, user, total_score), ...] for one page of a board."""
+    rows = db.query(*top_sql(limit, offset, test_id, period), replica=True)
+    return [(offset + i, user, score) for i, (user, score) in enumerate(rows, start=1)]
+
+
+def count_sql(test_id=None, period=None):
+    """-> (sql, params) of count(); also checked by query_plans."""
+    table, where, params = _board(test_id, period)
+    return f"SELECT COUNT(*) FROM {table}{where}", params
+
+
+def count(test_id=None, period=None):
+    """Number of users on a board."""
+    return db.query(*count_sql(test_id, period), replica=True)[0][0]
+
+
+def rebuild(conn):
+    """Recompute all aggregates from scores; call inside a write transaction.
+
+    Only needed once, when the aggregate tables are first created on a
+    database that already has scores.
+    """
+    conn.execute("DELETE FROM user_totals")
+    conn.execute("DELETE FROM user_test_totals")
+    conn.execute("DELETE FROM user_period_totals")
+    conn.execute("""
+        INSERT INTO user_totals (user, total_score, attempts)
+        SELECT user, SUM(score), COUNT(*) FROM scores GROUP BY user
+    """)
+    conn.execute("""
+        INSERT INTO user_test_totals (test_id, user, total_score, attempts)
+        SELECT test_id, user, SUM(score), COUNT(*) FROM scores
+         WHERE test_id IS NOT NULL GROUP BY test_id, user
+    """)
+    conn.execute("""
+        INSERT INTO user_period_totals (period, bucket, user, total_score, attempts)
+        SELECT 'day', date(timestamp), user, SUM(score), COUNT(*)
+          FROM scores GROUP BY 2, user
+        UNION ALL
+        SELECT 'week', date(timestamp, 'weekday 0', '-6 days'), user, SUM(score), COUNT(*)
+          FROM scores GROUP BY 2, user
+    """)
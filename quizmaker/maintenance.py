@@ -0,0 +1,366 @@
+"""Database maintenance: incremental vacuum, statistics and online backup.
+
+Three tasks, each done in small steps so readers (WAL) are never blocked
+and writers wait at most one step:
+
+  * vacuum — PRAGMA incremental_vacuum, VACUUM_STEP pages per BEGIN
+    IMMEDIATE transaction, until the freelist is empty, then a PASSIVE WAL checkpoint
+    so the file actually shrinks. Needs auto_vacuum=INCREMENTAL: new
+    databases get it from db._connect, existing ones are converted once
+    with `convert` (a full VACUUM that blocks writers while it runs);
+  * analyze — ANALYZE bounded by PRAGMA analysis_limit, then PRAGMA
+    optimize, so the planner has fresh sqlite_stat1 statistics;
+  * backup — sqlite3.Connection.backup() of one read snapshot (WAL
+    writers go on; their commits do not restart the copy), BACKUP_STEP
+    pages per step with STEP_PAUSE between steps, into a temporary file
+    that is checked and renamed to <backup dir>/<name>-YYYYmmdd-HHMMSS.db
+    once complete. The backup dir is QUIZMAKER_BACKUPS or "<database
+    name>-backups"; the newest BACKUP_KEEP backups are kept.
+
+Every run is recorded in maintenance_runs (migration 15) with its report:
+duration of each task, pages/bytes reclaimed, backup size and throughput.
+The background scheduler is opt-in: with QUIZMAKER_MAINTENANCE_INTERVAL
+set to a number of seconds (e.g. 21600 for every 6 hours; the default 0
+leaves it off) the app process runs all tasks from a background thread
+that often. The run is claimed in maintenance_runs, so several app
+processes on one database do not repeat each other's work. Without it,
+run the CLI below from cron or by hand.
+
+    python -m quizmaker.maintenance all
+    python -m quizmaker.maintenance vacuum analyze
+    python -m quizmaker.maintenance backup --dest /mnt/backups
+    python -m quizmaker.maintenance convert
+    python -m quizmaker.maintenance status
+"""
+import argparse
+import atexit
+import glob
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from quizmaker import db, migrations
+
+INTERVAL = float(os.environ.get("QUIZMAKER_MAINTENANCE_INTERVAL", 0))   # seconds; 0 = off
+FIRST_DELAY = 60.0     # seconds after app start before the first check
+CHECK_EVERY = 300.0    # seconds between checks whether a run is due
+VACUUM_STEP = 256      # pages freed per write transaction
+BACKUP_STEP = 1024     # pages copied per backup step
+STEP_PAUSE = 0.005     # seconds between steps, so writers get the lock
+ANALYSIS_LIMIT = 1000  # rows sampled per index by ANALYZE
+BACKUP_KEEP = 3
+RUNS_KEEP = 1000       # rows kept in maintenance_runs
+TASKS = ("vacuum", "analyze", "backup")
+
+CLAIM_SQL = """
+    SELECT 1 FROM maintenance_runs WHERE started_at > datetime('now', ?) LIMIT 1
+"""
+START_SQL = "INSERT INTO maintenance_runs (tasks) VALUES (?) RETURNING id"
+FINISH_SQL = """
+    UPDATE maintenance_runs SET finished_at = CURRENT_TIMESTAMP, report = ? WHERE id = ?
+"""
+PRUNE_SQL = "DELETE FROM maintenance_runs WHERE id <= ? - ?"
+RUNS_SQL = """
+    SELECT id, tasks, started_at, finished_at, report FROM maintenance_runs
+     ORDER BY id DESC LIMIT ?
+"""
+
+log = logging.getLogger(__name__)
+
+_last = {}   # task -> report of its last run in this process
+_last_lock = threading.Lock()
+
+
+def backup_dir():
+    return os.environ.get("QUIZMAKER_BACKUPS") or (
+        os.path.splitext(db.parse_url(db.DB_PATH)[1])[0] + "-backups"
+    )
+
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def _file_bytes(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def info():
+    """Page counts and file sizes of the primary database."""
+    path = db.get_pool().path
+    with db.connection() as conn:
+        out = {name: _pragma(conn, name)
+               for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")}
+    out["auto_vacuum"] = {0: "none", 1: "full", 2: "incremental"}[out["auto_vacuum"]]
+    out["file_bytes"] = _file_bytes(path)
+    out["wal_bytes"] = _file_bytes(path + "-wal")
+    return out
+
+
+def vacuum(step=VACUUM_STEP, pause=STEP_PAUSE):
+    """Return free pages to the file system, `step` pages per transaction."""
+    started = time.perf_counter()
+    path = db.get_pool().path
+    size_before = _file_bytes(path)
+    with db.connection() as conn:
+        mode = _pragma(conn, "auto_vacuum")
+        page_size = _pragma(conn, "page_size")
+        free_before = _pragma(conn, "freelist_count")
+    report = {"freelist_before": free_before, "steps": 0}
+    if mode != 2:
+        report["skipped"] = "auto_vacuum не INCREMENTAL, нужен convert"
+    else:
+        while True:
+            with db.transaction() as conn:
+                free = _pragma(conn, "freelist_count")
+                if not free:
+                    break
+                # the pragma frees one page per sqlite3_step, and the sqlite3
+                # module steps a statement without result columns only once
+                for _ in range(min(free, step)):
+                    conn.execute("PRAGMA incremental_vacuum(1)")
+            report["steps"] += 1
+            time.sleep(pause)
+        # pages moved out of the WAL let the database file shrink
+        with db.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    with db.connection() as conn:
+        free_after = _pragma(conn, "freelist_count")
+    report.update(
+        pages_reclaimed=free_before - free_after,
+        bytes_reclaimed=(free_before - free_after) * page_size,
+        file_bytes_before=size_before,
+        file_bytes_after=_file_bytes(path),
+        seconds=round(time.perf_counter() - started, 3),
+    )
+    return report
+
+
+def analyze(limit=ANALYSIS_LIMIT):
+    """Refresh the planner statistics with a bounded ANALYZE."""
+    started = time.perf_counter()
+    with db.transaction() as conn:
+        conn.execute(f"PRAGMA analysis_limit={int(limit)}")
+        try:
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.execute("PRAGMA analysis_limit=0")
+        tables = conn.execute("SELECT COUNT(DISTINCT tbl) FROM sqlite_stat1").fetchone()[0]
+    return {"tables": tables, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _prune_backups(directory, name, keep):
+    for old in sorted(glob.glob(os.path.join(directory, f"{name}-*.db")))[:-keep]:
+        os.remove(old)
+
+
+def backup(dest=None, step=BACKUP_STEP, pause=STEP_PAUSE, keep=BACKUP_KEEP):
+    """Online copy of the primary into `dest` (a directory); returns the report."""
+    directory = dest or backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.splitext(os.path.basename(db.get_pool().path))[0]
+    target_path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.db")
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".db")
+    os.close(fd)
+    counts = {"steps": 0, "pages": 0}
+
+    def progress(status, remaining, total):
+        counts["steps"] += 1
+        counts["pages"] = total
+        # spread the copy's I/O out instead of reading the file in one go
+        time.sleep(pause)
+
+    started = time.perf_counter()
+    try:
+        target = sqlite3.connect(tmp, isolation_level=None)
+        try:
+            with db.connection() as conn:
+                # copy one WAL snapshot: without an open read transaction
+                # every commit by another connection restarts the backup
+                conn.execute("BEGIN")
+                conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+                try:
+                    conn.backup(target, pages=step, progress=progress)
+                finally:
+                    conn.rollback()
+            # a self-contained file, without -wal/-shm companions
+            target.execute("PRAGMA journal_mode=DELETE")
+            check = target.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            target.close()
+        if check != "ok":
+            raise sqlite3.DatabaseError(f"Резервная копия повреждена: {check}")
+        os.replace(tmp, target_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    seconds = time.perf_counter() - started
+    size = _file_bytes(target_path)
+    _prune_backups(directory, name, keep)
+    return {
+        "path": target_path,
+        "pages": counts["pages"],
+        "steps": counts["steps"],
+        "bytes": size,
+        "seconds": round(seconds, 3),
+        "mb_per_s": round(size / 2 ** 20 / seconds, 1) if seconds else None,
+    }
+
+
+def convert():
+    """Switch an existing database to auto_vacuum=INCREMENTAL.
+
+    This is one full VACUUM: it rewrites the whole file and blocks writers
+    while it runs, so do it once, off-peak. Databases created by this
+    version of the app are incremental from the start.
+    """
+    started = time.perf_counter()
+    path = db.get_pool().path
+    size_before = _file_bytes(path)
+    with db.connection() as conn:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        db.get_pool().retry(lambda: conn.execute("VACUUM"))
+        mode = _pragma(conn, "auto_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return {
+        "auto_vacuum": mode,
+        "file_bytes_before": size_before,
+        "file_bytes_after": _file_bytes(path),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _claim(tasks, interval):
+    """Record the start of a run; None if one started less than `interval` ago."""
+    with db.transaction() as conn:
+        if interval and conn.execute(CLAIM_SQL, (f"-{int(interval)} seconds",)).fetchone():
+            return None
+        run_id = conn.execute(START_SQL, (",".join(tasks),)).fetchone()[0]
+        conn.execute(PRUNE_SQL, (run_id, RUNS_KEEP))
+    return run_id
+
+
+def run(tasks=TASKS, interval=0, dest=None):
+    """Run the tasks in order and record the run; returns {task: report},
+    or None if another run started less than `interval` seconds ago.
+
+    A failing task is logged and reported as {"error": ...}; the others
+    still run.
+    """
+    run_id = _claim(tasks, interval)
+    if run_id is None:
+        return None
+    reports = {}
+    for task in tasks:
+        try:
+            if task == "backup":
+                reports[task] = backup(dest)
+            else:
+                reports[task] = {"vacuum": vacuum, "analyze": analyze}[task]()
+        except Exception as exc:
+            log.exception("Обслуживание БД: %s не выполнено", task)
+            reports[task] = {"error": str(exc)}
+        with _last_lock:
+            _last[task] = dict(reports[task], at=time.strftime("%Y-%m-%d %H:%M:%S"))
+    with db.transaction() as conn:
+        conn.execute(FINISH_SQL, (json.dumps(reports, ensure_ascii=False), run_id))
+    return reports
+
+
+def history(limit=10):
+    return db.query_records(RUNS_SQL, (limit,))
+
+
+class Scheduler:
+    """Background thread running all tasks once every `interval` seconds."""
+
+    def __init__(self, interval=INTERVAL, first_delay=FIRST_DELAY, check_every=CHECK_EVERY):
+        self.interval = interval
+        self.first_delay = first_delay
+        self.check_every = min(check_every, interval)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        delay = self.first_delay
+        while not self._stop.wait(delay):
+            delay = self.check_every
+            try:
+                reports = run(interval=self.interval)
+            except Exception:
+                log.exception("Обслуживание БД не запущено")
+                continue
+            if reports is not None:
+                log.info("Обслуживание БД: %s", json.dumps(reports, ensure_ascii=False))
+
+    def close(self, timeout=5.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+# database path -> Scheduler
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def ensure_scheduler():
+    """Start the background maintenance thread once per process and database."""
+    if INTERVAL <= 0:
+        return None
+    path = db.DB_PATH
+    scheduler = _schedulers.get(path)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(path)
+            if scheduler is None:
+                scheduler = _schedulers[path] = Scheduler()
+                atexit.register(scheduler.close)
+    return scheduler
+
+
+def stats():
+    """Last report of every task run by this process."""
+    with _last_lock:
+        return {task: dict(report) for task, report in _last.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание БД: очистка, статистика, резервная копия")
+    parser.add_argument("--db", help="путь к БД (по умолчанию data/questions.db)")
+    parser.add_argument("--dest", help="каталог резервных копий (по умолчанию <БД>-backups)")
+    parser.add_argument("commands", nargs="+",
+                        choices=TASKS + ("all", "convert", "status"))
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.use_database(args.db)
+    migrations.migrate()
+
+    if "status" in args.commands:
+        print(json.dumps(info(), ensure_ascii=False))
+        for row in history():
+            print(json.dumps(row, ensure_ascii=False))
+        return 0
+    if "convert" in args.commands:
+        print(json.dumps({"convert": convert()}, ensure_ascii=False))
+    tasks = TASKS if "all" in args.commands else [t for t in TASKS if t in args.commands]
+    if not tasks:
+        return 0
+    reports = run(tasks, dest=args.dest)
+    print(json.dumps(reports, ensure_ascii=False, indent=2))
+    return 1 if any("error" in r for r in reports.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,596 @@
+"""Versioned schema migrations.
+
+Each migration is a function that receives a connection inside the write
+transaction opened by migrate(). Applied versions are recorded in the
+schema_version table, so every migration runs exactly once per database.
+New migrations go at the end of MIGRATIONS with the next version number;
+never edit one that has already shipped.
+
+Migrations 1-3 use IF NOT EXISTS so they also apply cleanly to databases
+created before schema_version existed.
+"""
+import threading
+
+from quizmaker import catalog, db, leaderboard
+
+
+def _base_schema(conn):
+    cur = conn.cursor()
+
+    # Questions table
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT,
+            type TEXT,
+            choices TEXT,
+            correct TEXT,
+            points INTEGER,
+            tags TEXT
+        )
+    """)
+
+    # Scores table
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scores (
+            user TEXT,
+            score INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Tests table
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            description TEXT,
+            tags TEXT
+        )
+    """)
+
+    # Link table between tests and questions
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS test_questions (
+            test_id INTEGER,
+            question_id INTEGER,
+            position INTEGER,
+            PRIMARY KEY (test_id, question_id),
+            FOREIGN KEY(test_id) REFERENCES tests(id),
+            FOREIGN KEY(question_id) REFERENCES questions(id)
+        )
+    """)
+
+
+def _test_tags_and_fts(conn):
+    cur = conn.cursor()
+
+    # Normalized tags of each test (tests.tags split by comma)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS test_tags (
+            tag TEXT NOT NULL,
+            test_id INTEGER NOT NULL,
+            PRIMARY KEY (tag, test_id)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_test_tags_test ON test_tags(test_id)")
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS tests_tags_ad AFTER DELETE ON tests BEGIN
+            DELETE FROM test_tags WHERE test_id = old.id;
+        END
+    """)
+    for test_id, tags in cur.execute("SELECT id, tags FROM tests").fetchall():
+        catalog.replace_test_tags(conn, test_id, tags)
+
+    # Full-text index over test name/description, kept in sync by triggers
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS tests_fts USING fts5(
+            name, description, content='tests', content_rowid='id'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS tests_fts_ai AFTER INSERT ON tests BEGIN
+            INSERT INTO tests_fts(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS tests_fts_ad AFTER DELETE ON tests BEGIN
+            INSERT INTO tests_fts(tests_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS tests_fts_au AFTER UPDATE ON tests BEGIN
+            INSERT INTO tests_fts(tests_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO tests_fts(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """)
+    cur.execute("INSERT INTO tests_fts(tests_fts) VALUES ('rebuild')")
+
+
+def _leaderboard_totals(conn):
+    cur = conn.cursor()
+
+    # Which test a score belongs to
+    score_cols = [r[1] for r in cur.execute("PRAGMA table_info(scores)")]
+    if "test_id" not in score_cols:
+        cur.execute("ALTER TABLE scores ADD COLUMN test_id INTEGER")
+
+    # Leaderboard aggregates, maintained by triggers on scores
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_totals (
+            user TEXT PRIMARY KEY,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_totals_total
+            ON user_totals(total_score DESC, user)
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_test_totals (
+            test_id INTEGER NOT NULL,
+            user TEXT NOT NULL,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (test_id, user)
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_test_totals_total
+            ON user_test_totals(test_id, total_score DESC, user)
+    """)
+    # period: 'day' or 'week'; bucket: the day / Monday of the week (UTC)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_period_totals (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            user TEXT NOT NULL,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket, user)
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_period_totals_total
+            ON user_period_totals(period, bucket, total_score DESC, user)
+    """)
+    for sign, event, row in (("+", "INSERT", "new"), ("-", "DELETE", "old")):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS scores_totals_{event.lower()}
+            AFTER {event} ON scores BEGIN
+                INSERT INTO user_totals (user, total_score, attempts)
+                VALUES ({row}.user, {sign}{row}.score, {sign}1)
+                ON CONFLICT(user) DO UPDATE SET
+                    total_score = total_score + excluded.total_score,
+                    attempts = attempts + excluded.attempts;
+                INSERT INTO user_test_totals (test_id, user, total_score, attempts)
+                SELECT {row}.test_id, {row}.user, {sign}{row}.score, {sign}1
+                 WHERE {row}.test_id IS NOT NULL
+                ON CONFLICT(test_id, user) DO UPDATE SET
+                    total_score = total_score + excluded.total_score,
+                    attempts = attempts + excluded.attempts;
+                INSERT INTO user_period_totals (period, bucket, user, total_score, attempts)
+                VALUES ('day', date({row}.timestamp), {row}.user, {sign}{row}.score, {sign}1),
+                       ('week', date({row}.timestamp, 'weekday 0', '-6 days'),
+                        {row}.user, {sign}{row}.score, {sign}1)
+                ON CONFLICT(period, bucket, user) DO UPDATE SET
+                    total_score = total_score + excluded.total_score,
+                    attempts = attempts + excluded.attempts;
+            END
+        """)
+    leaderboard.rebuild(conn)
+
+
+def _question_choices(conn):
+    # One row per answer option. Text questions store their accepted
+    # answer as a single is_correct row; it is never shown as an option.
+    conn.execute("""
+        CREATE TABLE question_choices (
+            question_id INTEGER NOT NULL,
+            ordinal INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            is_correct INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (question_id, ordinal)
+        ) WITHOUT ROWID
+    """)
+
+    src = conn.execute("SELECT id, type, choices, correct FROM questions")
+    while True:
+        chunk = src.fetchmany(1000)
+        if not chunk:
+            break
+        rows = []
+        for qid, qtype, choices, correct in chunk:
+            if qtype == "Текстовый ответ":
+                rows.append((qid, 0, correct or "", 1))
+                continue
+            correct_set = set((correct or "").split("|"))
+            options = [c for c in (choices or "").split("|") if c]
+            rows.extend((qid, i, c, int(c in correct_set)) for i, c in enumerate(options))
+        conn.executemany(
+            "INSERT INTO question_choices (question_id, ordinal, text, is_correct)"
+            " VALUES (?, ?, ?, ?)",
+            rows,
+        )
+
+    conn.execute("ALTER TABLE questions DROP COLUMN choices")
+    conn.execute("ALTER TABLE questions DROP COLUMN correct")
+
+
+def _secondary_indexes(conn):
+    for sql in (
+        # delete-question path: DELETE FROM test_questions WHERE question_id=?
+        "CREATE INDEX IF NOT EXISTS idx_test_questions_question ON test_questions(question_id)",
+        # a test's questions in order, MAX(position) when appending
+        "CREATE INDEX IF NOT EXISTS idx_test_questions_position ON test_questions(test_id, position)",
+        "CREATE INDEX IF NOT EXISTS idx_scores_user ON scores(user, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_scores_timestamp ON scores(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_questions_type ON questions(type)",
+        "CREATE INDEX IF NOT EXISTS idx_questions_tags ON questions(tags)",
+    ):
+        conn.execute(sql)
+
+
+# also used by repair_fts(); bulk_io drops it during a deferred import
+QUESTIONS_FTS_AI_SQL = """
+        CREATE TRIGGER questions_fts_ai AFTER INSERT ON questions BEGIN
+            INSERT INTO questions_fts(rowid, text) VALUES (new.id, new.text);
+        END
+    """
+TRIGGER_EXISTS_SQL = "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?"
+
+
+def _questions_fts(conn):
+    # Full-text index over question text for the question picker
+    conn.execute("""
+        CREATE VIRTUAL TABLE questions_fts USING fts5(
+            text, content='questions', content_rowid='id'
+        )
+    """)
+    conn.execute(QUESTIONS_FTS_AI_SQL)
+    conn.execute("""
+        CREATE TRIGGER questions_fts_ad AFTER DELETE ON questions BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, text)
+            VALUES ('delete', old.id, old.text);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER questions_fts_au AFTER UPDATE OF text ON questions BEGIN
+            INSERT INTO questions_fts(questions_fts, rowid, text)
+            VALUES ('delete', old.id, old.text);
+            INSERT INTO questions_fts(rowid, text) VALUES (new.id, new.text);
+        END
+    """)
+    conn.execute("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')")
+
+
+def _question_hashes(conn):
+    # Content hash for duplicate detection on bulk import
+    conn.execute("ALTER TABLE questions ADD COLUMN content_hash TEXT")
+    choices, correct = {}, {}
+    for qid, text, is_correct in conn.execute(
+        "SELECT question_id, text, is_correct FROM question_choices ORDER BY question_id, ordinal"
+    ):
+        choices.setdefault(qid, []).append(text)
+        if is_correct:
+            correct.setdefault(qid, []).append(text)
+    rows = []
+    for qid, text, qtype in conn.execute("SELECT id, text, type FROM questions").fetchall():
+        opts = [] if qtype == catalog.TEXT_TYPE else choices.get(qid, [])
+        rows.append((catalog.question_hash(text or "", qtype, opts, correct.get(qid, [])), qid))
+    conn.executemany("UPDATE questions SET content_hash=? WHERE id=?", rows)
+    conn.execute("CREATE INDEX idx_questions_hash ON questions(content_hash)")
+
+
+def _question_pools(conn):
+    # Tests that draw `size` random questions from the bank by tags
+    conn.execute("""
+        CREATE TABLE test_pools (
+            test_id INTEGER PRIMARY KEY REFERENCES tests(id),
+            size INTEGER NOT NULL,
+            tags TEXT NOT NULL,
+            weighting TEXT NOT NULL DEFAULT 'uniform'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER tests_pools_ad AFTER DELETE ON tests BEGIN
+            DELETE FROM test_pools WHERE test_id = old.id;
+        END
+    """)
+    # seed of the draw, so a pool attempt can be rebuilt and regraded
+    conn.execute("ALTER TABLE scores ADD COLUMN seed INTEGER")
+
+
+def _attempts_and_item_stats(conn):
+    # One row per graded submission and one per question of it: chosen
+    # options as a bitmask of their positions, or the text for text questions
+    conn.execute("""
+        CREATE TABLE attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test_id INTEGER,
+            score INTEGER,
+            max_score INTEGER,
+            seed INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX idx_attempts_test ON attempts(test_id)")
+    conn.execute("""
+        CREATE TABLE responses (
+            attempt_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            choices INTEGER,
+            answer TEXT,
+            correct INTEGER NOT NULL,
+            PRIMARY KEY (attempt_id, question_id)
+        ) WITHOUT ROWID
+    """)
+
+    # Running sums per (test, question) maintained by analytics.refresh();
+    # y is the attempt score as a fraction of the maximum
+    conn.execute("""
+        CREATE TABLE item_stats (
+            test_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            n_correct INTEGER NOT NULL,
+            sum_y REAL NOT NULL,
+            sum_y2 REAL NOT NULL,
+            sum_xy REAL NOT NULL,
+            PRIMARY KEY (test_id, question_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE choice_stats (
+            test_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            ordinal INTEGER NOT NULL,
+            picks INTEGER NOT NULL,
+            sum_y REAL NOT NULL,
+            PRIMARY KEY (test_id, question_id, ordinal)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE analytics_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT INTO analytics_state (name, value) VALUES ('last_attempt_id', 0)")
+
+
+def _catalog_version(conn):
+    # Bumped by catalog.invalidate(); every app process polls it to drop
+    # cached catalog reads after another process wrote
+    conn.execute("""
+        CREATE TABLE catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT INTO catalog_version (id, version) VALUES (1, 0)")
+
+
+def _cascading_foreign_keys(conn):
+    # SQLite cannot add ON DELETE CASCADE to an existing table: rebuild the
+    # link tables, dropping rows that already point at deleted tests/questions
+    conn.execute("""
+        CREATE TABLE test_questions_new (
+            test_id INTEGER NOT NULL REFERENCES tests(id) ON DELETE CASCADE,
+            question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+            position INTEGER,
+            PRIMARY KEY (test_id, question_id)
+        )
+    """)
+    conn.execute("""
+        INSERT INTO test_questions_new (test_id, question_id, position)
+        SELECT tq.test_id, tq.question_id, tq.position FROM test_questions tq
+         WHERE tq.test_id IN (SELECT id FROM tests)
+           AND tq.question_id IN (SELECT id FROM questions)
+    """)
+    conn.execute("DROP TABLE test_questions")
+    conn.execute("ALTER TABLE test_questions_new RENAME TO test_questions")
+    conn.execute("CREATE INDEX idx_test_questions_question ON test_questions(question_id)")
+    conn.execute("CREATE INDEX idx_test_questions_position ON test_questions(test_id, position)")
+
+    conn.execute("""
+        CREATE TABLE question_choices_new (
+            question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+            ordinal INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            is_correct INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (question_id, ordinal)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO question_choices_new (question_id, ordinal, text, is_correct)
+        SELECT question_id, ordinal, text, is_correct FROM question_choices
+         WHERE question_id IN (SELECT id FROM questions)
+    """)
+    conn.execute("DROP TABLE question_choices")
+    conn.execute("ALTER TABLE question_choices_new RENAME TO question_choices")
+
+    conn.execute("""
+        CREATE TABLE test_pools_new (
+            test_id INTEGER PRIMARY KEY REFERENCES tests(id) ON DELETE CASCADE,
+            size INTEGER NOT NULL,
+            tags TEXT NOT NULL,
+            weighting TEXT NOT NULL DEFAULT 'uniform'
+        )
+    """)
+    conn.execute("""
+        INSERT INTO test_pools_new SELECT * FROM test_pools
+         WHERE test_id IN (SELECT id FROM tests)
+    """)
+    conn.execute("DROP TRIGGER tests_pools_ad")
+    conn.execute("DROP TABLE test_pools")
+    conn.execute("ALTER TABLE test_pools_new RENAME TO test_pools")
+
+    # gapless 1..n positions from here on (see editing.renumber)
+    conn.execute("""
+        UPDATE test_questions SET position = r.rn
+          FROM (SELECT test_id, question_id,
+                       ROW_NUMBER() OVER (PARTITION BY test_id
+                                          ORDER BY position, question_id) AS rn
+                  FROM test_questions) r
+         WHERE test_questions.test_id = r.test_id
+           AND test_questions.question_id = r.question_id
+           AND test_questions.position IS NOT r.rn
+    """)
+
+
+def _text_answer_rules(conn):
+    # per-question matching rules of text answers (see text_answers), JSON;
+    # NULL means the defaults. Every is_correct row is an accepted answer.
+    conn.execute("ALTER TABLE questions ADD COLUMN answer_rules TEXT")
+
+
+def _test_snapshots(conn):
+    # latest published snapshot of a test (see quizmaker.snapshots); the
+    # artifact itself is a file, this row is its version and checksum. The
+    # row outlives unpublishing (active = 0) so version numbers never repeat.
+    conn.execute("""
+        CREATE TABLE test_snapshots (
+            test_id INTEGER PRIMARY KEY REFERENCES tests(id) ON DELETE CASCADE,
+            version INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            questions INTEGER NOT NULL,
+            published_at TEXT NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+
+
+def _idempotency_tokens(conn):
+    # one row per attempt token (see admission): a resubmitted attempt or
+    # score is dropped by ON CONFLICT DO NOTHING instead of counted twice
+    for table in ("attempts", "scores"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN token TEXT")
+        conn.execute(
+            f"CREATE UNIQUE INDEX idx_{table}_token ON {table}(token) WHERE token IS NOT NULL"
+        )
+
+
+def _maintenance_runs(conn):
+    # one row per maintenance run (see quizmaker.maintenance); started_at
+    # doubles as the claim that keeps app processes from running it twice
+    conn.execute("""
+        CREATE TABLE maintenance_runs (
+            id INTEGER PRIMARY KEY,
+            tasks TEXT NOT NULL,
+            started_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT,
+            report TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX idx_maintenance_runs_started ON maintenance_runs(started_at)")
+
+
+def _drop_unused_indexes(conn):
+    # no statement the app runs reads through these (see query_plans): the
+    # leaderboard uses user_totals/period_totals and pools read the whole
+    # bank, so they only slowed down score inserts and bulk imports
+    for name in ("idx_scores_user", "idx_scores_timestamp",
+                 "idx_questions_type", "idx_questions_tags"):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+MIGRATIONS = [
+    (1, "base schema", _base_schema),
+    (2, "test tags and full-text search", _test_tags_and_fts),
+    (3, "leaderboard aggregates", _leaderboard_totals),
+    (4, "question_choices replaces pipe-joined choices/correct", _question_choices),
+    (5, "secondary indexes", _secondary_indexes),
+    (6, "full-text search over questions", _questions_fts),
+    (7, "question content hashes", _question_hashes),
+    (8, "randomized question pools", _question_pools),
+    (9, "attempts, responses and item statistics", _attempts_and_item_stats),
+    (10, "shared catalog version", _catalog_version),
+    (11, "ON DELETE CASCADE for link tables", _cascading_foreign_keys),
+    (12, "text answer matching rules", _text_answer_rules),
+    (13, "published test snapshots", _test_snapshots),
+    (14, "idempotency tokens of attempts and scores", _idempotency_tokens),
+    (15, "maintenance run log", _maintenance_runs),
+    (16, "drop unused secondary indexes", _drop_unused_indexes),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+# database files this process has already brought up to LATEST
+_ready = set()
+_ready_lock = threading.Lock()
+
+
+def _current_version(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def current_version():
+    with db.connection() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_version'"
+        ).fetchone()
+        if not exists:
+            return 0
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate():
+    """Apply all pending migrations in one transaction; return the new version."""
+    if current_version() >= LATEST:
+        return LATEST
+    with db.transaction() as conn:
+        # another process may have migrated while we waited for the lock
+        version = _current_version(conn)
+        for number, name, apply in MIGRATIONS:
+            if number > version:
+                apply(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                    (number, name),
+                )
+    catalog.invalidate()
+    return LATEST
+
+
+def repair_fts():
+    """Recreate the questions_fts insert trigger if a deferred bulk import
+    died before putting it back, and rebuild the index; returns True if it
+    had to. Only takes the write lock when the trigger is missing."""
+    if db.query(TRIGGER_EXISTS_SQL, ("questions_fts_ai",)):
+        return False
+    with db.transaction() as conn:
+        if conn.execute(TRIGGER_EXISTS_SQL, ("questions_fts_ai",)).fetchone():
+            return False
+        conn.execute(QUESTIONS_FTS_AI_SQL)
+        conn.execute("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')")
+    catalog.invalidate()
+    return True
+
+
+def ensure_schema():
+    """migrate() and repair_fts() once per process and database file.
+
+    app.py calls this on every rerun; after the first call it is a set
+    lookup instead of a schema_version query.
+    """
+    path = db.DB_PATH
+    if path in _ready:
+        return
+    with _ready_lock:
+        if path not in _ready:
+            migrate()
+            repair_fts()
+            _ready.add(path)
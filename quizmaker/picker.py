@@ -0,0 +1,67 @@
+"""Searchable question picker for large question banks.
+
+Instead of feeding the whole bank into st.multiselect, the picker shows a
+search box and only offers the first PAGE_SIZE matching questions. Each
+"Показать ещё" fetches the next page with a keyset cursor (id > last shown
+id, LIMIT PAGE_SIZE) and appends it, so a page costs the same however deep
+the user has scrolled. Labels are resolved through an id -> text dict kept
+in session_state, so render cost depends on the number of offered options,
+not on bank size. When the search text or the catalog data version changes
+the list starts over from the first page and the dict is pruned to it and
+to selected questions that still exist, so deleted questions drop out.
+"""
+import streamlit as st
+
+from quizmaker import catalog
+
+PAGE_SIZE = 50
+
+
+def _fetch(query, exclude_test_id, after_id):
+    """One page after `after_id`; returns (rows, cursor of the next page or None)."""
+    rows = catalog.search_questions(query, PAGE_SIZE + 1, exclude_test_id, after_id)
+    if len(rows) > PAGE_SIZE:
+        rows = rows[:PAGE_SIZE]
+        return rows, rows[-1][0]
+    return rows, None
+
+
+def question_picker(label, key, exclude_test_id=None, show_ids=False):
+    """Render the picker and return the list of selected question ids."""
+    labels = st.session_state.setdefault(f"{key}_labels", {})
+    query = st.text_input(f"{label}: поиск", key=f"{key}_search",
+                          placeholder="Начните вводить текст вопроса")
+
+    # the first page is a cache hit on most reruns; reading it also picks up
+    # writes of other processes before the data version is compared
+    first, cursor = _fetch(query, exclude_test_id, 0)
+    state = (query, exclude_test_id, catalog.data_version())
+    if st.session_state.get(f"{key}_state") != state:
+        st.session_state[f"{key}_state"] = state
+        st.session_state[f"{key}_offered"] = [qid for qid, _ in first]
+        st.session_state[f"{key}_cursor"] = cursor
+        selected = st.session_state.get(key, [])
+        kept = catalog.existing_question_ids(selected) if selected else set()
+        labels = st.session_state[f"{key}_labels"] = {
+            qid: text for qid, text in labels.items() if qid in kept
+        }
+        labels.update(first)
+        if selected:
+            st.session_state[key] = [i for i in selected if i in kept]
+    offered = st.session_state[f"{key}_offered"]
+
+    selected = [i for i in st.session_state.get(key, []) if i in labels]
+    options = list(dict.fromkeys(selected + offered))
+    if show_ids:
+        fmt = lambda i: f"{i}: {labels[i]}"
+    else:
+        fmt = labels.__getitem__
+    picked = st.multiselect(label, options=options, format_func=fmt, key=key)
+
+    cursor = st.session_state[f"{key}_cursor"]
+    if cursor is not None and st.button("Показать ещё", key=f"{key}_more"):
+        rows, st.session_state[f"{key}_cursor"] = _fetch(query, exclude_test_id, cursor)
+        labels.update(rows)
+        offered.extend(qid for qid, _ in rows)
+        st.rerun()
+    return picked
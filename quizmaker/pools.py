@@ -0,0 +1,192 @@
+"""Randomized question pools.
+
+A test with a row in test_pools is drawn per attempt: `size` questions
+picked from every bank question carrying one of the pool tags, weighted by
+difficulty (question points). Instead of ORDER BY RANDOM() over the
+questions table, the bank is read once per data version into a per-tag
+index of id arrays; each tag set gets an alias table (Vose), so one draw
+costs O(k) expected time: sample with the alias table and skip repeats,
+which yields exactly sampling without replacement. Only when the weights
+are so skewed that repeats pile up does the draw fall back to an O(n)
+NumPy choice over the remaining questions.
+
+Draws are seeded per attempt (np.random.default_rng(seed)) over ids in
+ascending order, so the same seed gives the same questions as long as the
+tagged part of the bank is unchanged; the seed is stored with the score.
+"""
+import secrets
+from collections import namedtuple
+
+import numpy as np
+
+from quizmaker import catalog, db
+
+WEIGHTINGS = {
+    "uniform": "Равномерно",
+    "easy": "Чаще лёгкие",
+    "hard": "Чаще сложные",
+}
+# rejection draws allowed per requested question before the O(n) fallback
+MAX_DRAWS_PER_ITEM = 4
+
+Attempt = namedtuple("Attempt", "seed ids max_score")
+
+
+class TagIndex:
+    """Question ids and points of the bank, with id positions per tag."""
+
+    def __init__(self, rows):
+        import pandas as pd  # rows is a DataFrame; loaded once per data version
+
+        self.ids = rows["id"].to_numpy(dtype=np.int64)
+        self.points = rows["points"].fillna(1).clip(lower=1).to_numpy(dtype=np.int64)
+        tags = rows["tags"].fillna("").str.split(",").explode().str.strip()
+        tags = tags[tags != ""]
+        # exploded index = row position in `rows` (ids come sorted from SQL)
+        self.by_tag = {
+            tag: np.unique(pos.to_numpy(dtype=np.int64))
+            for tag, pos in pd.Series(tags.index, index=tags.to_numpy()).groupby(level=0)
+        }
+
+    def tags(self):
+        return sorted(self.by_tag)
+
+
+TAG_INDEX_SQL = "SELECT id, points, tags FROM questions ORDER BY id"
+
+
+def get_tag_index():
+    return catalog.get_cache().get_or_load(
+        ("tag_index",),
+        lambda: TagIndex(db.query_df(TAG_INDEX_SQL, replica=True).reset_index(drop=True)),
+    )
+
+
+def load_tags():
+    """Sorted list of all distinct question tags."""
+    return get_tag_index().tags()
+
+
+def _weights(points, weighting):
+    if weighting == "easy":
+        return 1.0 / points
+    if weighting == "hard":
+        return points.astype(np.float64)
+    return np.ones(len(points))
+
+
+class Pool:
+    """Weighted alias table over the questions of a tag set."""
+
+    def __init__(self, ids, points, weighting):
+        self.ids = ids
+        self.points = points
+        w = _weights(points, weighting)
+        self.p = w / w.sum() if len(w) else w
+        self.prob, self.alias = self._alias_table(self.p)
+
+    @staticmethod
+    def _alias_table(p):
+        n = len(p)
+        prob = np.ones(n)
+        alias = np.arange(n)
+        scaled = (p * n).tolist()
+        small = [i for i, x in enumerate(scaled) if x < 1.0]
+        large = [i for i, x in enumerate(scaled) if x >= 1.0]
+        while small and large:
+            s, g = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1.0 - scaled[s]
+            (small if scaled[g] < 1.0 else large).append(g)
+        return prob, alias
+
+    def __len__(self):
+        return len(self.ids)
+
+    def sample(self, k, rng):
+        """k distinct positions, without replacement, in draw order."""
+        n = len(self.ids)
+        k = min(int(k), n)
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+        chosen = {}
+        budget = MAX_DRAWS_PER_ITEM * k + 32
+        while len(chosen) < k and budget > 0:
+            m = k - len(chosen)
+            cols = rng.integers(0, n, size=m)
+            picks = np.where(rng.random(m) < self.prob[cols], cols, self.alias[cols])
+            for i in picks.tolist():
+                chosen.setdefault(i, None)
+                if len(chosen) == k:
+                    break
+            budget -= m
+        out = list(chosen)
+        if len(out) < k:
+            # too skewed for rejection: finish over the remaining questions
+            rest = np.ones(n, dtype=bool)
+            rest[out] = False
+            left = np.flatnonzero(rest)
+            p = self.p[left] / self.p[left].sum()
+            out += left[rng.choice(len(left), size=k - len(out), replace=False, p=p)].tolist()
+        return np.array(out, dtype=np.int64)
+
+
+def get_pool(tags, weighting="uniform"):
+    """Pool over all questions carrying any of `tags`, cached per data version."""
+    tags = tuple(sorted(set(tags)))
+
+    def build():
+        index = get_tag_index()
+        parts = [index.by_tag[t] for t in tags if t in index.by_tag]
+        pos = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        return Pool(index.ids[pos], index.points[pos], weighting)
+
+    return catalog.get_cache().get_or_load(("question_pool", tags, weighting), build)
+
+
+# ---------------------------------
+# Pool settings of a test
+# ---------------------------------
+POOL_SQL = "SELECT size, tags, weighting FROM test_pools WHERE test_id=?"
+
+
+def load_pool(test_id):
+    """{"size", "tags", "weighting"} of a pool test, or None for a fixed test."""
+    def load():
+        rows = db.query(POOL_SQL, (int(test_id),), replica=True)
+        if not rows:
+            return None
+        size, tags, weighting = rows[0]
+        return {"size": size, "tags": catalog.split_tags(tags), "weighting": weighting}
+
+    return catalog.get_cache().get_or_load(("test_pool", int(test_id)), load)
+
+
+SAVE_POOL_SQL = (
+    "INSERT INTO test_pools (test_id, size, tags, weighting) VALUES (?,?,?,?)"
+    " ON CONFLICT(test_id) DO UPDATE SET size=excluded.size, tags=excluded.tags,"
+    " weighting=excluded.weighting"
+)
+DELETE_POOL_SQL = "DELETE FROM test_pools WHERE test_id=?"
+
+
+def save_pool(conn, test_id, size, tags, weighting):
+    """Make a test a pool test (or update it); call inside the write transaction."""
+    conn.execute(SAVE_POOL_SQL, (test_id, int(size), ",".join(tags), weighting))
+
+
+def delete_pool(conn, test_id):
+    conn.execute(DELETE_POOL_SQL, (test_id,))
+
+
+def new_seed():
+    return secrets.randbits(63)
+
+
+def draw(test_id, seed):
+    """Questions of one attempt of a pool test: Attempt(seed, ids, max_score)."""
+    config = load_pool(test_id)
+    pool = get_pool(config["tags"], config["weighting"])
+    pos = pool.sample(config["size"], np.random.default_rng(seed))
+    return Attempt(seed, pool.ids[pos].tolist(), int(pool.points[pos].sum()))
@@ -0,0 +1,174 @@
+"""Opt-in per-rerun profiling.
+
+Enabled with the QUIZMAKER_PROFILE=1 environment variable (every session)
+or the ?profile=1 query parameter (one browser tab). For each rerun it
+records the time spent in init_db and the page function, every query made
+through the db helpers (text, duration, row count, DataFrame memory),
+every write transaction (its statements, total duration including the
+lock wait and the commit) and the number of SQL statements executed on
+pooled connections. The result
+is shown in a collapsible sidebar panel and appended to a rotating JSONL
+log (logs/profile.jsonl by default, QUIZMAKER_PROFILE_LOG to override).
+
+When profiling is off, main() pays one dictionary lookup per rerun and the
+db helpers one thread-local lookup per query once profiling has been used
+in the process.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from quizmaker import admission, db, maintenance, score_writer
+
+ENV_ENABLED = os.environ.get("QUIZMAKER_PROFILE", "") not in ("", "0")
+LOG_PATH = os.environ.get("QUIZMAKER_PROFILE_LOG") or os.path.join(
+    db.PROJECT_ROOT, "logs", "profile.jsonl"
+)
+LOG_MAX_BYTES = 5 * 2 ** 20
+LOG_BACKUPS = 3
+MAX_SQL_CHARS = 300
+
+_local = threading.local()
+_install_lock = threading.Lock()
+_installed = False
+
+
+class Rerun:
+    def __init__(self, session):
+        self.session = session
+        self.started = time.perf_counter()
+        self.wall = time.time()
+        self.sections = {}
+        self.queries = []
+        self.statements = 0
+        self.in_transaction = None   # statements of the open write transaction
+        self.total_ms = 0.0
+
+    def to_dict(self):
+        return {
+            "ts": round(self.wall, 3),
+            "session": self.session,
+            "total_ms": round(self.total_ms, 3),
+            "sections": {k: round(v, 3) for k, v in self.sections.items()},
+            "statements": self.statements,
+            "queries": self.queries,
+        }
+
+
+def _current():
+    return getattr(_local, "rerun", None)
+
+
+def _observe(kind, sql, seconds, result):
+    rerun = _current()
+    if rerun is None:
+        return
+    entry = {"kind": kind, "sql": " ".join(sql.split())[:MAX_SQL_CHARS],
+             "ms": round(seconds * 1000, 3)}
+    if kind == "query_df":
+        entry["rows"] = len(result)
+        entry["df_bytes"] = int(result.memory_usage(deep=True).sum())
+    elif kind == "query":
+        entry["rows"] = len(result)
+    elif kind == "transaction":
+        statements = rerun.in_transaction or []
+        rerun.in_transaction = None
+        entry["sql"] = "; ".join(" ".join(s.split()) for s in statements)[:MAX_SQL_CHARS]
+        entry["statements"] = len(statements)
+    rerun.queries.append(entry)
+
+
+def _trace(sql):
+    rerun = _current()
+    if rerun is not None:
+        rerun.statements += 1
+        if sql == "BEGIN IMMEDIATE":
+            rerun.in_transaction = []
+        elif rerun.in_transaction is not None and sql != "COMMIT":
+            rerun.in_transaction.append(sql)
+
+
+@st.cache_resource
+def _get_logger():
+    os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+    logger = logging.getLogger("quizmaker.profile")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.handlers.RotatingFileHandler(
+        LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    return logger
+
+
+def _install():
+    global _installed
+    with _install_lock:
+        if not _installed:
+            db.set_observer(_observe)
+            db.get_pool().set_trace(_trace)
+            db.get_router().set_trace(_trace)
+            _installed = True
+
+
+def enabled():
+    return ENV_ENABLED or st.query_params.get("profile") == "1"
+
+
+def start():
+    """Begin profiling this rerun if enabled; returns the Rerun or None."""
+    if not enabled():
+        return None
+    _install()
+    ctx = get_script_run_ctx()
+    rerun = Rerun(ctx.session_id if ctx else None)
+    _local.rerun = rerun
+    return rerun
+
+
+@contextmanager
+def _timed(rerun, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        rerun.sections[name] = rerun.sections.get(name, 0.0) + \
+            (time.perf_counter() - started) * 1000
+
+
+def section(name):
+    """Context manager timing a block of the current rerun (no-op when off)."""
+    rerun = _current()
+    return nullcontext() if rerun is None else _timed(rerun, name)
+
+
+def finish(rerun):
+    """Stop profiling, log the rerun and render the sidebar panel."""
+    if rerun is None:
+        return
+    _local.rerun = None
+    rerun.total_ms = (time.perf_counter() - rerun.started) * 1000
+    record = rerun.to_dict()
+    _get_logger().info(json.dumps(record, ensure_ascii=False))
+
+    with st.sidebar.expander(f"⏱️ Профилирование: {rerun.total_ms:.0f} мс"):
+        st.write({name: f"{ms:.1f} мс" for name, ms in rerun.sections.items()})
+        db_ms = sum(q["ms"] for q in rerun.queries)
+        st.caption(
+            f"Запросов: {len(rerun.queries)} ({db_ms:.1f} мс), "
+            f"SQL-операторов: {rerun.statements}"
+        )
+        if rerun.queries:
+            st.dataframe(rerun.queries, hide_index=True)
+        st.caption(f"Пул: {db.pool_stats()}")
+        st.caption(f"Допуск запросов: {admission.stats()}")
+        st.caption(f"Запись результатов: {score_writer.get_writer().stats()}")
+        st.caption(f"Обслуживание БД: {maintenance.stats()}")
@@ -0,0 +1,204 @@
+"""Query-plan regression check for the statements used by the pages.
+
+Builds a throwaway database with the app schema, seeds it with a large
+synthetic catalog and runs EXPLAIN QUERY PLAN on every statement the pages
+issue. Statements are the module constants the code runs (catalog.*_SQL,
+analytics.*_SQL, ...) and, for SQL assembled from filters, the builder
+functions the code calls (catalog.search_tests_sql(), leaderboard.top_sql(),
+...), never copies, so the check cannot drift from the code. A statement fails the check if its plan contains a full table scan
+(a "SCAN <table>" step without an index), unless it is listed in
+ALLOWED_SCANS with the reason the scan is intended. tests/ runs the same
+check on a smaller database under pytest.
+
+    python -m quizmaker.query_plans            # exit code 1 on regressions
+    python -m quizmaker.query_plans --verbose  # print every plan
+    python -m quizmaker.query_plans --analyze  # with planner statistics, as
+                                               # quizmaker.maintenance leaves them
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+from quizmaker import (
+    analytics, catalog, db, editing, leaderboard, maintenance, pools, score_writer, snapshots,
+    synthetic,
+)
+
+SEED_SIZES = {
+    "questions": 50000,
+    "tests": 10000,
+    "questions_per_test": 20,
+    "scores": 200000,
+}
+
+
+# name -> (sql, params)
+STATEMENTS = {
+    # catalog reads (list_tests_page, take_full_test_page, edit_test_page, wizard)
+    "load_tests": (catalog.LOAD_TESTS_SQL, []),
+    "search_questions": catalog.search_questions_sql("", 51),
+    "search_questions_by_text": catalog.search_questions_sql("вопрос номер 12", 51),
+    "search_questions_not_in_test": catalog.search_questions_sql("", 51, 42),
+    "search_questions_by_text_not_in_test": catalog.search_questions_sql("тему 7", 51, 42),
+    "search_questions_after_id": catalog.search_questions_sql("", 51, after_id=2500),
+    "search_questions_by_text_after_id": catalog.search_questions_sql("вопрос", 51, after_id=2500),
+    "search_questions_not_in_test_after_id": catalog.search_questions_sql("", 51, 42, after_id=2500),
+    "load_tags": (catalog.LOAD_TAGS_SQL, []),
+    "count_tests": catalog.count_tests_sql((), ""),
+    "count_tests_filtered": catalog.count_tests_sql(("tag3", "tag4"), "тест"),
+    "search_tests": catalog.search_tests_sql((), "", 3, 5),
+    "search_tests_by_tag": catalog.search_tests_sql(("tag3",), "", 3, 5),
+    "search_tests_by_text": catalog.search_tests_sql((), "описание 12", 3, 5),
+    "search_tests_by_tag_and_text": catalog.search_tests_sql(("tag3", "tag5"), "тест", 3, 5),
+    "test_questions": (catalog.TEST_QUESTIONS_SQL, [42, -1, 0]),
+    "test_choices": (catalog.TEST_CHOICES_SQL, [42, -1, 0]),
+    "test_page": (catalog.TEST_QUESTIONS_SQL, [42, 10, 10]),
+    "test_page_choices": (catalog.TEST_CHOICES_SQL, [42, 10, 10]),
+    "test_summary": (catalog.TEST_SUMMARY_SQL, [42]),
+    "catalog_version": (catalog.VERSION_SQL, []),
+    # pool tests (quizmaker.pools)
+    "test_pool": (pools.POOL_SQL, [42]),
+    "save_pool": (pools.SAVE_POOL_SQL, [42, 10, "tag3", "uniform"]),
+    "delete_pool": (pools.DELETE_POOL_SQL, [42]),
+    "tag_index": (pools.TAG_INDEX_SQL, []),
+    "questions_by_id": (catalog.QUESTIONS_BY_ID_SQL, ["[1, 500, 42]"]),
+    "choices_by_id": (catalog.CHOICES_BY_ID_SQL, ["[1, 500, 42]"]),
+    "question_ids": (catalog.QUESTION_IDS_SQL, ["[1, 500, 42]"]),
+    # stats_page (quizmaker.analytics)
+    "analytics_pending": (analytics.PENDING_SQL, []),
+    "analytics_watermark": (analytics.WATERMARK_SQL, []),
+    "analytics_upto": (analytics.UPTO_SQL, [100, analytics.CHUNK_ATTEMPTS]),
+    "new_attempt_responses": (analytics.NEW_RESPONSES_SQL, [100, 5100]),
+    "count_new_attempts": (analytics.COUNT_ATTEMPTS_SQL, [100, 5100]),
+    "add_item_stats": (analytics.ADD_ITEM_STATS_SQL, [42, 500, 1, 1, 0.5, 0.25, 0.5]),
+    "add_choice_stats": (analytics.ADD_CHOICE_STATS_SQL, [42, 500, 0, 1, 0.5]),
+    "set_watermark": (analytics.SET_WATERMARK_SQL, [5100]),
+    "test_overview": (analytics.TEST_OVERVIEW_SQL, [42]),
+    "item_stats": (analytics.ITEM_STATS_SQL, [42]),
+    "choice_stats": (analytics.CHOICE_STATS_SQL, [42, 500]),
+    "item_answers": (analytics.ITEM_ANSWERS_SQL, [42, 500]),
+    # rating_page
+    "board_all": leaderboard.top_sql(20, 0),
+    "board_all_page": leaderboard.top_sql(20, 200),
+    "board_day": leaderboard.top_sql(20, 0, period="day"),
+    "board_week": leaderboard.top_sql(20, 0, period="week"),
+    "board_test": leaderboard.top_sql(20, 0, test_id=42),
+    "board_count_all": leaderboard.count_sql(),
+    "board_count_day": leaderboard.count_sql(period="day"),
+    "board_count_test": leaderboard.count_sql(test_id=42),
+    # write paths (add_question_page, wizard, edit_test_page, score_writer)
+    "insert_score": (
+        score_writer.INSERT_SQL,
+        ["u", 1, 1, "2026-01-01 00:00:00", None, None],
+    ),
+    "insert_attempt": (
+        score_writer.ATTEMPT_SQL,
+        [42, 1, 2, None, "2026-01-01 00:00:00", None],
+    ),
+    "insert_response": (score_writer.RESPONSE_SQL, [1, 500, 1, None, 1]),
+    "insert_question": (
+        catalog.INSERT_QUESTION_SQL, ["q", "Один ответ", 1, "t", "hash", None],
+    ),
+    "insert_choice": (catalog.INSERT_CHOICE_SQL, [500, 999, "a", 1]),
+    "bump_catalog_version": (catalog.BUMP_VERSION_SQL, []),
+    "update_test": (catalog.UPDATE_TEST_SQL, ["n", "d", "t", 42]),
+    "replace_test_tags": (catalog.DELETE_TEST_TAGS_SQL, [42]),
+    "insert_test_tag": (catalog.INSERT_TEST_TAG_SQL, ["t", 42]),
+    "insert_test": (catalog.INSERT_TEST_SQL, ["n", "d", "t"]),
+    "insert_test_question": (catalog.INSERT_TEST_QUESTION_SQL, [42, 500, 999]),
+    "add_to_test": (editing.APPEND_SQL, {"test_id": 42, "ids": "[7, 8, 9]"}),
+    "remove_from_test": (editing.REMOVE_SQL, [42, "[7, 8]"]),
+    "renumber": (editing.RENUMBER_SQL, ["[42, 43]"]),
+    "tests_of_questions": (editing.TESTS_OF_QUESTIONS_SQL, ["[7, 8]"]),
+    "delete_questions": (editing.DELETE_QUESTIONS_SQL, ["[7, 8]"]),
+    "delete_tests": (editing.DELETE_TESTS_SQL, ["[42, 43]"]),
+    "snapshot_status": (snapshots.STATUS_SQL, [42]),
+    "snapshot_test_name": (snapshots.TEST_NAME_SQL, [42]),
+    "snapshot_is_pool": (snapshots.IS_POOL_SQL, [42]),
+    "snapshot_latest_version": (snapshots.LATEST_VERSION_SQL, [42]),
+    "snapshot_record": (snapshots.RECORD_SQL, [42, 1, "sha", 20, "2024-01-01 00:00:00"]),
+    "snapshot_unpublish": (snapshots.UNPUBLISH_SQL, [42]),
+}
+
+# statements that read a whole table on purpose
+ALLOWED_SCANS = {
+    "load_tests": "test selector lists every test",
+    "search_questions": "rowid-order scan stopped by LIMIT",
+    "search_questions_not_in_test": "rowid-order scan stopped by LIMIT",
+    "load_tags": "DISTINCT walk of the tag-ordered primary key, cached per data version",
+    "count_tests": "unfiltered COUNT(*) of the catalog, cached per data version",
+    "search_tests": "rowid-order scan stopped by LIMIT",
+    "board_count_all": "COUNT(*) of user_totals, one row per user",
+    "tag_index": "whole bank read once per data version for pool sampling",
+}
+
+
+def full_scans(plan):
+    """Plan rows that read a table without an index."""
+    # scans of subquery results (already filtered rows) are not table scans
+    derived = {detail.split(" ", 1)[1] for _id, _parent, _unused, detail in plan
+               if detail.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+    bad = []
+    for _id, _parent, _unused, detail in plan:
+        if detail.startswith("SCAN ") and " USING " not in detail \
+                and "VIRTUAL TABLE" not in detail \
+                and not detail.startswith("SCAN CONSTANT ROW") \
+                and detail[5:] not in derived:
+            bad.append(detail)
+    return bad
+
+
+def check(conn, statements=STATEMENTS, allowed=ALLOWED_SCANS, verbose=False):
+    """EXPLAIN every statement; return {name: [offending plan rows]}."""
+    failures = {}
+    for name, (sql, params) in statements.items():
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        bad = full_scans(plan)
+        if verbose:
+            mark = "FAIL" if bad and name not in allowed else "ok"
+            print(f"[{mark}] {name}")
+            for row in plan:
+                print("       ", row[3])
+        if bad and name not in allowed:
+            failures[name] = bad
+    return failures
+
+
+def run(directory, sizes=SEED_SIZES, analyze=False, verbose=False):
+    """Seed a database in `directory` and check() it; returns the failures."""
+    path = os.path.join(directory, "plans.db")
+    synthetic.generate(path, **sizes)
+    conn = sqlite3.connect(path)
+    try:
+        if analyze:
+            conn.execute(f"PRAGMA analysis_limit={maintenance.ANALYSIS_LIMIT}")
+            conn.execute("ANALYZE")
+            conn.commit()
+        return check(conn, verbose=verbose)
+    finally:
+        conn.close()
+        db.get_pool().close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--analyze", action="store_true",
+                        help="собрать статистику (ANALYZE) перед проверкой")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        failures = run(tmp, analyze=args.analyze, verbose=args.verbose)
+
+    for name, rows in failures.items():
+        print(f"Полный скан в {name}: {'; '.join(rows)}", file=sys.stderr)
+    if failures:
+        return 1
+    print(f"OK: {len(STATEMENTS)} statements, no unexpected full scans")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""Write-behind queue for score records and graded attempts.
+
+Pages hand finished results to a single background thread per process,
+which inserts them in batched transactions (one executemany per table and
+batch). Attempts carry their per-question responses for analytics.
+A batch is flushed when BATCH_SIZE records are waiting or FLUSH_INTERVAL
+seconds after its first record arrived. The queue is bounded: when it is
+full the record is written synchronously by the caller instead, so nothing
+is dropped. Pending records are flushed at interpreter exit.
+
+Only lock errors (and other transient failures) are retried, with
+backoff. A batch that fails with any other sqlite3.Error is bisected
+until the offending records are isolated; those are appended to the
+dead-letter log (logs/dead_scores.jsonl, QUIZMAKER_DEAD_LETTER to
+override) and the rest of the batch commits, so one bad record never
+blocks the queue.
+
+Records carrying an idempotency token (see admission) are inserted with
+ON CONFLICT DO NOTHING: a second copy of the same attempt or score is
+skipped (and counted as deduplicated) instead of reaching the leaderboard.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import streamlit as st
+
+from quizmaker import db
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.2     # seconds
+RETRY_DELAY = 1.0        # seconds after a failed flush, doubled per retry
+MAX_RETRY_DELAY = 30.0
+SHUTDOWN_RETRIES = 3
+DEAD_LETTER_PATH = os.environ.get("QUIZMAKER_DEAD_LETTER") or os.path.join(
+    db.PROJECT_ROOT, "logs", "dead_scores.jsonl"
+)
+
+INSERT_SQL = ("INSERT INTO scores (user, score, test_id, timestamp, seed, token)"
+              " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING")
+ATTEMPT_SQL = ("INSERT INTO attempts (test_id, score, max_score, seed, timestamp, token)"
+               " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING RETURNING id")
+RESPONSE_SQL = ("INSERT INTO responses (attempt_id, question_id, choices, answer, correct)"
+                " VALUES (?, ?, ?, ?, ?)")
+
+log = logging.getLogger(__name__)
+
+
+def _now():
+    # same format as CURRENT_TIMESTAMP, so day/week buckets stay correct
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ScoreWriter:
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 maxsize=QUEUE_SIZE, dead_letter_path=DEAD_LETTER_PATH):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dead_letter_path = dead_letter_path
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0, "written": 0, "deduplicated": 0, "direct_writes": 0, "batches": 0,
+            "failures": 0, "dead_lettered": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="score-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user, score, test_id=None, seed=None, token=None):
+        self._put(("score", (user, score, test_id, _now(), seed, token)))
+
+    def submit_attempt(self, test_id, score, max_score, seed, responses, token=None):
+        """responses: (question_id, choices mask, text answer, correct) rows."""
+        self._put(("attempt", ((test_id, score, max_score, seed, _now(), token), responses)))
+
+    def _put(self, item):
+        db.prefer_primary()
+        with self._lock:
+            self._stats["submitted"] += 1
+        if not self._stop.is_set():
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+        # backpressure: the queue is full (or shutting down), write inline
+        with db.transaction() as conn:
+            skipped = self._insert(conn, [item])
+        with self._lock:
+            self._stats["direct_writes"] += 1
+            self._stats["written"] += 1 - skipped
+            self._stats["deduplicated"] += skipped
+
+    def _take_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _insert(conn, batch):
+        """Insert a batch; returns how many records were duplicates."""
+        scores = [rec for kind, rec in batch if kind == "score"]
+        skipped = len(scores) - max(conn.executemany(INSERT_SQL, scores).rowcount, 0)
+        responses = []
+        for kind, rec in batch:
+            if kind == "attempt":
+                attempt, rows = rec
+                inserted = conn.execute(ATTEMPT_SQL, attempt).fetchone()
+                if inserted is None:
+                    skipped += 1
+                    continue
+                responses.extend((inserted[0],) + tuple(r) for r in rows)
+        conn.executemany(RESPONSE_SQL, responses)
+        return skipped
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        with db.transaction() as conn:
+            skipped = self._insert(conn, batch)
+        ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats["written"] += len(batch) - skipped
+            self._stats["deduplicated"] += skipped
+            self._stats["batches"] += 1
+            self._stats["last_flush_ms"] = ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], ms)
+            self._stats["total_flush_ms"] += ms
+
+    def _dead_letter(self, records, exc):
+        """Append records that cannot be written to the dead-letter log."""
+        log.error("%d результатов отложено в %s: %s", len(records), self.dead_letter_path, exc)
+        with self._lock:
+            self._stats["dead_lettered"] += len(records)
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for kind, rec in records:
+                    f.write(json.dumps(
+                        {"ts": _now(), "error": str(exc), "kind": kind, "record": rec},
+                        ensure_ascii=False, default=str,
+                    ) + "\n")
+        except OSError:
+            log.exception("Потеряно %d результатов: %r", len(records), records)
+
+    def _flush(self, batch):
+        # Lock errors and other transient failures retry the same part with
+        # backoff. Any other sqlite3.Error means some record cannot be
+        # written: the part is split in halves until the bad records are
+        # isolated and dead-lettered, and the rest commits.
+        parts = [batch]
+        attempt = 0
+        while parts:
+            part = parts[0]
+            try:
+                self._write(part)
+            except Exception as exc:
+                if isinstance(exc, sqlite3.Error) and not db._is_lock_error(exc):
+                    parts.pop(0)
+                    if len(part) == 1:
+                        self._dead_letter(part, exc)
+                    else:
+                        mid = len(part) // 2
+                        parts[:0] = [part[:mid], part[mid:]]
+                    continue
+                log.exception("Не удалось записать %d результатов", len(part))
+                with self._lock:
+                    self._stats["failures"] += 1
+                attempt += 1
+                # keep retrying while running; give up after a few tries on shutdown
+                if self._stop.is_set() and attempt >= SHUTDOWN_RETRIES:
+                    self._dead_letter([rec for p in parts for rec in p], exc)
+                    break
+                time.sleep(min(RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY))
+                continue
+            parts.pop(0)
+            attempt = 0
+        for _ in batch:
+            self._queue.task_done()
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+
+    def flush(self):
+        """Block until every queued record is committed."""
+        self._queue.join()
+
+    def close(self, timeout=30.0):
+        """Stop accepting records, drain the queue and stop the thread."""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out["queue_depth"] = self._queue.qsize()
+        out["avg_flush_ms"] = out.pop("total_flush_ms") / out["batches"] if out["batches"] else 0.0
+        return out
+
+
+@st.cache_resource
+def get_writer():
+    writer = ScoreWriter()
+    atexit.register(writer.close)
+    return writer
@@ -0,0 +1,440 @@
+"""Published, immutable snapshots of tests for exam traffic.
+
+publish(test_id) freezes a test — name, questions in order with options
+and accepted answers, answer rules — into a versioned binary file:
+
+    <root>/<test_id>/v<version>.qms
+    <root>/<test_id>/CURRENT          text file with the current version
+
+root is QUIZMAKER_SNAPSHOTS or "<database name>-snapshots" next to the
+database file, shared by all app processes on the host. A .qms file is a fixed header (magic, format, test id,
+version, payload length, SHA-256 of the payload) followed by zlib
+compressed JSON; its contents are written once and never modified.
+Publishing reads the test in a read transaction and writes the new
+version to a temporary file first; only the rename into place and the
+test_snapshots row happen under BEGIN IMMEDIATE, so score flushes are not
+held up by a large publish. If another publisher took the version number
+meanwhile, the file is built again. CURRENT is swapped with os.replace
+only after that commit, in a second write transaction and only if the
+version is still the latest, so readers see either the old or the new
+version, never a partial one or one the database does not record.
+
+Exam pages read through the process-wide SnapshotStore: a loaded snapshot
+(questions plus its compiled AnswerKey) is shared by all sessions, and
+CURRENT is stat()-ed at most once per SNAPSHOT_CHECK seconds per test, so
+the hot path does no SQLite reads at all. Sessions may pin a version
+(the paged exam does) so a publish in the middle of an attempt does not
+change its questions. A version that stops being current (publish,
+unpublish) gets its mtime set to that moment and is deleted
+SNAPSHOT_RETAIN seconds later; only deleting the test removes its files
+at once.
+
+    python -m quizmaker.snapshots publish 42
+    python -m quizmaker.snapshots unpublish 42
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from quizmaker import catalog, db, grading, migrations
+
+MAGIC = b"QMSNAP"
+FORMAT = 1
+HEADER = struct.Struct("<6sHqqI32s")   # magic, format, test_id, version, length, sha256
+SNAPSHOT_CHECK = 1.0   # seconds between stat() calls of a test's CURRENT file
+SNAPSHOT_CACHE = 64    # loaded snapshots kept per process
+SNAPSHOT_RETAIN = 24 * 3600   # seconds a replaced version stays on disk for
+                              # pinned attempts; longer than the longest exam
+PUBLISH_ATTEMPTS = 3   # rebuilds when a concurrent publisher takes the number
+
+STATUS_SQL = """
+    SELECT version, sha256, questions, published_at FROM test_snapshots
+     WHERE test_id = ? AND active
+"""
+TEST_NAME_SQL = "SELECT name FROM tests WHERE id=?"
+IS_POOL_SQL = "SELECT 1 FROM test_pools WHERE test_id=?"
+LATEST_VERSION_SQL = "SELECT COALESCE(MAX(version), 0) FROM test_snapshots WHERE test_id=?"
+RECORD_SQL = """
+    INSERT INTO test_snapshots (test_id, version, sha256, questions, published_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(test_id) DO UPDATE SET
+        version=excluded.version, sha256=excluded.sha256,
+        questions=excluded.questions, published_at=excluded.published_at, active=1
+"""
+UNPUBLISH_SQL = "UPDATE test_snapshots SET active=0 WHERE test_id=?"
+
+
+def snapshot_dir():
+    return os.environ.get("QUIZMAKER_SNAPSHOTS") or (
+        os.path.splitext(db.parse_url(db.DB_PATH)[1])[0] + "-snapshots"
+    )
+
+
+def _path(root, test_id, version):
+    return os.path.join(root, str(int(test_id)), f"v{int(version)}.qms")
+
+
+def _current_path(root, test_id):
+    return os.path.join(root, str(int(test_id)), "CURRENT")
+
+
+class Snapshot:
+    """One published version of a test; shared between sessions, read-only."""
+
+    def __init__(self, body):
+        self.test_id = body["test_id"]
+        self.version = body["version"]
+        self.name = body["name"]
+        self.published_at = body["published_at"]
+        self.questions = body["questions"]
+        self.key = grading.AnswerKey(self.questions)
+        self.max_score = self.key.max_score
+        self._page_keys = {}
+
+    def __len__(self):
+        return len(self.questions)
+
+    def page(self, page, page_size):
+        return self.questions[page * page_size:(page + 1) * page_size]
+
+    def page_key(self, page, page_size):
+        key = self._page_keys.get((page, page_size))
+        if key is None:
+            key = self._page_keys[(page, page_size)] = grading.AnswerKey(self.page(page, page_size))
+        return key
+
+
+def encode(body):
+    payload = zlib.compress(
+        json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6
+    )
+    header = HEADER.pack(MAGIC, FORMAT, body["test_id"], body["version"], len(payload),
+                         hashlib.sha256(payload).digest())
+    return header + payload
+
+
+def decode(data):
+    """Bytes of a .qms file -> body dict; ValueError if it is damaged."""
+    if len(data) < HEADER.size:
+        raise ValueError("Снимок теста обрезан")
+    magic, fmt, test_id, version, length, digest = HEADER.unpack_from(data)
+    payload = data[HEADER.size:]
+    if magic != MAGIC or fmt != FORMAT:
+        raise ValueError("Неизвестный формат снимка теста")
+    if len(payload) != length or hashlib.sha256(payload).digest() != digest:
+        raise ValueError(f"Снимок теста {test_id} v{version} повреждён")
+    body = json.loads(zlib.decompress(payload))
+    if (body["test_id"], body["version"]) != (test_id, version):
+        raise ValueError(f"Снимок теста {test_id} v{version} повреждён")
+    return body
+
+
+def _read_current(root, test_id):
+    try:
+        with open(_current_path(root, test_id), "rb") as f:
+            return int(f.read().strip() or 0) or None
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_temp(directory, data):
+    """Write data to a fsynced temporary file in directory; returns its path."""
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp
+
+
+def _write_atomic(path, data):
+    tmp = _write_temp(os.path.dirname(path), data)
+    try:
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _check_publishable(conn, test_id):
+    if conn.execute(TEST_NAME_SQL, (test_id,)).fetchone() is None:
+        raise ValueError(f"Тест {test_id} не найден")
+    if conn.execute(IS_POOL_SQL, (test_id,)).fetchone():
+        raise ValueError("Тест со случайной выборкой вопросов нельзя опубликовать снимком.")
+
+
+def _latest_version(conn, root, test_id):
+    # never reuse a number that CURRENT has pointed at (processes cache
+    # snapshots by it); a file left by a publish that did not commit was
+    # never served and may be overwritten
+    return max(
+        conn.execute(LATEST_VERSION_SQL, (test_id,)).fetchone()[0],
+        _read_current(root, test_id) or 0,
+    )
+
+
+def _read_test(conn, test_id):
+    name = conn.execute(TEST_NAME_SQL, (test_id,)).fetchone()[0]
+    params = (test_id, -1, 0)
+    cur = conn.execute(catalog.TEST_QUESTIONS_SQL, params)
+    names = [d[0] for d in cur.description]
+    questions = [dict(zip(names, r)) for r in cur.fetchall()]
+    return name, catalog._with_choices(questions, conn.execute(catalog.TEST_CHOICES_SQL, params))
+
+
+def _read_for_publish(root, test_id):
+    """(name, questions, latest version) from one read transaction."""
+    with db.connection() as conn:
+        conn.execute("BEGIN")
+        try:
+            _check_publishable(conn, test_id)
+            name, questions = _read_test(conn, test_id)
+            return name, questions, _latest_version(conn, root, test_id)
+        finally:
+            conn.execute("ROLLBACK")
+
+
+def publish(test_id):
+    """Freeze the current state of a fixed test; returns the new Snapshot."""
+    test_id = int(test_id)
+    root = snapshot_dir()
+    for _ in range(PUBLISH_ATTEMPTS):
+        # the artifact is built and fsynced before the write lock is taken
+        name, questions, latest = _read_for_publish(root, test_id)
+        if not questions:
+            raise ValueError("В тесте нет вопросов.")
+        version = latest + 1
+        body = {
+            "test_id": test_id, "version": version, "name": name,
+            "published_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+            "questions": questions,
+        }
+        data = encode(body)
+        path = _path(root, test_id, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = _write_temp(os.path.dirname(path), data)
+        try:
+            with db.transaction() as conn:
+                _check_publishable(conn, test_id)
+                if _latest_version(conn, root, test_id) != latest:
+                    continue   # another publisher took the number; build again
+                # not served until CURRENT points at it, which happens after commit
+                os.replace(tmp, path)
+                conn.execute(RECORD_SQL, (test_id, version, hashlib.sha256(data).hexdigest(),
+                                          len(questions), body["published_at"]))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        break
+    else:
+        raise ValueError("Тест одновременно публикуют в другом месте, повторите позже.")
+    # Swap CURRENT only once test_snapshots records this version, under the
+    # write lock again so a slower publisher (or an unpublish) that
+    # committed after us is never overwritten with an older version.
+    with db.transaction() as conn:
+        row = conn.execute(STATUS_SQL, (test_id,)).fetchone()
+        if row is not None and row[0] == version:
+            previous = _read_current(root, test_id)
+            _write_atomic(_current_path(root, test_id), str(version).encode("ascii"))
+            _retire(root, test_id, previous)
+    _prune(root, test_id)
+    return Snapshot(body)
+
+
+def _retire(root, test_id, version):
+    """Stamp a version that stopped being current with the time it did."""
+    if version is None:
+        return
+    try:
+        os.utime(_path(root, test_id, version))
+    except FileNotFoundError:
+        pass
+
+
+def _prune(root, test_id):
+    """Delete the versions of a test that are not current and were retired
+    (or, if never served, written) over SNAPSHOT_RETAIN seconds ago."""
+    directory = os.path.join(root, str(int(test_id)))
+    keep = f"v{_read_current(root, test_id)}.qms"
+    cutoff = time.time() - SNAPSHOT_RETAIN
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith(".qms") or name == keep:
+            continue
+        try:
+            if os.stat(os.path.join(directory, name)).st_mtime < cutoff:
+                os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def unpublish(test_ids):
+    """Send new exams of these tests back to the live database; attempts
+    that pinned a version keep it until it is pruned."""
+    ids = [int(t) for t in test_ids]
+    root = snapshot_dir()
+    with db.transaction() as conn:
+        conn.executemany(UNPUBLISH_SQL, [(t,) for t in ids])
+    for t in ids:
+        current = _read_current(root, t)
+        try:
+            os.remove(_current_path(root, t))
+        except FileNotFoundError:
+            pass
+        _retire(root, t, current)
+        _prune(root, t)
+
+
+def remove_files(test_ids):
+    """Delete every version of (deleted) tests at once."""
+    root = snapshot_dir()
+    for t in test_ids:
+        # CURRENT first: readers stop picking the snapshot before its files go
+        try:
+            os.remove(_current_path(root, t))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(os.path.join(root, str(int(t))), ignore_errors=True)
+
+
+def status(test_id):
+    """(version, sha256, questions, published_at) of the published snapshot, or None."""
+    rows = db.query(STATUS_SQL, (int(test_id),))
+    return rows[0] if rows else None
+
+
+class SnapshotStore:
+    """Process-wide cache of loaded snapshots under one root directory."""
+
+    def __init__(self, root, check_interval=SNAPSHOT_CHECK, maxsize=SNAPSHOT_CACHE):
+        self.root = root
+        self.check_interval = check_interval
+        self.maxsize = maxsize
+        self._loaded = OrderedDict()   # (test_id, version) -> Snapshot
+        self._current = {}             # test_id -> (version or None, checked at, stat key)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "checks": 0, "loads": 0, "swaps": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _current_version(self, test_id):
+        now = time.monotonic()
+        version, checked, stat_key = self._current.get(test_id, (None, -1e9, None))
+        if now - checked < self.check_interval:
+            return version
+        self._count("checks")
+        try:
+            info = os.stat(_current_path(self.root, test_id))
+            new_key = (info.st_ino, info.st_mtime_ns, info.st_size)
+        except FileNotFoundError:
+            new_key = None
+        if new_key != stat_key:
+            new_version = _read_current(self.root, test_id) if new_key else None
+            if version is not None and new_version != version:
+                self._count("swaps")
+            version, stat_key = new_version, new_key
+        # one tuple assignment: readers see the old or the new entry
+        self._current[test_id] = (version, now, stat_key)
+        return version
+
+    def get(self, test_id, version=None):
+        """Current (or the given) snapshot of a test, or None if it has none."""
+        test_id = int(test_id)
+        if version is None:
+            version = self._current_version(test_id)
+            if version is None:
+                return None
+        snap = self._loaded.get((test_id, version))
+        if snap is not None:
+            self._count("hits")
+            return snap
+        with self._lock:
+            snap = self._loaded.get((test_id, version))
+            if snap is not None:
+                return snap
+            try:
+                with open(_path(self.root, test_id, version), "rb") as f:
+                    snap = Snapshot(decode(f.read()))
+            except (OSError, ValueError):
+                self._stats["errors"] += 1
+                return None
+            self._stats["loads"] += 1
+            self._loaded[(test_id, version)] = snap
+            while len(self._loaded) > self.maxsize:
+                self._loaded.popitem(last=False)
+        return snap
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["loaded"] = len(self._loaded)
+        return out
+
+
+# root -> SnapshotStore. A plain dict rather than st.cache_resource: this
+# runs on every exam rerun and a dict lookup is the cheaper guard.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    root = snapshot_dir()
+    store = _stores.get(root)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(root, SnapshotStore(root))
+    return store
+
+
+def get(test_id, version=None):
+    return get_store().get(test_id, version)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Снимки тестов для экзаменов")
+    parser.add_argument("--db", help="путь к БД (по умолчанию data/questions.db)")
+    parser.add_argument("command", choices=("publish", "unpublish"))
+    parser.add_argument("test_ids", nargs="+", type=int)
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.use_database(args.db)
+    migrations.migrate()
+
+    if args.command == "unpublish":
+        unpublish(args.test_ids)
+        print(f"Снято с публикации: {len(args.test_ids)}")
+        return 0
+    failed = 0
+    for test_id in args.test_ids:
+        try:
+            snap = publish(test_id)
+        except ValueError as exc:
+            print(f"тест {test_id}: {exc}", file=sys.stderr)
+            failed += 1
+            continue
+        print(f"тест {test_id}: версия {snap.version}, вопросов {len(snap)}, "
+              f"{os.path.getsize(_path(snapshot_dir(), test_id, snap.version))} байт")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
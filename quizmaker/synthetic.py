@@ -0,0 +1,127 @@
+"""Synthetic databases with the app schema, for benchmarks and plan checks.
+
+All rows are generated inside SQLite with recursive CTEs, so even
+10^6 questions or 10^7 scores take seconds to minutes rather than hours.
+
+    python -m quizmaker.synthetic /tmp/big.db --questions 1000000 --scores 10000000
+"""
+import argparse
+import os
+import sys
+import time
+
+from quizmaker import catalog, db, leaderboard, migrations
+
+DEFAULTS = {
+    "questions": 10000,
+    "tests": 1000,
+    "questions_per_test": 20,
+    "scores": 100000,
+    "users": 5000,
+    "tags": 50,
+    "days": 30,
+}
+
+TYPES = ("Один ответ", "Множественный выбор", "Текстовый ответ")
+
+
+def _numbers(n):
+    return f"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {int(n)})"
+
+
+def populate(conn, questions=DEFAULTS["questions"], tests=DEFAULTS["tests"],
+             questions_per_test=DEFAULTS["questions_per_test"], scores=DEFAULTS["scores"],
+             users=DEFAULTS["users"], tags=DEFAULTS["tags"], days=DEFAULTS["days"]):
+    """Append synthetic rows to an empty database; call inside a write transaction."""
+    conn.execute(f"""
+        {_numbers(questions)}
+        INSERT INTO questions (text, type, points, tags)
+        SELECT 'Вопрос номер ' || i || ' про тему ' || (i % {tags}),
+               CASE i % 3 WHEN 0 THEN '{TYPES[0]}' WHEN 1 THEN '{TYPES[1]}' ELSE '{TYPES[2]}' END,
+               1 + i % 5, 'tag' || (i % {tags})
+          FROM n
+    """)
+    # choice questions: 4 options, option 0 (and 1 for multi) correct;
+    # text questions: a single accepted answer
+    conn.execute(f"""
+        INSERT INTO question_choices (question_id, ordinal, text, is_correct)
+        SELECT q.id, o.k, 'вариант ' || o.k,
+               o.k = 0 OR (o.k = 1 AND q.type = '{TYPES[1]}')
+          FROM questions q,
+               (SELECT 0 AS k UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3) o
+         WHERE q.type <> '{TYPES[2]}'
+        UNION ALL
+        SELECT id, 0, 'ответ ' || id, 1 FROM questions WHERE type = '{TYPES[2]}'
+    """)
+    conn.execute(f"""
+        {_numbers(tests)}
+        INSERT INTO tests (name, description, tags)
+        SELECT 'Тест ' || i, 'Описание теста ' || i || ' по теме ' || (i % {tags}),
+               'tag' || (i % {tags}) || ',tag' || ((i * 7) % {tags})
+          FROM n
+    """)
+    conn.execute(f"""
+        INSERT INTO test_tags (tag, test_id)
+        SELECT 'tag' || (id % {tags}), id FROM tests
+        UNION SELECT 'tag' || ((id * 7) % {tags}), id FROM tests
+    """)
+    conn.execute(f"""
+        {_numbers(questions_per_test)}
+        INSERT OR IGNORE INTO test_questions (test_id, question_id, position)
+        SELECT t.id, 1 + (t.id * 37 + n.i * 101) % {questions}, n.i FROM tests t, n
+    """)
+
+    # bulk scores without firing the leaderboard triggers row by row,
+    # then rebuild the aggregates in one pass
+    triggers = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='trigger' AND tbl_name='scores'"
+    ).fetchall()
+    for name, _sql in triggers:
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.execute(f"""
+        {_numbers(scores)}
+        INSERT INTO scores (user, score, test_id, timestamp)
+        SELECT 'user' || (i % {users}), i % 10, 1 + i % {tests},
+               datetime('now', '-' || (i % {days}) || ' days', '-' || (i % 86400) || ' seconds')
+          FROM n
+    """)
+    for _name, sql in triggers:
+        conn.execute(sql)
+    leaderboard.rebuild(conn)
+
+
+def generate(path, **sizes):
+    """Create a fresh database at `path`, fill it and make it the active one."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db.use_database(path)
+    catalog.invalidate()
+    migrations.migrate()
+    with db.transaction() as conn:
+        populate(conn, **sizes)
+    catalog.invalidate()
+
+
+def add_size_arguments(parser):
+    for name, default in DEFAULTS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=int, default=default)
+
+
+def sizes_from_args(args):
+    return {name: getattr(args, name) for name in DEFAULTS}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сгенерировать синтетическую БД")
+    parser.add_argument("path")
+    add_size_arguments(parser)
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    generate(args.path, **sizes_from_args(args))
+    print(f"{args.path}: {time.perf_counter() - started:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
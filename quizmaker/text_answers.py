@@ -0,0 +1,223 @@
+"""Matching of free-text answers ("Текстовый ответ").
+
+Every accepted answer of a question (its is_correct rows) is an
+alternative. Before comparing, the given answer and the alternatives are
+normalized: Unicode NFKC, ё → е, case folding, punctuation dropped and
+whitespace collapsed. questions.answer_rules (JSON, NULL = defaults)
+adjusts this per question:
+
+    case_sensitive      keep letter case (default false)
+    ignore_punctuation  drop punctuation before comparing (default true)
+    max_distance        accept alternatives within this many edits
+                        (insert/delete/replace a character), default 0
+    patterns            regular expressions; an answer that fully matches
+                        one of them is accepted (matched against the answer
+                        with whitespace collapsed, case-insensitive unless
+                        case_sensitive)
+
+compile_matcher() turns (alternatives, rules) into a Matcher — normalized
+alternative set, compiled patterns — and keeps it in an LRU cache keyed by
+that content, so a question is compiled again only when its answers or
+rules change. A check is a set lookup; only on a miss are the patterns
+tried and then the edit distance, which is bounded: bounded_levenshtein()
+gives up as soon as the distance must exceed max_distance.
+"""
+import json
+import logging
+import re
+import unicodedata
+from functools import lru_cache
+
+DEFAULT_RULES = {
+    "case_sensitive": False,
+    "ignore_punctuation": True,
+    "max_distance": 0,
+    "patterns": [],
+}
+MAX_DISTANCE = 5
+MATCHER_CACHE = 4096   # compiled questions kept per process
+
+log = logging.getLogger(__name__)
+
+_SPACE = re.compile(r"\s+")
+
+
+class _PunctuationTable(dict):
+    """str.translate table mapping Unicode punctuation (categories P*) to a
+    space; filled per character on first sight instead of at import."""
+
+    def __missing__(self, cp):
+        self[cp] = " " if unicodedata.category(chr(cp)).startswith("P") else cp
+        return self[cp]
+
+
+_PUNCTUATION = _PunctuationTable()
+_YO = str.maketrans("ёЁ", "еЕ")
+
+
+def parse_rules(rules):
+    """answer_rules column (JSON text, dict or None) -> complete rules dict.
+
+    Raises ValueError for malformed rules; see validate_rules().
+    """
+    if not rules:
+        return dict(DEFAULT_RULES)
+    if isinstance(rules, str):
+        try:
+            rules = json.loads(rules)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"Правила проверки — не JSON: {exc}") from None
+    if not isinstance(rules, dict):
+        raise ValueError("Правила проверки должны быть JSON-объектом.")
+    unknown = set(rules) - set(DEFAULT_RULES)
+    if unknown:
+        raise ValueError(f"Неизвестные правила проверки: {', '.join(sorted(unknown))}")
+    out = dict(DEFAULT_RULES, **rules)
+    distance = out["max_distance"]
+    if not isinstance(distance, int) or isinstance(distance, bool) \
+            or not 0 <= distance <= MAX_DISTANCE:
+        raise ValueError(f"max_distance должно быть целым от 0 до {MAX_DISTANCE}.")
+    if isinstance(out["patterns"], str):
+        out["patterns"] = [out["patterns"]]
+    out["patterns"] = [p for p in out["patterns"] if p]
+    for p in out["patterns"]:
+        try:
+            re.compile(p)
+        except re.error as exc:
+            raise ValueError(f"Неверное регулярное выражение {p!r}: {exc}") from None
+    out["case_sensitive"] = bool(out["case_sensitive"])
+    out["ignore_punctuation"] = bool(out["ignore_punctuation"])
+    return out
+
+
+def validate_rules(rules):
+    """Error message for malformed rules, or None."""
+    try:
+        parse_rules(rules)
+    except ValueError as exc:
+        return str(exc)
+    return None
+
+
+def dump_rules(rules):
+    """Rules as stored in questions.answer_rules: only non-defaults, None if none."""
+    rules = parse_rules(rules)
+    changed = {k: v for k, v in rules.items() if v != DEFAULT_RULES[k]}
+    return json.dumps(changed, ensure_ascii=False, sort_keys=True) if changed else None
+
+
+def _collapse(text):
+    return _SPACE.sub(" ", unicodedata.normalize("NFKC", str(text)).translate(_YO)).strip()
+
+
+def normalize(text, case_sensitive=False, ignore_punctuation=True):
+    text = unicodedata.normalize("NFKC", str(text)).translate(_YO)
+    if not case_sensitive:
+        text = text.casefold()
+    if ignore_punctuation:
+        text = text.translate(_PUNCTUATION)
+    return _SPACE.sub(" ", text).strip()
+
+
+def bounded_levenshtein(a, b, limit):
+    """Edit distance of a and b if it is at most `limit`, else limit + 1.
+
+    Only the diagonal band |i - j| <= limit of the DP table is filled, and
+    the loop stops once a whole row exceeds the limit: O(limit * len).
+    """
+    if a == b:
+        return 0
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > limit:
+        return limit + 1
+    # common prefix and suffix do not change the distance
+    start = 0
+    while start < len(a) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    if not a:
+        return len(b) if len(b) <= limit else limit + 1
+
+    over = limit + 1
+    n = len(b)
+    prev = list(range(n + 1))
+    for i in range(1, len(a) + 1):
+        lo, hi = max(1, i - limit), min(n, i + limit)
+        cur = [over] * (n + 1)
+        cur[0] = i if i <= limit else over
+        ca = a[i - 1]
+        best = cur[0]
+        for j in range(lo, hi + 1):
+            cost = prev[j - 1] + (ca != b[j - 1])
+            if prev[j] + 1 < cost:
+                cost = prev[j] + 1
+            if cur[j - 1] + 1 < cost:
+                cost = cur[j - 1] + 1
+            cur[j] = cost if cost < over else over
+            if cost < best:
+                best = cost
+        if best > limit:
+            return over
+        prev = cur
+    return prev[n] if prev[n] <= limit else over
+
+
+class Matcher:
+    """Compiled check of one text question: matcher(answer) -> bool."""
+
+    def __init__(self, alternatives, rules):
+        self.case_sensitive = rules["case_sensitive"]
+        self.ignore_punctuation = rules["ignore_punctuation"]
+        self.max_distance = rules["max_distance"]
+        self.exact = frozenset(filter(None, (self.normalize(a) for a in alternatives)))
+        flags = 0 if self.case_sensitive else re.IGNORECASE
+        self.patterns = tuple(re.compile(p, flags) for p in rules["patterns"])
+
+    def normalize(self, text):
+        return normalize(text, self.case_sensitive, self.ignore_punctuation)
+
+    def __call__(self, answer):
+        if answer is None:
+            return False
+        given = self.normalize(answer)
+        if not given:
+            return False
+        if given in self.exact:
+            return True
+        if self.patterns:
+            raw = _collapse(answer)
+            if any(p.fullmatch(raw) for p in self.patterns):
+                return True
+        k = self.max_distance
+        if k:
+            return any(
+                abs(len(alt) - len(given)) <= k and bounded_levenshtein(given, alt, k) <= k
+                for alt in self.exact
+            )
+        return False
+
+
+@lru_cache(maxsize=MATCHER_CACHE)
+def _compile(alternatives, rules):
+    try:
+        parsed = parse_rules(rules)
+    except ValueError as exc:
+        # written around validate_rules (e.g. edited in the database): grade exactly
+        log.warning("Правила проверки проигнорированы: %s", exc)
+        parsed = dict(DEFAULT_RULES)
+    return Matcher(alternatives, parsed)
+
+
+def compile_matcher(alternatives, rules=None):
+    """Matcher for the accepted answers and answer_rules of a question."""
+    return _compile(tuple(alternatives), rules or None)
+
+
+def cache_stats():
+    info = _compile.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
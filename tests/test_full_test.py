@@ -0,0 +1,55 @@
+"""take_full_test_page rendered headlessly with AppTest."""
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from quizmaker import db, score_writer, synthetic
+
+APP_PATH = os.path.join(db.PROJECT_ROOT, "app.py")
+
+
+@pytest.fixture
+def app(tmp_path):
+    synthetic.generate(str(tmp_path / "app.db"), questions=50, tests=2,
+                       questions_per_test=5, scores=0)
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.run()
+    at.sidebar.radio[0].set_value("Пройти тест").run()
+    yield at
+    db.get_pool().close()
+
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def _select_test(at, n):
+    box = next(b for b in at.selectbox if b.label == "Выберите тест")
+    box.set_value(box.options[n]).run()
+
+
+def _grade_and_save(at, user):
+    _button(at, "Отправить все ответы").click().run()
+    at.text_input(key="fulltest_user").set_value(user).run()
+    _button(at, "Сохранить результат").click().run()
+    assert not at.exception
+
+
+def test_graded_attempt_is_saved_after_switching_tests(app):
+    _button(app, "Отправить все ответы").click().run()
+    _select_test(app, 1)
+    app.text_input(key="fulltest_user").set_value("Ann").run()
+    _button(app, "Сохранить результат").click().run()
+    assert "Результат сохранён!" in [s.value for s in app.success]
+
+    _grade_and_save(app, "Bob")
+    score_writer.get_writer().flush()
+
+    tests = [t for t, in db.query("SELECT id FROM tests ORDER BY id")]
+    scores = db.query("SELECT user, test_id, token FROM scores WHERE token IS NOT NULL ORDER BY user")
+    assert [(user, test_id) for user, test_id, _ in scores] == [
+        ("Ann", tests[0]), ("Bob", tests[1]),
+    ]
+    attempts = db.query("SELECT test_id, token FROM attempts ORDER BY test_id")
+    assert [(t, token) for _, t, token in scores] == attempts
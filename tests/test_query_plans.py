@@ -0,0 +1,10 @@
+"""Query-plan regression check (see quizmaker.query_plans) as a test."""
+from quizmaker import query_plans
+
+# smaller than query_plans.SEED_SIZES: without ANALYZE the planner does not
+# look at table sizes, so the plans are the same and the test stays quick
+SIZES = {"questions": 5000, "tests": 500, "questions_per_test": 20, "scores": 20000}
+
+
+def test_no_unexpected_full_scans(tmp_path):
+    assert query_plans.run(str(tmp_path), SIZES) == {}